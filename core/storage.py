@@ -0,0 +1,182 @@
+"""
+Document storage backends.
+
+All document access (uploads, the extraction pipeline, media serving) goes
+through Django's storage API so extraction workers do not need to share a
+filesystem with the web host:
+
+- ShardedFileSystemStorage: local MEDIA_ROOT with a hashed two-level
+  directory layout so no single folder grows unbounded.
+- S3CompatibleStorage: any S3 API (AWS, MinIO, Ceph RGW, ...). Use a local
+  MinIO container as a stand-in for testing.
+
+Select the backend with STORAGES['default'] in settings.py.
+"""
+
+import contextlib
+import hashlib
+import os
+import posixpath
+import shutil
+import tempfile
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage, Storage
+from django.utils.deconstruct import deconstructible
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+    ClientError = None
+
+
+def shard_name(name, levels=2):
+    """
+    Insert hashed shard directories in front of the file name:
+    submissions/2025/01/02/inv.pdf -> submissions/2025/01/02/3f/a9/inv.pdf
+    """
+    dirname, basename = posixpath.split(name)
+    digest = hashlib.sha1(f"{uuid.uuid4().hex}{basename}".encode()).hexdigest()
+    shards = [digest[i * 2:i * 2 + 2] for i in range(levels)]
+    return posixpath.join(dirname, *shards, basename)
+
+
+@deconstructible
+class ShardedFileSystemStorage(FileSystemStorage):
+    """Local filesystem storage with a hashed directory layout for new uploads."""
+
+    def __init__(self, *args, shard_levels=2, **kwargs):
+        self.shard_levels = shard_levels
+        super().__init__(*args, **kwargs)
+
+    def generate_filename(self, filename):
+        return super().generate_filename(shard_name(filename.replace('\\', '/'), self.shard_levels))
+
+
+@deconstructible
+class S3CompatibleStorage(Storage):
+    """
+    Minimal S3-compatible backend (requires boto3).
+
+    OPTIONS: bucket_name, endpoint_url, access_key, secret_key, region_name,
+    location (key prefix), shard_levels, querystring_expire.
+    """
+
+    def __init__(self, bucket_name=None, endpoint_url=None, access_key=None, secret_key=None,
+                 region_name=None, location='', shard_levels=2, querystring_expire=3600):
+        if boto3 is None:
+            raise ImproperlyConfigured("S3CompatibleStorage requires boto3 (pip install boto3)")
+        if not bucket_name:
+            raise ImproperlyConfigured("S3CompatibleStorage requires a bucket_name")
+        self.bucket_name = bucket_name
+        self.endpoint_url = endpoint_url
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region_name = region_name
+        self.location = location.strip('/')
+        self.shard_levels = shard_levels
+        self.querystring_expire = querystring_expire
+        self._client = None
+
+    @property
+    def client(self):
+        # boto3 clients are thread-safe; create lazily so settings import stays cheap
+        if self._client is None:
+            self._client = boto3.client(
+                's3',
+                endpoint_url=self.endpoint_url,
+                aws_access_key_id=self.access_key,
+                aws_secret_access_key=self.secret_key,
+                region_name=self.region_name,
+            )
+        return self._client
+
+    def _key(self, name):
+        name = name.replace('\\', '/').lstrip('/')
+        return f"{self.location}/{name}" if self.location else name
+
+    def _open(self, name, mode='rb'):
+        if 'w' in mode or 'a' in mode:
+            raise ValueError("S3CompatibleStorage files are read-only once saved")
+        spool = tempfile.SpooledTemporaryFile(max_size=10 * 1024 * 1024)
+        self.client.download_fileobj(self.bucket_name, self._key(name), spool)
+        spool.seek(0)
+        return File(spool, name=name)
+
+    def _save(self, name, content):
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        self.client.upload_fileobj(content, self.bucket_name, self._key(name))
+        return name
+
+    def generate_filename(self, filename):
+        return super().generate_filename(shard_name(filename.replace('\\', '/'), self.shard_levels))
+
+    def _head(self, name):
+        return self.client.head_object(Bucket=self.bucket_name, Key=self._key(name))
+
+    def exists(self, name):
+        try:
+            self._head(name)
+            return True
+        except ClientError:
+            return False
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket_name, Key=self._key(name))
+
+    def size(self, name):
+        return self._head(name)['ContentLength']
+
+    def get_modified_time(self, name):
+        return self._head(name)['LastModified']
+
+    def etag(self, name):
+        """The object's ETag (unquoted), read from its metadata."""
+        return self._head(name)['ETag'].strip('"')
+
+    def url(self, name):
+        # Documents are served through the access-controlled media view
+        return posixpath.join(settings.MEDIA_URL.rstrip('/') or '/', name.lstrip('/'))
+
+    def presigned_url(self, name):
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket_name, 'Key': self._key(name)},
+            ExpiresIn=self.querystring_expire,
+        )
+
+
+@contextlib.contextmanager
+def local_copy(field_file):
+    """
+    Yield a local filesystem path for a stored file.
+
+    Local backends yield the real path; remote backends download the object
+    to a temporary file (same extension, so type sniffing keeps working)
+    which is removed afterwards.
+    """
+    try:
+        path = field_file.path
+    except NotImplementedError:
+        path = None
+    if path:
+        yield path
+        return
+
+    suffix = os.path.splitext(field_file.name)[1]
+    handle, temp_path = tempfile.mkstemp(suffix=suffix, prefix='doc_')
+    try:
+        with os.fdopen(handle, 'wb') as out, field_file.storage.open(field_file.name, 'rb') as src:
+            shutil.copyfileobj(src, out, 1024 * 1024)
+        yield temp_path
+    finally:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
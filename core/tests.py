@@ -1,3 +1,86 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase
+
+from core import views
+
+
+class ServeMediaTests(SimpleTestCase):
+    content = bytes(range(256)) * 4
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.storage = FileSystemStorage(location=root)
+        self.storage.save('docs/inv.pdf', ContentFile(self.content))
+        for target, value in (('default_storage', self.storage), ('_user_can_access', lambda user, name: True)):
+            patcher = mock.patch.object(views, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        views._etag_cache.clear()
+
+    def get(self, path='docs/inv.pdf', **headers):
+        request = RequestFactory().get('/media/' + path, **headers)
+        request.user = mock.Mock(is_authenticated=True)
+        return views.serve_media(request, path)
+
+    def test_full_file_with_validators(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertTrue(response['ETag'].startswith('"'))
+
+    def test_byte_ranges(self):
+        response = self.get(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+
+        response = self.get(HTTP_RANGE='bytes=-4')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-4:])
+
+        response = self.get(HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_if_range_mismatch_serves_whole_file(self):
+        response = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_conditional_get(self):
+        etag = self.get()['ETag']
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_access_checked_before_existence(self):
+        with mock.patch.object(views, '_user_can_access', return_value=False):
+            self.assertEqual(self.get().status_code, 403)
+            self.assertEqual(self.get('docs/missing.pdf').status_code, 403)
+        with self.assertRaises(Http404):
+            self.get('docs/missing.pdf')
+        with self.assertRaises(Http404):
+            self.get('../settings.py')
+
+    def test_etag_cache_is_bounded(self):
+        for i in range(5):
+            self.storage.save(f'docs/{i}.pdf', ContentFile(b'%d' % i))
+        with mock.patch.object(views, '_ETAG_CACHE_SIZE', 3):
+            for i in range(5):
+                self.get(f'docs/{i}.pdf')
+        self.assertEqual(list(views._etag_cache), ['docs/2.pdf', 'docs/3.pdf', 'docs/4.pdf'])
+
+    def test_storage_etag_is_used_without_reading_the_file(self):
+        self.storage.etag = lambda name: 'abc123'
+        with mock.patch.object(self.storage, 'open', wraps=self.storage.open) as opened:
+            response = self.get(HTTP_IF_NONE_MATCH='"abc123"')
+        self.assertEqual(response.status_code, 304)
+        opened.assert_not_called()
@@ -1,5 +1,21 @@
+import collections
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+import threading
+
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse,
+)
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+
 
 def home(request):
     if request.user.is_authenticated:
@@ -14,3 +30,202 @@ def dashboard_redirect(request):
     else:
         # Default to vendor dashboard
         return redirect('vendors:dashboard')
+
+
+# ============================================================================
+# PROTECTED MEDIA SERVING (Range / ETag / 304 / X-Accel-Redirect)
+# ============================================================================
+
+# LRU cache of content-hash ETags keyed by storage name -> (mtime, size, etag)
+_etag_cache = collections.OrderedDict()
+_etag_lock = threading.Lock()
+_ETAG_CACHE_SIZE = 4096
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+_CHUNK_SIZE = 64 * 1024
+
+
+def _content_etag(name, mtime, size):
+    """
+    Strong ETag for the stored file: the backend's own ETag when it keeps one
+    (S3 returns it with the object metadata, no download needed), else the
+    SHA-256 of the content, cached until the file changes.
+    """
+    storage_etag = getattr(default_storage, 'etag', None)
+    if storage_etag:
+        return quote_etag(storage_etag(name))
+
+    key = (mtime, size)
+    with _etag_lock:
+        cached = _etag_cache.get(name)
+        if cached and cached[:2] == key:
+            _etag_cache.move_to_end(name)
+            return cached[2]
+
+    digest = hashlib.sha256()
+    with default_storage.open(name, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    etag = quote_etag(digest.hexdigest()[:32])
+
+    with _etag_lock:
+        _etag_cache[name] = key + (etag,)
+        _etag_cache.move_to_end(name)
+        while len(_etag_cache) > _ETAG_CACHE_SIZE:
+            _etag_cache.popitem(last=False)
+    return etag
+
+
+def _local_path(name):
+    try:
+        return default_storage.path(name)
+    except NotImplementedError:
+        return None
+
+
+def _user_can_access(user, name):
+    """Finance users see every document; vendors only their own submissions."""
+    if user.user_type == 'finance' or user.is_superuser:
+        return True
+    from vendors.models import SubmissionDocument
+    return SubmissionDocument.objects.filter(file=name, submission__vendor=user).exists()
+
+
+def _not_modified(request, etag, mtime):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag in etags
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(mtime) <= if_modified_since
+
+
+def _parse_range(request, size, etag, mtime):
+    """
+    Return (start, end) for a satisfiable single byte range, None to serve the
+    whole file, or False when the range cannot be satisfied.
+    """
+    header = request.META.get('HTTP_RANGE', '').strip()
+    if not header:
+        return None
+
+    # If-Range: only honour the range if the representation is unchanged
+    if_range = request.META.get('HTTP_IF_RANGE', '').strip()
+    if if_range:
+        if if_range.startswith(('"', 'W/')):
+            if if_range != etag:
+                return None
+        else:
+            if_range_date = parse_http_date_safe(if_range)
+            if if_range_date is None or int(mtime) > if_range_date:
+                return None
+
+    match = _RANGE_RE.match(header.replace(' ', ''))
+    if not match:
+        # Multi-range or malformed requests get the full body
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+def _file_range_iterator(name, start, length):
+    with default_storage.open(name, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+@login_required
+def serve_media(request, path):
+    """
+    Access-controlled media view with HTTP byte ranges, strong ETags and
+    conditional GET. Files are read through the configured storage backend.
+    When MEDIA_ACCEL_REDIRECT is set the transfer itself is handed off to the
+    front web server (nginx X-Accel-Redirect / Apache X-Sendfile).
+    """
+    name = posixpath.normpath(path.replace('\\', '/')).lstrip('/')
+    if name.startswith('..'):
+        raise Http404('Invalid path')
+
+    # Check access before existence so other users cannot probe which files exist
+    if not _user_can_access(request.user, name):
+        return HttpResponse('Access denied', status=403)
+    try:
+        if not default_storage.exists(name):
+            raise Http404('File not found')
+    except SuspiciousFileOperation:
+        raise Http404('Invalid path')
+
+    size = default_storage.size(name)
+    mtime = default_storage.get_modified_time(name).timestamp()
+    etag = _content_etag(name, mtime, size)
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    common_headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(mtime),
+        'Cache-Control': 'private, no-cache',
+        'Accept-Ranges': 'bytes',
+    }
+
+    if _not_modified(request, etag, mtime):
+        response = HttpResponseNotModified()
+        for header, value in common_headers.items():
+            response[header] = value
+        return response
+
+    accel = getattr(settings, 'MEDIA_ACCEL_REDIRECT', None)
+    local_path = _local_path(name)
+    if accel and local_path:
+        # Front server handles ranges and the byte transfer itself
+        response = HttpResponse(content_type=content_type)
+        if accel == 'x-sendfile':
+            response['X-Sendfile'] = local_path
+        else:
+            prefix = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
+            response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + name
+        for header, value in common_headers.items():
+            response[header] = value
+        return response
+
+    byte_range = _parse_range(request, size, etag, mtime)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if byte_range is None:
+        response = FileResponse(default_storage.open(name, 'rb'), content_type=content_type)
+        response['Content-Length'] = str(size)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            _file_range_iterator(name, start, length),
+            status=206,
+            content_type=content_type,
+        )
+        response['Content-Length'] = str(length)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    for header, value in common_headers.items():
+        response[header] = value
+    response['Content-Disposition'] = 'inline; filename="%s"' % os.path.basename(name)
+    return response
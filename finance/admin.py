@@ -1,20 +1,28 @@
 from django.contrib import admin
-from .models import ExtractionTask
+from .models import ExtractionTask, VendorTemplate
 
 @admin.register(ExtractionTask)
 class ExtractionTaskAdmin(admin.ModelAdmin):
-    list_display = ('submission', 'status', 'model_used', 'processing_time', 'created_at')
-    list_filter = ('status', 'model_used', 'created_at')
+    list_display = ('submission', 'status', 'model_used', 'escalated', 'processing_time', 'created_at')
+    list_filter = ('status', 'model_used', 'escalated', 'created_at')
     readonly_fields = ('created_at', 'updated_at')
     
     fieldsets = (
         ('Task Information', {
-            'fields': ('submission', 'status', 'model_used')
+            'fields': ('submission', 'status', 'model_used', 'initial_model', 'escalated')
         }),
         ('Results', {
-            'fields': ('extracted_data', 'error_log', 'processing_time')
+            'fields': ('extracted_data', 'error_log', 'processing_time', 'extraction_metrics')
         }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at')
         }),
     )
+
+
+@admin.register(VendorTemplate)
+class VendorTemplateAdmin(admin.ModelAdmin):
+    list_display = ('vendor_name', 'vendor_key', 'samples', 'hits', 'fallbacks', 'hit_rate', 'enabled', 'updated_at')
+    list_filter = ('enabled',)
+    search_fields = ('vendor_name', 'vendor_key')
+    readonly_fields = ('created_at', 'updated_at')
@@ -1,6 +1,30 @@
+import os
+import sys
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class FinanceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'finance'
+
+    def ready(self):
+        # Only processes explicitly started as background workers warm models and
+        # load the TRN index (FINANCE_BACKGROUND_WORKERS=1): importing the app in a
+        # script, test run or task worker must not call Ollama or Oracle.
+        if not getattr(settings, 'FINANCE_BACKGROUND_WORKERS', False):
+            return
+        warmup = getattr(settings, 'OLLAMA_WARMUP_ON_STARTUP', False)
+        preload = getattr(settings, 'TRN_INDEX_PRELOAD', False)
+        if not (warmup or preload):
+            return
+        # Even then: not migrate, shell, etc. and not runserver's autoreloader parent process.
+        if os.path.basename(sys.argv[0]) == 'manage.py':
+            if sys.argv[1:2] != ['runserver'] or os.environ.get('RUN_MAIN') != 'true':
+                return
+        from .services.ollama_service import ORACLE_DSN, model_warmer, trn_index
+        if warmup:
+            model_warmer.start()
+        if preload and ORACLE_DSN:
+            trn_index.start()
@@ -0,0 +1,158 @@
+import json
+import random
+import re
+import string
+import time
+
+from django.core.management.base import BaseCommand
+from finance.services.json_stream import repair_json
+
+
+def legacy_parse(text):
+    """The original cleanup: strip fences, parse, retry with escaped backslashes, clean keys."""
+    text = text.strip()
+    if text.startswith("```json"):
+        text = text[7:].strip()
+    if text.startswith("```"):
+        text = text[3:].strip()
+    if text.endswith("```"):
+        text = text[:-3].strip()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        data = json.loads(re.sub(r'\\(?!["\\/bfnrtu])', r'\\\\', text))
+
+    def clean_json_keys(data):
+        if isinstance(data, dict):
+            return {k.replace('\\', ''): clean_json_keys(v) for k, v in data.items()}
+        if isinstance(data, list):
+            return [clean_json_keys(item) for item in data]
+        return data
+
+    return clean_json_keys(data)
+
+
+def synthetic_invoice(rng, items):
+    word = lambda: ''.join(rng.choice(string.ascii_letters) for _ in range(rng.randint(3, 9)))
+    return {
+        "Invoice_No": f"INV-{rng.randint(1000, 99999)}",
+        "Invoice_Date": f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2025",
+        "PO_Number": f"ATCPO2501{rng.randint(0, 9999):04d}",
+        "Vendor_Name": f"{word()} {word()} LLC",
+        "Customer_Name": f"{word()} Trading",
+        "Subtotal": f"{rng.uniform(10, 99999):.2f}",
+        "Total": f"{rng.uniform(10, 99999):.2f}",
+        "Items": [
+            {
+                "Item_No": str(n + 1),
+                "Item_Description": ' '.join(word() for _ in range(rng.randint(1, 6))),
+                "Quantity": str(rng.randint(1, 500)),
+                "Unit": rng.choice(["PCS", "KG", "BOX", ""]),
+                "Unit_Price": f"{rng.uniform(0.1, 999):.3f}",
+                "Amount": f"{rng.uniform(1, 9999):.3f}",
+            }
+            for n in range(items)
+        ],
+    }
+
+
+def defects(rng, data):
+    """(label, text, expected value) variants of one extraction as models emit them."""
+    clean = json.dumps(data, indent=rng.choice([None, 2]))
+    yield 'clean', clean, data
+    yield 'fenced', f"```json\n{clean}\n```", data
+    yield 'escaped_underscore', clean.replace('_', '\\_'), data
+    yield 'backslashed_key', clean.replace('"Invoice_No"', '"Invoice\\\\_No"'), data
+    yield 'trailing_comma', re.sub(r'(["\]}])(\s*[}\]])', r'\1,\2', clean, count=3), data
+
+    path = dict(data, Customer_Name="C:\\Users\\invoices")
+    yield 'invalid_escape', json.dumps(path).replace('\\\\', '\\'), path
+
+    # Cut inside the item list: every complete item must survive
+    if data['Items']:
+        start = clean.index('"Items"')
+        yield 'truncated', clean[:rng.randint(start + 12, len(clean) - 3)], None
+
+
+class Command(BaseCommand):
+    help = 'Fuzz the one-pass JSON repair parser and benchmark it against the original cleanup'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--docs', type=int, default=300, help='Synthetic extractions')
+        parser.add_argument('--items', type=int, default=20, help='Max items per extraction')
+        parser.add_argument('--mutations', type=int, default=20, help='Random corruptions per extraction')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def verify(self, label, text, expected, original):
+        """Problem description, or None when the parse is acceptable."""
+        try:
+            value, repairs = repair_json(text)
+        except json.JSONDecodeError as e:
+            return f'{label}: {e}'
+        if expected is not None:
+            if value != expected:
+                return f'{label}: value differs'
+            if label == 'clean' and repairs:
+                return f'clean: unexpected repairs {repairs}'
+            return None
+        # Truncated: complete items are kept in order, nothing is invented
+        items = value.get('Items', [])
+        if items != original['Items'][:len(items)] or any(value[k] != original[k] for k in value if k != 'Items'):
+            return f'{label}: partial value is not a prefix of the original'
+        return None
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        docs = [synthetic_invoice(rng, rng.randint(0, options['items'])) for _ in range(options['docs'])]
+        cases = [(label, text, expected, doc) for doc in docs for label, text, expected in defects(rng, doc)]
+
+        # Fuzz: every defect repaired correctly
+        failures = [problem for case in cases if (problem := self.verify(*case))]
+
+        # Fuzz: random prefixes and corruptions may fail to parse, but only with JSONDecodeError
+        crashes = 0
+        alphabet = '{}[]",:\\ntu0_ `'
+        for label, text, expected, doc in cases[::7]:
+            for _ in range(options['mutations']):
+                mutated = list(text[:rng.randint(0, len(text))])
+                for _ in range(rng.randint(0, 3)):
+                    if mutated:
+                        mutated[rng.randrange(len(mutated))] = rng.choice(alphabet)
+                try:
+                    repair_json(''.join(mutated))
+                except json.JSONDecodeError:
+                    pass
+                except Exception as e:
+                    crashes += 1
+                    failures.append(f'{label}: {type(e).__name__}: {e}')
+
+        # Benchmark per variant: the original cleanup (and plain json.loads) vs the repair parser
+        def timed(parse, texts):
+            failed = 0
+            start = time.perf_counter()
+            for text in texts:
+                try:
+                    parse(text)
+                except json.JSONDecodeError:
+                    failed += 1
+            return (time.perf_counter() - start) / len(texts) * 1e6, failed
+
+        size = sum(len(case[1]) for case in cases) / len(cases)
+        self.stdout.write(f'\n📊 {len(cases)} outputs ({len(docs)} extractions x up to 7 variants), avg {size:.0f} chars')
+        self.stdout.write(f'   {"variant":20} {"original":>12} {"one-pass":>12}')
+        for variant in dict.fromkeys(case[0] for case in cases):
+            texts = [case[1] for case in cases if case[0] == variant]
+            legacy_micros, legacy_failed = timed(legacy_parse, texts)
+            micros, failed = timed(repair_json, texts)
+            legacy = f'{legacy_micros:7.1f} µs' if not legacy_failed else f'{legacy_failed}/{len(texts)} fail'
+            self.stdout.write(f'   {variant:20} {legacy:>12} {micros:9.1f} µs' + (f'  ({failed} fail)' if failed else ''))
+            if variant == 'clean':
+                self.stdout.write(f'   {"(json.loads)":20} {timed(json.loads, texts)[0]:9.1f} µs')
+        self.stdout.write(f'   Random corruptions tried: {len(cases[::7]) * options["mutations"]}, crashes: {crashes}')
+
+        if failures:
+            for failure in failures[:20]:
+                self.stdout.write(self.style.ERROR(f'   ❌ {failure}'))
+            self.stdout.write(self.style.ERROR(f'\n{len(failures)} failure(s)'))
+        else:
+            self.stdout.write(self.style.SUCCESS('\n✅ Every defect repaired; no unexpected exceptions'))
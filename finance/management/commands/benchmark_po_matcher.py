@@ -0,0 +1,86 @@
+import random
+import re
+import string
+import time
+
+from django.core.management.base import BaseCommand
+from finance.services.ollama_service import PREFIX_MAPPING, PO_PREFIXES, SEARCH_PREFIXES, po_matcher
+
+
+def legacy_find(text):
+    """The original per-prefix loop, kept as the reference implementation."""
+    for prefix in SEARCH_PREFIXES:
+        match = re.search(rf"({prefix}-?\d+)", text, re.IGNORECASE)
+        if match:
+            raw_match = match.group(1).replace("-", "").upper()
+            if prefix in PREFIX_MAPPING:
+                remainder = raw_match[len(prefix):]
+                if remainder.startswith("0"):
+                    remainder = remainder[1:]
+                return PREFIX_MAPPING[prefix] + remainder
+            return raw_match
+    return None
+
+
+def synthetic_text(rng, size):
+    """OCR-like text with a few PO numbers (some with a dash, lower case or O read as 0)."""
+    words = []
+    while sum(len(w) + 1 for w in words) < size:
+        roll = rng.random()
+        if roll < 0.002:
+            prefix = rng.choice(PO_PREFIXES)
+            style = rng.random()
+            if style < 0.3:
+                prefix = prefix[:4] + '0'
+            elif style < 0.5:
+                prefix = prefix + '-'
+            elif style < 0.6:
+                prefix = prefix.lower()
+            words.append(prefix + ''.join(rng.choice(string.digits) for _ in range(8)))
+        elif roll < 0.3:
+            words.append(str(rng.randint(0, 10 ** rng.randint(1, 8))))
+        else:
+            words.append(''.join(rng.choice(string.ascii_letters) for _ in range(rng.randint(2, 9))))
+    return ' '.join(words)
+
+
+class Command(BaseCommand):
+    help = 'Compare the single-pass PO prefix matcher with the original per-prefix regex loop'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--texts', type=int, default=200, help='Synthetic OCR texts')
+        parser.add_argument('--size', type=int, default=4000, help='Characters per text')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        texts = [synthetic_text(rng, options['size']) for _ in range(options['texts'])]
+
+        start = time.perf_counter()
+        legacy = [legacy_find(t) for t in texts]
+        legacy_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        matched = [po_matcher.best(t) for t in texts]
+        matcher_seconds = time.perf_counter() - start
+
+        # Prefixes of equal length were tried in set order by the loop, so only
+        # the prefix length (and that the loop's answer is among the hits) must agree
+        mismatches = 0
+        for text, old, new in zip(texts, legacy, matched):
+            if old == new:
+                continue
+            hits = {h.po for h in po_matcher.ranked(text)}
+            if old not in hits or new is None:
+                mismatches += 1
+                self.stdout.write(self.style.ERROR(f'   ❌ legacy {old!r} vs matcher {new!r}'))
+
+        per_text = lambda seconds: seconds / len(texts) * 1e6
+        self.stdout.write(f'\n📊 {len(texts)} texts x {options["size"]} chars, {len(SEARCH_PREFIXES)} prefixes')
+        self.stdout.write(f'   Per-prefix loop : {per_text(legacy_seconds):9.1f} µs/text')
+        self.stdout.write(f'   Single pass     : {per_text(matcher_seconds):9.1f} µs/text')
+        self.stdout.write(f'   Speed-up        : {legacy_seconds / matcher_seconds:9.1f}x')
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f'\n{mismatches} disagreement(s)'))
+        else:
+            self.stdout.write(self.style.SUCCESS('\n✅ Results agree with the original loop'))
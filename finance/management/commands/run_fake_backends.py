@@ -0,0 +1,86 @@
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from finance.services.fake_backends import (
+    FakeN8nHandler, FakeOllamaHandler, Profile, make_server, seed_oracle,
+)
+from finance.services.ollama_service import OLLAMA_MODEL_TIERS, PO_PREFIXES
+
+
+class Command(BaseCommand):
+    help = 'Run local fake Ollama / n8n servers and a SQLite Axpert database for offline load testing'
+
+    def add_arguments(self, parser):
+        webhook = urlsplit(getattr(settings, 'N8N_WEBHOOK_URL', None) or 'http://localhost:5678/webhook/invoice_extract')
+
+        parser.add_argument('--ollama-port', type=int, default=11435)
+        parser.add_argument('--ollama-latency', type=float, default=2.0, help='Median seconds per generation')
+        parser.add_argument('--ollama-jitter', type=float, default=0.5, help='Log-normal sigma of the latency')
+        parser.add_argument('--ollama-errors', type=float, default=0.0, help='Share of 503 responses')
+        parser.add_argument('--ollama-concurrency', type=int, default=2, help='Generations served in parallel')
+        parser.add_argument('--models', nargs='+', default=list(OLLAMA_MODEL_TIERS))
+
+        parser.add_argument('--n8n-port', type=int, default=webhook.port or 5678)
+        parser.add_argument('--webhook-path', default=webhook.path or '/webhook/invoice_extract')
+        parser.add_argument('--n8n-latency', type=float, default=8.0)
+        parser.add_argument('--n8n-jitter', type=float, default=1.0)
+        parser.add_argument('--n8n-errors', type=float, default=0.05)
+        parser.add_argument('--n8n-concurrency', type=int, default=4)
+
+        parser.add_argument('--oracle-db', default=str(Path(settings.BASE_DIR) / 'fake_axpert.sqlite3'))
+        parser.add_argument('--oracle-latency', type=float, default=0.02, help='Mean seconds per query')
+        parser.add_argument('--oracle-errors', type=float, default=0.0)
+        parser.add_argument('--pos-per-branch', type=int, default=20)
+
+        parser.add_argument('--no-ollama', action='store_true')
+        parser.add_argument('--no-n8n', action='store_true')
+        parser.add_argument('--stats-interval', type=int, default=30, help='Seconds between stats lines (0 = off)')
+        parser.add_argument('--verbose', action='store_true', help='Log every request')
+
+    def handle(self, *args, **options):
+        servers = {}
+
+        if not options['no_ollama']:
+            servers['Ollama'] = make_server(
+                FakeOllamaHandler, options['ollama_port'],
+                Profile(options['ollama_latency'], options['ollama_jitter'], options['ollama_errors'], options['ollama_concurrency']),
+                verbose=options['verbose'], models=options['models'],
+            )
+            self.stdout.write(self.style.SUCCESS(f'🦙 Fake Ollama on http://127.0.0.1:{options["ollama_port"]} ({", ".join(options["models"])})'))
+
+        if not options['no_n8n']:
+            servers['n8n'] = make_server(
+                FakeN8nHandler, options['n8n_port'],
+                Profile(options['n8n_latency'], options['n8n_jitter'], options['n8n_errors'], options['n8n_concurrency']),
+                verbose=options['verbose'], webhook_path=options['webhook_path'],
+            )
+            self.stdout.write(self.style.SUCCESS(f'🔁 Fake n8n webhook on http://127.0.0.1:{options["n8n_port"]}{options["webhook_path"]}'))
+
+        po_count = seed_oracle(options['oracle_db'], PO_PREFIXES, options['pos_per_branch'])
+        dsn = f'sqlite:{options["oracle_db"]}?latency={options["oracle_latency"]}&error_rate={options["oracle_errors"]}'
+        self.stdout.write(self.style.SUCCESS(f'🗄️  Fake Axpert database with {po_count} POs: {options["oracle_db"]}'))
+
+        self.stdout.write('\nPoint the portal at the fakes in settings.py:')
+        if 'Ollama' in servers:
+            self.stdout.write(f'   OLLAMA_BASE_URL = "http://127.0.0.1:{options["ollama_port"]}"')
+        if 'n8n' in servers:
+            self.stdout.write(f'   N8N_WEBHOOK_URL = "http://127.0.0.1:{options["n8n_port"]}{options["webhook_path"]}"')
+        self.stdout.write(f'   ORACLE_DSN = "{dsn}"')
+        self.stdout.write('\nPress Ctrl+C to stop.\n')
+
+        try:
+            while True:
+                time.sleep(options['stats_interval'] or 3600)
+                if options['stats_interval']:
+                    line = '  '.join(
+                        f'{name}: {server.profile.served} served, {server.profile.failed} failed'
+                        for name, server in servers.items()
+                    )
+                    self.stdout.write(f'📊 {line}')
+        except KeyboardInterrupt:
+            for server in servers.values():
+                server.shutdown()
+            self.stdout.write('\n✨ Fake backends stopped.')
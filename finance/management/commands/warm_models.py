@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from finance.services.ollama_service import model_warmer, ollama_pool
+
+
+class Command(BaseCommand):
+    help = 'Pre-load the extraction models on every Ollama endpoint and show their load state'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--status',
+            action='store_true',
+            help='Only show the current load state, do not warm',
+        )
+
+    def handle(self, *args, **options):
+        if not options['status']:
+            ollama_pool.check_all()
+            self.stdout.write(f'\n🔥 Warming {", ".join(model_warmer.models)}...')
+            results = model_warmer.warm_all()
+            failed = [key for key, ok in results.items() if not ok]
+            if failed:
+                for url, model in failed:
+                    self.stdout.write(self.style.ERROR(f'   ❌ {model} on {url}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'   ✅ {len(results)} model load(s) succeeded'))
+
+        status = model_warmer.status()
+        self.stdout.write(f'\n📊 Model load state (keep_alive: {status["keep_alive"] or "Ollama default"})')
+        for endpoint in status['endpoints']:
+            self.stdout.write(f'   {endpoint["url"]}' + (f'  ⚠️  {endpoint["ps_error"]}' if endpoint['ps_error'] else ''))
+            for model, state in endpoint['models'].items():
+                loaded = {True: 'loaded', False: 'not loaded', None: 'unknown'}[state['loaded']]
+                extra = f' (until {state["expires_at"]})' if state.get('expires_at') else ''
+                self.stdout.write(f'      {model}: {loaded}{extra}')
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='extractiontask',
+            name='extraction_metrics',
+            field=models.JSONField(blank=True, default=dict, help_text='Per-task pipeline metrics (prompt size, time saved, ...)'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0002_extractiontask_extraction_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='extractiontask',
+            name='escalated',
+            field=models.BooleanField(default=False, help_text='Re-extracted with a larger model after failed validation'),
+        ),
+        migrations.AddField(
+            model_name='extractiontask',
+            name='initial_model',
+            field=models.CharField(blank=True, help_text='Model chosen by the complexity router', max_length=50),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0003_extractiontask_routing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendorTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vendor_key', models.CharField(help_text='Vendor TRN, or normalized vendor name', max_length=100, unique=True)),
+                ('vendor_name', models.CharField(blank=True, max_length=255)),
+                ('fingerprint', models.JSONField(blank=True, default=list, help_text='Static words of page 1 as [token, column, row]')),
+                ('rules', models.JSONField(blank=True, default=dict, help_text='Anchored field regions, item rule and vendor constants')),
+                ('samples', models.PositiveIntegerField(default=0, help_text='Accepted extractions learned from')),
+                ('hits', models.PositiveIntegerField(default=0, help_text='Documents extracted without the LLM')),
+                ('fallbacks', models.PositiveIntegerField(default=0, help_text='Matched documents sent to the LLM after a failed check')),
+                ('enabled', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -20,10 +20,51 @@ class ExtractionTask(models.Model):
     
     # Metadata about the extraction process
     model_used = models.CharField(max_length=50, default='llava:7b')
+    initial_model = models.CharField(max_length=50, blank=True, help_text="Model chosen by the complexity router")
+    escalated = models.BooleanField(default=False, help_text="Re-extracted with a larger model after failed validation")
     processing_time = models.FloatField(null=True, help_text="Time taken in seconds")
+    extraction_metrics = models.JSONField(default=dict, blank=True, help_text="Per-task pipeline metrics (prompt size, time saved, ...)")
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Extraction for {self.submission.id} - {self.status}"
+
+    def apply_result(self, result):
+        """Store a process_invoice() result on the task (does not save)."""
+        if result['success']:
+            self.status = 'completed'
+            self.extracted_data = result['data']
+            self.processing_time = result.get('processing_time', 0)
+            self.model_used = result.get('model', self.model_used)
+            self.initial_model = result.get('initial_model', '')
+            self.escalated = result.get('escalated', False)
+            self.extraction_metrics = result.get('metrics', {})
+        else:
+            self.status = 'failed'
+            self.error_log = result.get('error', 'Unknown error')
+
+
+class VendorTemplate(models.Model):
+    """Layout template of a recurring vendor, learned from accepted extractions (see layout_templates.py)"""
+
+    vendor_key = models.CharField(max_length=100, unique=True, help_text="Vendor TRN, or normalized vendor name")
+    vendor_name = models.CharField(max_length=255, blank=True)
+    fingerprint = models.JSONField(default=list, blank=True, help_text="Static words of page 1 as [token, column, row]")
+    rules = models.JSONField(default=dict, blank=True, help_text="Anchored field regions, item rule and vendor constants")
+    samples = models.PositiveIntegerField(default=0, help_text="Accepted extractions learned from")
+    hits = models.PositiveIntegerField(default=0, help_text="Documents extracted without the LLM")
+    fallbacks = models.PositiveIntegerField(default=0, help_text="Matched documents sent to the LLM after a failed check")
+    enabled = models.BooleanField(default=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Template for {self.vendor_name or self.vendor_key} ({self.samples} samples)"
+
+    @property
+    def hit_rate(self):
+        matched = self.hits + self.fallbacks
+        return round(self.hits / matched, 3) if matched else None
@@ -0,0 +1,106 @@
+"""
+Unified candidate scanner for PO and VAT/TRN detection.
+
+One pass over each text source (OCR text, each JSON string value) emits
+typed candidates with their offsets, source and a confidence:
+
+    po_prefixed  a known PO prefix followed by digits (ATCPO25080595, ATCP0...)
+    po_digits    an 8-digit YYMMXXXX PO number without prefix
+    vat          an Omani VAT/TRN number (OM + 10 digits, spaces allowed)
+
+PO selection then works over the candidate list instead of re-scanning.
+"""
+
+import re
+from collections import namedtuple
+
+from .po_matcher import _ASCII_UPPER, trie_pattern
+
+# prefix: the matched PO prefix for po_prefixed candidates ('' otherwise), used for ranking
+Candidate = namedtuple('Candidate', 'kind value start end source field prefix confidence')
+
+PO_PREFIXED = 'po_prefixed'
+PO_DIGITS = 'po_digits'
+VAT = 'vat'
+
+# JSON fields where a PO number may have been put by the model
+PO_FIELDS = ("Invoice_No", "PO_Number", "Order_Number", "LPO_reference", "Customer_RefNo")
+
+# Base confidence by kind and source; OCR loses a little to misreads
+CONFIDENCE = {
+    (PO_PREFIXED, 'json'): 0.95, (PO_PREFIXED, 'ocr'): 0.9,
+    (PO_DIGITS, 'json'): 0.6, (PO_DIGITS, 'ocr'): 0.5,
+    (VAT, 'json'): 0.9, (VAT, 'ocr'): 0.8,
+}
+
+
+class CandidateScanner:
+    """
+    Args:
+        matcher: PrefixMatcher holding the known PO prefixes and PREFIX_MAPPING
+    """
+
+    def __init__(self, matcher):
+        self.matcher = matcher
+        # One lookahead alternation tried at every position (texts are upper-cased first)
+        self.regex = re.compile(
+            r"(?=(?P<vat>OM\s*\d[\d\s]{9,})"
+            r"|(?P<prefix>" + trie_pattern(sorted(matcher.prefixes)) + r")(?P<dash>-?)(?P<digits>\d+)"
+            r"|\b(?P<num>\d{8})\b)"
+        )
+
+    def scan(self, text, source, field=None):
+        """Candidates in `text`, in text order."""
+        text = text or ""
+        found = []
+        for match in self.regex.finditer(text.translate(_ASCII_UPPER)):
+            start = match.start()
+            if match.group('vat'):
+                value = re.sub(r"\s+", "", match.group('vat'))
+                if len(value) == 12:
+                    end = start + len(match.group('vat'))
+                    found.append(Candidate(VAT, value, start, end, source, field, '', CONFIDENCE[(VAT, source)]))
+            elif match.group('prefix'):
+                prefix, digits = match.group('prefix'), match.group('digits')
+                end = start + len(prefix) + len(match.group('dash')) + len(digits)
+                confidence = CONFIDENCE[(PO_PREFIXED, source)]
+                if prefix in self.matcher.mapping:
+                    confidence -= 0.05  # Recovered from an O/0 misread
+                found.append(Candidate(PO_PREFIXED, self.matcher._po(prefix, digits), start, end, source, field, prefix, confidence))
+            else:
+                value = match.group('num')
+                if 1 <= int(value[2:4]) <= 12:  # YYMM
+                    found.append(Candidate(PO_DIGITS, value, start, start + 8, source, field, '', CONFIDENCE[(PO_DIGITS, source)]))
+        return found
+
+    def scan_json(self, data, field=None):
+        """Candidates in every string value of extracted JSON; `field` is the top-level key."""
+        found = []
+        if isinstance(data, dict):
+            for key, value in data.items():
+                found += self.scan_json(value, key if field is None else field)
+        elif isinstance(data, list):
+            for value in data:
+                found += self.scan_json(value, field)
+        elif data not in (None, '') and not isinstance(data, bool):
+            # Numbers too: a model may return PO_Number as 25080595
+            found += self.scan(str(data), 'json', field)
+        return found
+
+
+def of_kind(candidates, kind, source=None):
+    return [c for c in candidates if c.kind == kind and (source is None or c.source == source)]
+
+
+def best_prefixed(candidates):
+    """The prefixed PO the prefix matcher would pick: longest prefix, then earliest."""
+    prefixed = of_kind(candidates, PO_PREFIXED)
+    return min(prefixed, key=lambda c: (-len(c.prefix), c.start)) if prefixed else None
+
+
+def unique_values(candidates):
+    values = []
+    for c in candidates:
+        if c.value not in values:
+            values.append(c.value)
+    return values
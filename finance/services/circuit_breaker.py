@@ -0,0 +1,96 @@
+"""
+Circuit breaker for slow or failing backends (the n8n webhook).
+
+closed     calls pass through; outcomes are recorded in a sliding window.
+           Once enough calls failed or were slower than the latency
+           threshold the breaker opens.
+open       calls are refused so the caller falls back immediately.
+half_open  after the cool-down one probe call is let through; success
+           closes the breaker, failure re-opens it.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Args:
+        name: label used in logs and status
+        window: most recent calls considered
+        min_calls: calls needed in the window before the breaker may open
+        failure_rate: share of failed (or slow) calls that opens the breaker
+        slow_call_seconds: calls slower than this count as failures (None = off)
+        open_seconds: cool-down before a probe is allowed
+    """
+
+    def __init__(self, name, window=10, min_calls=4, failure_rate=0.5, slow_call_seconds=60, open_seconds=60):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.rejected = 0
+        self._outcomes = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        if state != self.state:
+            logger.warning(f"[CIRCUIT] {self.name}: {self.state} -> {state}")
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.time()
+        elif state == CLOSED:
+            self.opened_at = None
+            self._outcomes.clear()
+
+    def allow(self):
+        """True when a call may go ahead. A True in half-open state reserves the probe."""
+        with self._lock:
+            if self.state == OPEN and time.time() - self.opened_at >= self.open_seconds:
+                self._transition(HALF_OPEN)
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, success, latency):
+        """Report the outcome of an allowed call."""
+        slow = self.slow_call_seconds is not None and latency > self.slow_call_seconds
+        ok = success and not slow
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.probe_in_flight = False
+                self._transition(CLOSED if ok else OPEN)
+                return
+
+            self._outcomes.append(ok)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                self._transition(OPEN)
+
+    def status(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'state': self.state,
+                'recent_calls': len(self._outcomes),
+                'recent_failures': self._outcomes.count(False),
+                'opened_at': self.opened_at,
+                'rejected': self.rejected,
+            }
@@ -0,0 +1,207 @@
+"""
+Adaptive (AIMD) concurrency limiting for LLM calls.
+
+Ollama's real parallel capacity depends on the model, the prompt sizes and
+what else the box is doing, so no fixed thread count fits. The limiter lets
+one more request in flight after every window of calls whose p95 latency
+stayed near the best p95 seen, and cuts the limit multiplicatively when p95
+climbs or a call times out. Timeouts of calls that were already in flight
+at the last cut belong to the same overload event and do not cut again; a
+timeout of a call started after it does, so sustained timeouts keep
+halving the limit down to the minimum.
+"""
+
+import collections
+import contextlib
+import math
+import threading
+import time
+
+import requests
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty sequence."""
+    ordered = sorted(values)
+    rank = max(1, int(math.ceil(pct / 100.0 * len(ordered))))
+    return ordered[rank - 1]
+
+
+class AdaptiveLimiter:
+    """
+    Args:
+        initial / minimum / maximum: bounds on concurrent calls
+        window: completed calls (successes, timeouts and errors) per adjustment
+        tolerance: p95 may grow to baseline * tolerance before backing off
+        backoff: multiplicative decrease on latency growth (timeouts halve the limit)
+    """
+
+    def __init__(self, initial=2, minimum=1, maximum=8, window=20, tolerance=1.5, backoff=0.75):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(self.maximum, max(self.minimum, initial))
+        self.window = window
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.inflight = 0
+        self.waiting = 0
+        self.baseline = None
+        self.last_p95 = None
+        self.increases = 0
+        self.decreases = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self._samples = []
+        self._completed = 0
+        self._saturated = False      # Limit was reached during the current window
+        self._cut_this_window = False
+        self._epoch = 0              # Bumped on every cut
+        self._cond = threading.Condition()
+
+    # ------------------------------------------------------------------
+    # Slots
+    # ------------------------------------------------------------------
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Hold one in-flight slot for the duration of an LLM call."""
+        queued = time.time()
+        with self._cond:
+            self.waiting += 1
+            while self.inflight >= self.limit:
+                self._cond.wait()
+            self.waiting -= 1
+            self.inflight += 1
+            if self.inflight >= self.limit:
+                self._saturated = True
+            self.total_wait += time.time() - queued
+            epoch = self._epoch
+
+        start = time.time()
+        try:
+            yield
+        except requests.exceptions.Timeout:
+            with self._cond:
+                self.timeouts += 1
+                self._on_timeout(epoch)
+            raise
+        else:
+            with self._cond:
+                self._samples.append(time.time() - start)
+        finally:
+            with self._cond:
+                self.inflight -= 1
+                self._on_complete()
+                self._cond.notify_all()
+
+    # ------------------------------------------------------------------
+    # AIMD (called with the condition held)
+    # ------------------------------------------------------------------
+
+    def _set_limit(self, value):
+        value = min(self.maximum, max(self.minimum, value))
+        if value > self.limit:
+            self.increases += 1
+        elif value < self.limit:
+            self.decreases += 1
+        self.limit = value
+        self._cond.notify_all()
+
+    def _cut(self, value):
+        self._set_limit(value)
+        self._cut_this_window = True
+        self._epoch += 1
+
+    def _on_timeout(self, epoch):
+        # Calls in flight at the last cut time out together: one overload event
+        if epoch == self._epoch:
+            self._cut(int(self.limit / 2))
+
+    def _on_complete(self):
+        self._completed += 1
+        if self._completed < self.window:
+            return
+
+        if self._samples:
+            p95 = percentile(self._samples, 95)
+            self.last_p95 = p95
+            if self.baseline is None:
+                self.baseline = p95
+            elif p95 > self.baseline * self.tolerance:
+                if not self._cut_this_window:
+                    self._cut(int(self.limit * self.backoff))
+            elif self._saturated and not self._cut_this_window:
+                self._set_limit(self.limit + 1)
+            # Track the best p95 but let it drift up so a slower workload mix is not punished forever
+            self.baseline = min(p95, self.baseline * 1.02)
+
+        self._samples = []
+        self._completed = 0
+        self._saturated = self.inflight >= self.limit
+        self._cut_this_window = False
+
+    def status(self):
+        with self._cond:
+            return {
+                'limit': self.limit,
+                'inflight': self.inflight,
+                'waiting': self.waiting,
+                'p95': round(self.last_p95, 3) if self.last_p95 is not None else None,
+                'baseline_p95': round(self.baseline, 3) if self.baseline is not None else None,
+                'increases': self.increases,
+                'decreases': self.decreases,
+                'timeouts': self.timeouts,
+                'total_wait': round(self.total_wait, 3),
+            }
+
+
+class LatencyTracker:
+    """Recent call latencies of one backend, for percentile-based hedging delays."""
+
+    def __init__(self, window=50):
+        self._samples = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        with self._lock:
+            self._samples.append(latency)
+
+    def percentile(self, pct, default, min_samples=10):
+        """`default` until enough samples have been recorded."""
+        with self._lock:
+            samples = list(self._samples)
+        if len(samples) < min_samples:
+            return default
+        return percentile(samples, pct)
+
+
+# ----------------------------------------------------------------------
+# Cooperative cancellation of in-flight LLM calls
+# ----------------------------------------------------------------------
+
+class Cancelled(Exception):
+    """The call was cancelled because another backend already answered."""
+
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def cancellation(event):
+    """Calls made by this thread inside the block stop once `event` is set."""
+    previous = getattr(_local, 'event', None)
+    _local.event = event
+    try:
+        yield
+    finally:
+        _local.event = previous
+
+
+def cancelled():
+    event = getattr(_local, 'event', None)
+    return event is not None and event.is_set()
+
+
+def current_cancellation():
+    """This thread's cancel event, to hand on to worker threads it starts."""
+    return getattr(_local, 'event', None)
@@ -0,0 +1,271 @@
+"""
+Local stand-ins for the extraction backends, for offline load testing.
+
+FakeOllama   /api/generate (streaming and not), /api/tags, /api/ps
+FakeN8n      the invoice_extract webhook (multipart upload -> [{"output": ...}])
+seed_oracle  a SQLite database with the Axpert tables read by the service
+
+Each HTTP server has a Profile: log-normal latency around a median, an
+error rate (503 responses) and a concurrency limit beyond which requests
+queue, like a saturated GPU box.
+"""
+
+import json
+import math
+import random
+import re
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .oracle_db import SQLITE_SCHEMA
+
+
+class Profile:
+    """
+    Args:
+        latency: median seconds per request
+        jitter: log-normal sigma (0 = constant latency; 0.5 gives a realistic tail)
+        error_rate: share of requests answered with 503
+        concurrency: requests served at once; the rest wait
+    """
+
+    def __init__(self, latency=1.0, jitter=0.5, error_rate=0.0, concurrency=2):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.slots = threading.BoundedSemaphore(max(1, concurrency))
+        self.served = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def duration(self):
+        if not self.latency:
+            return 0.0
+        return self.latency * math.exp(random.gauss(0, self.jitter)) if self.jitter else self.latency
+
+    def fails(self):
+        failed = random.random() < self.error_rate
+        with self._lock:
+            self.served += 1
+            self.failed += failed
+        return failed
+
+
+# ----------------------------------------------------------------------
+# Canned extraction output
+# ----------------------------------------------------------------------
+
+# The number follows a required No / Number / # label on the same line ("TAX INVOICE" is not one)
+_INVOICE_RE = re.compile(r"\binvoice[ \t]*(?:no\b|number\b|num\b|#)\.?[ \t]*[:#\-]?[ \t]*([A-Z0-9][A-Z0-9\-/]{2,})", re.I)
+_DATE_RE = re.compile(r"\b(\d{4}-\d{2}-\d{2}|\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4})\b")
+_PO_RE = re.compile(r"\b([A-Z]{3,6}P[O0][\-/]?\d{3,})\b")
+_TOTAL_RE = re.compile(r"total[^\d\n]*([\d,]+\.\d{2})", re.I)
+_ITEM_RE = re.compile(r"^(?:(\d+)\s+)?(.*?[A-Za-z].*?)\s+(\d+(?:\.\d+)?)\s+([\d,]+\.\d{2})\s+([\d,]+\.\d{2})\s*$", re.M)
+
+
+def fake_extraction(text, fields):
+    """An extraction-shaped object with values found in `text` by simple patterns."""
+    def first(regex):
+        match = regex.search(text)
+        return match.group(1) if match else ""
+
+    data = {field: "" for field in fields if field != "Items"}
+    values = {
+        "Invoice_No": first(_INVOICE_RE),
+        "Invoice_Date": first(_DATE_RE),
+        "PO_Number": first(_PO_RE),
+        "Total": first(_TOTAL_RE),
+        "Vendor_Name": "Fake Vendor LLC",
+    }
+    data.update({k: v for k, v in values.items() if k in data})
+    if "Items" in fields:
+        data["Items"] = [
+            {"Item_No": no or str(index + 1), "Item_Description": desc, "Quantity": qty, "Unit": "",
+             "Unit_Price": price, "Amount": amount}
+            for index, (no, desc, qty, price, amount) in enumerate(_ITEM_RE.findall(text))
+        ]
+    return data
+
+
+def _fields_from(payload):
+    schema = payload.get("format")
+    if isinstance(schema, dict) and schema.get("properties"):
+        return list(schema["properties"])
+    return ["Invoice_No", "Invoice_Date", "PO_Number", "Vendor_Name", "Subtotal", "Total", "Items"]
+
+
+# ----------------------------------------------------------------------
+# HTTP servers
+# ----------------------------------------------------------------------
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeBackend/1.0'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b''.join(chunks)
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _send_json(self, status, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _serve(self, respond):
+        """Queue for a slot, wait out the simulated latency, then respond (or fail)."""
+        profile = self.server.profile
+        with profile.slots:
+            duration = profile.duration()
+            if profile.fails():
+                time.sleep(duration / 2)
+                self._send_json(503, {'error': 'simulated overload'})
+                return
+            respond(duration)
+
+
+class FakeOllamaHandler(_Handler):
+    def do_GET(self):
+        models = [{'name': name, 'model': name} for name in self.server.models]
+        if self.path == '/api/tags':
+            self._send_json(200, {'models': models})
+        elif self.path == '/api/ps':
+            self._send_json(200, {'models': [dict(m, expires_at='2099-01-01T00:00:00Z', size_vram=0) for m in models]})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/api/generate':
+            self._send_json(404, {'error': 'not found'})
+            return
+        try:
+            payload = json.loads(self._body() or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': 'invalid JSON'})
+            return
+
+        prompt = payload.get('prompt') or ''
+        if not prompt:
+            # Empty prompt = load request (warm-up)
+            self._send_json(200, {'model': payload.get('model'), 'response': '', 'done': True, 'load_duration': 0})
+            return
+
+        text = prompt.split('data =', 1)[-1]
+        output = json.dumps(fake_extraction(text, _fields_from(payload)))
+        stats = {
+            'prompt_eval_count': max(1, len(prompt) // 4),
+            'prompt_eval_duration': int(len(prompt) * 2e5),
+            'eval_count': max(1, len(output) // 4),
+        }
+
+        def respond(duration):
+            if not payload.get('stream', True):
+                time.sleep(duration)
+                self._send_json(200, dict(stats, model=payload.get('model'), response=output, done=True))
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            tokens = [output[i:i + 4] for i in range(0, len(output), 4)]
+            per_token = duration / max(1, len(tokens))
+            try:
+                for token in tokens:
+                    time.sleep(per_token)
+                    self._write_chunk({'model': payload.get('model'), 'response': token, 'done': False})
+                self._write_chunk(dict(stats, model=payload.get('model'), response='', done=True))
+                self.wfile.write(b'0\r\n\r\n')
+            except (BrokenPipeError, ConnectionResetError):
+                # Client closed the stream early (JSON complete or cancelled)
+                self.close_connection = True
+
+        self._serve(respond)
+
+    def _write_chunk(self, obj):
+        line = json.dumps(obj).encode('utf-8') + b'\n'
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line))
+        self.wfile.flush()
+
+
+class FakeN8nHandler(_Handler):
+    def do_POST(self):
+        if self.path != self.server.webhook_path:
+            self._send_json(404, {'error': 'webhook not registered'})
+            return
+        body = self._body()
+        # The real workflow OCRs the upload; any readable text in it is good enough here
+        text = body.decode('latin-1')
+        output = json.dumps(fake_extraction(text, _fields_from({})), indent=2)
+
+        def respond(duration):
+            time.sleep(duration)
+            self._send_json(200, [{'output': f"```json\n{output}\n```"}])
+
+        self._serve(respond)
+
+
+def make_server(handler, port, profile, verbose=False, **attrs):
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    server.profile = profile
+    server.verbose = verbose
+    for name, value in attrs.items():
+        setattr(server, name, value)
+    thread = threading.Thread(target=server.serve_forever, name=f'fake-{handler.__name__}', daemon=True)
+    thread.start()
+    return server
+
+
+# ----------------------------------------------------------------------
+# SQLite stand-in for the Axpert Oracle schema
+# ----------------------------------------------------------------------
+
+def seed_oracle(path, prefixes, pos_per_branch=20):
+    """
+    Create the Axpert tables and fill them with one branch per PO prefix
+    (TRN OM11000000nn) and `pos_per_branch` approved POs each (<prefix>2501nnnn).
+
+    Returns:
+        int: number of POs created
+    """
+    with sqlite3.connect(path) as conn:
+        conn.executescript(SQLITE_SCHEMA)
+        conn.execute("DELETE FROM pohdr")
+        conn.execute("DELETE FROM vendor")
+        conn.execute("DELETE FROM branch")
+        conn.execute("DELETE FROM currency")
+        conn.execute("INSERT INTO currency VALUES (1, 'AED')")
+        po_id = 0
+        for branch_id, prefix in enumerate(prefixes, start=1):
+            code = prefix[:-2] if prefix.endswith('PO') else prefix
+            trn = f"OM11{branch_id:08d}"
+            conn.execute("INSERT INTO branch VALUES (?, ?, ?, ?)", (branch_id, code, f"{code} Branch", trn))
+            conn.execute(
+                "INSERT INTO vendor (vendorid, vendorname, creditdays, currency, trnno) VALUES (?, ?, 30, 1, ?)",
+                (branch_id, f"Vendor {code} LLC", f"OM12{branch_id:08d}"),
+            )
+            for n in range(1, pos_per_branch + 1):
+                po_id += 1
+                conn.execute(
+                    "INSERT INTO pohdr (pohdrid, docid, docdt, totpovalue, netcostamt, payterm, currency, supplier, branchname)"
+                    " VALUES (?, ?, '2025-01-01', ?, ?, '30 DAYS', 1, ?, ?)",
+                    (po_id, f"{prefix}2501{n:04d}", 1050.0 * n, 1000.0 * n, branch_id, branch_id),
+                )
+    return po_id
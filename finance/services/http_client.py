@@ -0,0 +1,215 @@
+"""
+Shared HTTP client for the LLM backends (Ollama, n8n).
+
+One requests.Session per host gives each backend its own keep-alive
+connection pool. Calls are retried a bounded number of times with
+full-jitter exponential backoff, and every call is recorded in per-host
+metrics.
+"""
+
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+try:
+    from urllib3.exceptions import NewConnectionError, ReadTimeoutError
+except ImportError:
+    NewConnectionError = ReadTimeoutError = None
+
+logger = logging.getLogger(__name__)
+
+# Responses worth retrying when the call is idempotent
+RETRY_STATUSES = {429, 502, 503, 504}
+
+# Calls that may have been running server-side for minutes (LLM generation)
+# only retry these: the host was not reachable or not serving yet
+UNAVAILABLE_STATUSES = {502, 503}
+
+
+def _never_sent(exc):
+    """True when the request failed before reaching the server (safe to retry any call)."""
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(exc, requests.exceptions.ConnectionError) and exc.args:
+        reason = getattr(exc.args[0], 'reason', None)
+        return NewConnectionError is not None and isinstance(reason, NewConnectionError)
+    return False
+
+
+def is_read_timeout(exc):
+    """
+    True for a read timeout while consuming a streamed body: requests raises
+    those from iter_lines()/iter_content() as ConnectionError, not Timeout.
+    """
+    if isinstance(exc, requests.exceptions.ReadTimeout):
+        return True
+    if isinstance(exc, requests.exceptions.ConnectionError) and exc.args:
+        return ReadTimeoutError is not None and isinstance(exc.args[0], ReadTimeoutError)
+    return False
+
+
+def _rewind_files(kwargs):
+    """Uploaded file objects must be rewound before a retry re-sends them."""
+    files = kwargs.get('files')
+    if not files:
+        return
+    values = files.values() if isinstance(files, dict) else [v for _, v in files]
+    for value in values:
+        fileobj = value[1] if isinstance(value, (tuple, list)) and len(value) > 1 else value
+        if hasattr(fileobj, 'seek'):
+            fileobj.seek(0)
+
+
+class HostMetrics:
+    """Counters and latency totals for one backend host."""
+
+    def __init__(self):
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.failures = 0
+        self.statuses = {}
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = 0.0
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'attempts': self.attempts,
+            'retries': self.retries,
+            'failures': self.failures,
+            'statuses': dict(self.statuses),
+            'avg_latency': round(self.total_latency / self.calls, 3) if self.calls else 0.0,
+            'max_latency': round(self.max_latency, 3),
+            'last_latency': round(self.last_latency, 3),
+        }
+
+
+class BackendClient:
+    """
+    Thread-safe pooled client.
+
+    Args:
+        pool_maxsize: keep-alive connections kept per host
+        max_retries: extra attempts after the first one
+        backoff_base / backoff_max: full-jitter backoff bounds in seconds
+    """
+
+    def __init__(self, pool_maxsize=10, max_retries=2, backoff_base=0.5, backoff_max=8.0):
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._sessions = {}
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _host(url):
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def _session(self, host):
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                # Retries are handled here so they can be counted and jittered
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize, max_retries=0)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[host] = session
+                self._metrics[host] = HostMetrics()
+            return session
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _record(self, host, attempts, latency, status=None, failed=False):
+        with self._lock:
+            m = self._metrics[host]
+            m.calls += 1
+            m.attempts += attempts
+            m.retries += attempts - 1
+            if failed:
+                m.failures += 1
+            if status is not None:
+                m.statuses[status] = m.statuses.get(status, 0) + 1
+            m.total_latency += latency
+            m.max_latency = max(m.max_latency, latency)
+            m.last_latency = latency
+
+    def request(self, method, url, idempotent=True, max_retries=None, retry_timeouts=True, **kwargs):
+        """
+        Send a request through the host's pooled session.
+
+        Connection failures that never reached the server are always retried.
+        Timeouts, dropped connections and 429/502/503/504 responses are only
+        retried when the call is idempotent. With retry_timeouts=False (long
+        LLM generations) a timed-out or dropped call is not repeated and only
+        502/503 responses are retried.
+        """
+        host = self._host(url)
+        session = self._session(host)
+        retries = self.max_retries if max_retries is None else max_retries
+        statuses = RETRY_STATUSES if retry_timeouts else UNAVAILABLE_STATUSES
+
+        start = time.time()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as exc:
+                retryable = _never_sent(exc) or (
+                    idempotent and retry_timeouts
+                    and isinstance(exc, (requests.exceptions.Timeout, requests.exceptions.ConnectionError))
+                )
+                if retryable and attempt <= retries:
+                    delay = self._backoff(attempt - 1)
+                    logger.warning(f"[RETRY] {method} {url} failed ({exc.__class__.__name__}); retry {attempt}/{retries} in {delay:.2f}s")
+                    time.sleep(delay)
+                    _rewind_files(kwargs)
+                    continue
+                self._record(host, attempt, time.time() - start, failed=True)
+                raise
+
+            if idempotent and response.status_code in statuses and attempt <= retries:
+                delay = self._backoff(attempt - 1)
+                logger.warning(f"[RETRY] {method} {url} returned {response.status_code}; retry {attempt}/{retries} in {delay:.2f}s")
+                response.close()
+                time.sleep(delay)
+                _rewind_files(kwargs)
+                continue
+
+            latency = time.time() - start
+            self._record(host, attempt, latency, status=response.status_code, failed=response.status_code >= 500)
+            logger.debug(f"[HTTP] {method} {url} -> {response.status_code} in {latency:.2f}s ({attempt} attempt(s))")
+            return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def metrics(self):
+        """Snapshot of per-host metrics."""
+        with self._lock:
+            return {host: m.as_dict() for host, m in self._metrics.items()}
+
+
+# Module-level client shared by every extraction thread
+client = BackendClient(
+    pool_maxsize=getattr(settings, 'LLM_HTTP_POOL_SIZE', 10),
+    max_retries=getattr(settings, 'LLM_HTTP_MAX_RETRIES', 2),
+    backoff_base=getattr(settings, 'LLM_HTTP_BACKOFF_BASE', 0.5),
+    backoff_max=getattr(settings, 'LLM_HTTP_BACKOFF_MAX', 8.0),
+)
@@ -0,0 +1,115 @@
+"""
+Multi-invoice PDF splitting.
+Detects invoice boundaries page by page so a scan holding several invoices
+can be extracted as independent sub-tasks.
+"""
+
+import re
+
+# Pages are separated by a form feed in OCR output (see extract_text_via_ocr)
+PAGE_SEPARATOR = "\f"
+
+# Only the top of the page is searched for the header / invoice number
+HEADER_LINES = 25
+
+INVOICE_NO_RE = re.compile(
+    r"invoice\s*(?:no|number|num|#)\.?\s*[:#\-]?\s*([A-Z0-9][A-Z0-9/\-]{2,})",
+    re.IGNORECASE,
+)
+INVOICE_HEADER_RE = re.compile(r"\b(?:tax\s+)?invoice\b", re.IGNORECASE)
+PAGE_OF_RE = re.compile(r"\bpage\s*(\d+)\s*(?:of|/)\s*(\d+)", re.IGNORECASE)
+
+
+def split_pages(text, keep_empty=False):
+    """
+    Split OCR text into page texts. Empty pages are dropped unless
+    `keep_empty`, which keeps page i of the list = page i of the PDF.
+    """
+    if not text or PAGE_SEPARATOR not in text:
+        return [text] if text and text.strip() else []
+    pages = text.split(PAGE_SEPARATOR)
+    if keep_empty:
+        # OCR ends every page with a separator: nothing follows the last one
+        return pages[:-1] if not pages[-1].strip() else pages
+    return [page for page in pages if page.strip()]
+
+
+def read_pdf_pages(file_path):
+    """Per-page text from the PDF text layer (empty list if unavailable)."""
+    try:
+        import PyPDF2
+        with open(file_path, 'rb') as f:
+            reader = PyPDF2.PdfReader(f)
+            return [page.extract_text() or "" for page in reader.pages]
+    except Exception as e:
+        print(f"[WARNING] Could not read PDF pages: {e}")
+        return []
+
+
+def page_signature(page_text):
+    """
+    Boundary signals for one page.
+
+    Returns:
+        dict: invoice_no (str or None), has_header (bool), page_no (int or None)
+    """
+    head = "\n".join(page_text.strip().splitlines()[:HEADER_LINES])
+
+    invoice_no = None
+    match = INVOICE_NO_RE.search(head)
+    if match:
+        invoice_no = match.group(1).upper().strip("-/")
+
+    page_no = None
+    page_match = PAGE_OF_RE.search(page_text)
+    if page_match:
+        page_no = int(page_match.group(1))
+
+    return {
+        'invoice_no': invoice_no,
+        'has_header': bool(INVOICE_HEADER_RE.search(head)),
+        'page_no': page_no,
+    }
+
+
+def detect_invoice_segments(pages):
+    """
+    Group consecutive pages into invoices.
+
+    A new invoice starts when a page shows a different invoice number than
+    the current one, or when it carries an invoice header and says
+    "Page 1 of N". Pages without any signal are treated as continuations.
+
+    Args:
+        pages: list of page texts
+
+    Returns:
+        list of dicts: {'pages': [page indexes], 'invoice_no': str or None}
+    """
+    segments = []
+    current = None
+
+    for index, page_text in enumerate(pages):
+        sig = page_signature(page_text)
+
+        starts_new = current is None
+        if current is not None:
+            if sig['invoice_no'] and current['invoice_no'] and sig['invoice_no'] != current['invoice_no']:
+                starts_new = True
+            elif sig['has_header'] and sig['page_no'] == 1:
+                starts_new = True
+
+        if starts_new:
+            current = {'pages': [index], 'invoice_no': sig['invoice_no']}
+            segments.append(current)
+        else:
+            current['pages'].append(index)
+            if not current['invoice_no'] and sig['invoice_no']:
+                current['invoice_no'] = sig['invoice_no']
+
+    return segments
+
+
+def segment_text(pages, segment):
+    """Join the page texts of a segment back into one document text."""
+    return PAGE_SEPARATOR.join(pages[i] for i in segment['pages'])
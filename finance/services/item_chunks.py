@@ -0,0 +1,74 @@
+"""
+Helpers for map-reduce extraction of long line-item tables.
+
+The invoice text is cut into overlapping line chunks that are extracted
+independently; the per-chunk `Items` arrays are then stitched back together
+in chunk order, dropping the items repeated by the overlap.
+"""
+
+import re
+
+from .prompt_builder import PAGE_SEPARATOR, estimate_tokens, normalize_whitespace, remove_repeated_edges
+
+
+def clean_text(text):
+    """Normalized text with repeated page headers/footers removed."""
+    deduped, _ = remove_repeated_edges(normalize_whitespace(text))
+    return deduped
+
+
+def header_text(text):
+    """First and last page: where header fields and totals live."""
+    pages = [p for p in clean_text(text).split(PAGE_SEPARATOR) if p.strip()]
+    if len(pages) <= 2:
+        return "\n\n".join(pages)
+    return pages[0] + "\n\n" + pages[-1]
+
+
+def chunk_lines(text, chunk_tokens, overlap_lines=3):
+    """
+    Consecutive line chunks of about `chunk_tokens` estimated tokens, each
+    starting with the last `overlap_lines` lines of the previous chunk so an
+    item cut at a boundary appears whole in one of them.
+    """
+    lines = [line for line in clean_text(text).replace(PAGE_SEPARATOR, "\n").split("\n") if line.strip()]
+    chunks = []
+    start = 0
+    while start < len(lines):
+        end = start
+        used = 0
+        while end < len(lines) and (end == start or used + estimate_tokens(lines[end]) + 1 <= chunk_tokens):
+            used += estimate_tokens(lines[end]) + 1
+            end += 1
+        chunks.append("\n".join(lines[start:end]))
+        if end >= len(lines):
+            break
+        start = max(start + 1, end - overlap_lines)
+    return chunks
+
+
+def _norm(value):
+    return re.sub(r"[^0-9a-z.]", "", str(value or "").lower())
+
+
+def item_key(item):
+    return (_norm(item.get("Item_Description")), _norm(item.get("Quantity")), _norm(item.get("Amount")))
+
+
+def merge_items(chunk_items, max_overlap=6):
+    """
+    Concatenate per-chunk item lists in order. Where the head of a chunk
+    repeats the tail of what was merged so far (the overlap), the repeated
+    items are dropped; identical items elsewhere are kept, since invoices can
+    legitimately list the same line twice.
+    """
+    merged = []
+    for items in chunk_items:
+        items = [i for i in items or [] if isinstance(i, dict) and any(str(v).strip() for v in i.values())]
+        overlap = 0
+        for k in range(min(len(merged), len(items), max_overlap), 0, -1):
+            if [item_key(i) for i in merged[-k:]] == [item_key(i) for i in items[:k]]:
+                overlap = k
+                break
+        merged.extend(items[overlap:])
+    return merged
@@ -0,0 +1,435 @@
+"""
+Incremental JSON scanning and tolerant parsing of model output.
+
+The scanner is fed tokens as they arrive from Ollama. It reports when the
+top-level object has closed (so the stream can be cut short) and raises
+SchemaDivergence as soon as the output clearly is not the JSON object we
+asked for, so a bad generation fails in seconds instead of minutes.
+
+repair_json() parses what a model (or the n8n workflow) produced,
+repairing the usual defects. Well-formed output goes through the C scanner
+in one call; escape-only defects (the common case) are fixed in one regex
+pass and handed to the C scanner again; anything else is walked once by
+hand, repairing on the way:
+
+    fences / chatter     ```json ... ``` and text around the object are skipped
+    escaped punctuation  Invoice\\_No -> Invoice_No (markdown escapes)
+    invalid backslashes  C:\\Users stays a literal backslash
+    control characters   raw newlines and tabs inside strings are kept
+    trailing commas      {"a": 1,} and [1, 2,]
+    missing commas       {"a": "1" "b": "2"}
+    backslashed keys     {"Invoice\\\\_No": ...} -> "Invoice_No"
+    truncation           output cut off mid-stream keeps every complete
+                         member; an unfinished array element or scalar is dropped
+
+Any prefix of a stream can be parsed, so partial output is usable as well.
+"""
+
+import json
+import re
+import string
+
+# Text a model may legitimately emit before the opening brace
+_FENCE_PREAMBLES = ("```json", "```JSON", "```")
+
+
+class SchemaDivergence(ValueError):
+    """Raised when streamed output can no longer match the expected schema."""
+
+
+class IncrementalJSONScanner:
+    """
+    Character-level scanner for one top-level JSON object.
+
+    Args:
+        allowed_keys: top-level keys the schema permits (None = any key)
+        max_chars: abort once the output grows past this size (runaway generation; None = no limit)
+    """
+
+    def __init__(self, allowed_keys=None, max_chars=None):
+        self.allowed_keys = set(allowed_keys) if allowed_keys else None
+        self.max_chars = max_chars
+        self.parts = []
+        self.length = 0
+        self.preamble = ""
+        self.started = False
+        self.done = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.expect_key = False
+        self.reading_key = False
+        self.key_chars = []
+        self.keys = []
+
+    @property
+    def text(self):
+        return "".join(self.parts)
+
+    def _check_preamble(self):
+        stripped = self.preamble.strip()
+        if not stripped:
+            return
+        for fence in _FENCE_PREAMBLES:
+            if fence.startswith(stripped):
+                return
+        raise SchemaDivergence(f"Output does not start with a JSON object: {stripped[:40]!r}")
+
+    def _finish_key(self):
+        key = "".join(self.key_chars).replace("\\", "")
+        self.key_chars = []
+        self.reading_key = False
+        self.keys.append(key)
+        if self.allowed_keys is not None and key not in self.allowed_keys:
+            raise SchemaDivergence(f"Unexpected top-level key: {key!r}")
+
+    def feed(self, chunk):
+        """
+        Consume a chunk of generated text.
+
+        Returns:
+            bool: True once the top-level object is complete
+        """
+        if self.done or not chunk:
+            return self.done
+
+        for ch in chunk:
+            if not self.started:
+                if ch == "{":
+                    self._check_preamble()
+                    self.started = True
+                    self.depth = 1
+                    self.expect_key = True
+                    self.parts.append(ch)
+                    self.length += 1
+                else:
+                    self.preamble += ch
+                    self._check_preamble()
+                continue
+
+            self.parts.append(ch)
+            self.length += 1
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                    if self.reading_key:
+                        self.key_chars.append(ch)
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    if self.reading_key:
+                        self._finish_key()
+                elif self.reading_key:
+                    self.key_chars.append(ch)
+                continue
+
+            if ch == '"':
+                self.in_string = True
+                if self.depth == 1 and self.expect_key:
+                    self.reading_key = True
+                    self.expect_key = False
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.done = True
+                    # Anything after the closing brace (fences, chatter) is dropped
+                    return True
+            elif ch == "," and self.depth == 1:
+                self.expect_key = True
+            elif ch == ":" and self.depth == 1:
+                self.expect_key = False
+
+        if self.max_chars and self.length > self.max_chars:
+            raise SchemaDivergence(f"Output exceeded {self.max_chars} characters without closing")
+        return False
+
+    def parse(self):
+        """Tolerant parse of the text scanned so far (see repair_json)."""
+        return repair_json(self.text)
+
+
+# ----------------------------------------------------------------------
+# Tolerant one-pass parser
+# ----------------------------------------------------------------------
+
+_START = re.compile(r"[{\[]")
+_WS = re.compile(r"[ \t\n\r]*")
+_STRING_RUN = re.compile(r'[^"\\]*')
+_NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?")
+_HEX4 = re.compile(r"[0-9a-fA-F]{4}")
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+_LITERALS = (("true", True), ("false", False), ("null", None))
+_PUNCTUATION = frozenset(string.punctuation)
+# A backslash and what follows: a valid escape, or (group 1) the character of an invalid one
+_BACKSLASH_PAIR = re.compile(r'\\(?:u[0-9a-fA-F]{4}|["\\/bfnrt]|(.))', re.DOTALL)
+
+
+class _Truncated(Exception):
+    """Input ended inside a value; carries the part of a container parsed so far."""
+
+    def __init__(self, value=None):
+        self.value = value
+
+
+class _RepairParser:
+    """
+    Well-formed output is parsed by the C scanner in one call. Escape-only
+    defects are fixed in one regex pass and parsed by the C scanner again.
+    Anything else is walked once by hand, top to bottom; a defective
+    document is never re-scanned container by container.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.end = len(text)
+        self.repairs = []
+        self._scan = json.JSONDecoder(strict=False, object_pairs_hook=self._members).scan_once
+
+    def _members(self, pairs):
+        obj = {}
+        for key, value in pairs:
+            if '\\' in key:
+                key = key.replace('\\', '')
+                self.note('backslashed_key')
+            obj[key] = value
+        return obj
+
+    def note(self, repair):
+        if repair not in self.repairs:
+            self.repairs.append(repair)
+
+    def fail(self, message, pos):
+        raise json.JSONDecodeError(message, self.text, pos)
+
+    def parse(self):
+        text = self.text
+        match = _START.search(text)
+        if not match:
+            self.fail("No JSON object found", 0)
+        if text[:match.start()].strip():
+            self.note('fence' if text[:match.start()].lstrip().startswith("```") else 'leading_text')
+        try:
+            value, pos = self._scan(text, match.start())
+        except (StopIteration, ValueError):
+            value = None
+            if '\\' in text:
+                value, pos, text = self._scan_fixed_escapes(match.start())
+        try:
+            if value is None:
+                # Defective or cut off somewhere inside: walk it by hand
+                value, pos = self.value(match.start())
+        except _Truncated as truncated:
+            if truncated.value is None:
+                self.fail("Output ended before any value was complete", self.end)
+            self.note('truncated')
+            return truncated.value
+        trailing = text[pos:].strip()
+        if trailing:
+            self.note('fence' if trailing.startswith("```") else 'trailing_text')
+        return value
+
+    def _fix_escape(self, match):
+        esc = match.group(1)
+        if esc is None:
+            return match.group()
+        if esc in _PUNCTUATION:
+            # Markdown-style escape: \_ \# \* ...
+            self.note('escaped_underscore' if esc == '_' else 'escaped_punctuation')
+            return esc
+        # Not an escape at all (Windows paths etc.): keep the backslash
+        self.note('invalid_escape')
+        return '\\\\' + esc
+
+    def _scan_fixed_escapes(self, start):
+        """
+        Returns:
+            tuple: (value, end, text) parsed from the text with its escapes
+            fixed, or (None, None, original text) when other defects remain
+        """
+        repairs = list(self.repairs)
+        fixed = _BACKSLASH_PAIR.sub(self._fix_escape, self.text)
+        if fixed != self.text:
+            try:
+                value, pos = self._scan(fixed, start)
+                return value, pos, fixed
+            except (StopIteration, ValueError):
+                pass
+        self.repairs = repairs
+        return None, None, self.text
+
+    def value(self, pos):
+        text = self.text
+        pos = _WS.match(text, pos).end()
+        if pos >= self.end:
+            raise _Truncated()
+        ch = text[pos]
+        if ch == '{':
+            return self.object(pos + 1)
+        if ch == '[':
+            return self.array(pos + 1)
+        if ch == '"':
+            return self.string(pos + 1)
+        match = _NUMBER.match(text, pos)
+        if match:
+            if match.end() >= self.end:
+                raise _Truncated()  # More digits may have followed
+            number = match.group()
+            if '.' in number or 'e' in number or 'E' in number:
+                return float(number), match.end()
+            return int(number), match.end()
+        for word, literal in _LITERALS:
+            if text.startswith(word, pos):
+                return literal, pos + len(word)
+            if word.startswith(text[pos:]):
+                raise _Truncated()
+        self.fail("Expecting value", pos)
+
+    def string(self, pos):
+        text = self.text
+        quote = text.find('"', pos)
+        if quote != -1 and text.find('\\', pos, quote) == -1:
+            return text[pos:quote], quote + 1  # No escapes: nothing to decode
+        parts = []
+        while True:
+            match = _STRING_RUN.match(text, pos)
+            parts.append(match.group())
+            pos = match.end()
+            if pos >= self.end:
+                raise _Truncated()
+            if text[pos] == '"':
+                return "".join(parts), pos + 1
+
+            # Backslash
+            if pos + 1 >= self.end:
+                raise _Truncated()
+            esc = text[pos + 1]
+            if esc in _ESCAPES:
+                parts.append(_ESCAPES[esc])
+                pos += 2
+            elif esc == 'u' and _HEX4.match(text, pos + 2):
+                code = int(text[pos + 2:pos + 6], 16)
+                pos += 6
+                if 0xD800 <= code < 0xDC00 and text.startswith('\\u', pos) and _HEX4.match(text, pos + 2):
+                    low = int(text[pos + 2:pos + 6], 16)
+                    if 0xDC00 <= low < 0xE000:
+                        code = 0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)
+                        pos += 6
+                parts.append(chr(code))
+            elif esc == 'u' and pos + 6 > self.end:
+                raise _Truncated()
+            elif esc in _PUNCTUATION:
+                # Markdown-style escape: \_ \# \* ...
+                parts.append(esc)
+                self.note('escaped_underscore' if esc == '_' else 'escaped_punctuation')
+                pos += 2
+            else:
+                # Not an escape at all (Windows paths etc.): keep the backslash
+                parts.append('\\')
+                self.note('invalid_escape')
+                pos += 1
+
+    def key(self, pos):
+        key, pos = self.string(pos)
+        if '\\' in key:
+            key = key.replace('\\', '')
+            self.note('backslashed_key')
+        return key, pos
+
+    def object(self, pos):
+        text = self.text
+        obj = {}
+        comma = False
+        while True:
+            pos = _WS.match(text, pos).end()
+            if pos >= self.end:
+                raise _Truncated(obj)
+            ch = text[pos]
+            if ch == '}':
+                if comma:
+                    self.note('trailing_comma')
+                return obj, pos + 1
+            if ch == ',':
+                if comma or not obj:
+                    self.note('extra_comma')
+                comma = True
+                pos += 1
+                continue
+            if ch != '"':
+                self.fail("Expecting property name enclosed in double quotes", pos)
+            if obj and not comma:
+                self.note('missing_comma')
+            try:
+                key, pos = self.key(pos + 1)
+            except _Truncated:
+                raise _Truncated(obj)
+            pos = _WS.match(text, pos).end()
+            if pos >= self.end:
+                raise _Truncated(obj)
+            if text[pos] != ':':
+                self.fail("Expecting ':' delimiter", pos)
+            try:
+                value, pos = self.value(pos + 1)
+            except _Truncated as truncated:
+                # An unfinished container keeps its complete members; a cut scalar is dropped
+                if truncated.value is not None:
+                    obj[key] = truncated.value
+                raise _Truncated(obj)
+            obj[key] = value
+            comma = False
+
+    def array(self, pos):
+        text = self.text
+        arr = []
+        comma = False
+        while True:
+            pos = _WS.match(text, pos).end()
+            if pos >= self.end:
+                raise _Truncated(arr)
+            ch = text[pos]
+            if ch == ']':
+                if comma:
+                    self.note('trailing_comma')
+                return arr, pos + 1
+            if ch == ',':
+                if comma or not arr:
+                    self.note('extra_comma')
+                comma = True
+                pos += 1
+                continue
+            if arr and not comma:
+                self.note('missing_comma')
+            try:
+                value, pos = self.value(pos)
+            except _Truncated:
+                # The unfinished element (e.g. a half-written item) is dropped
+                raise _Truncated(arr)
+            arr.append(value)
+            comma = False
+
+
+def repair_json(text):
+    """
+    Parse model output in one pass, repairing common defects (see module docstring).
+
+    Returns:
+        tuple: (value, list of repairs applied - empty for clean JSON)
+
+    Raises:
+        json.JSONDecodeError: no JSON value could be recovered
+    """
+    parser = _RepairParser(text or "")
+    value = parser.parse()
+    return value, parser.repairs
+
+
+def clean_keys(data):
+    """Remove backslashes from every key (for JSON already parsed elsewhere)."""
+    if isinstance(data, dict):
+        return {k.replace('\\', ''): clean_keys(v) for k, v in data.items()}
+    if isinstance(data, list):
+        return [clean_keys(item) for item in data]
+    return data
@@ -0,0 +1,470 @@
+"""
+Deterministic extraction for recurring vendor layouts.
+
+A template is learned from an accepted extraction and the OCR word boxes
+of the same document (pytesseract.image_to_data):
+
+    fingerprint  static words of page 1 with their coarse grid position;
+                 re-learning keeps only words present in every sample, so
+                 invoice-specific text drops out
+    fields       per header field, the label words ("Invoice No", "Total")
+                 the value sits right of or below, the value kind and how
+                 many words it spans
+    items        whether the generic item-line parser reproduces the
+                 accepted items on this layout
+    constants    vendor identity (Vendor_Name, VATIN) as accepted; used only
+                 when it is found in the new document's OCR text
+
+A new document whose page 1 matches a fingerprint is extracted by finding
+each label and reading the region next to it. Any missing label, a value
+of the wrong kind or failed sanity checks sends the document to the LLM.
+"""
+
+import collections
+import re
+import threading
+from collections import namedtuple
+
+from .validation import parse_amount, validate_extraction
+
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+try:
+    from pdf2image import convert_from_path, pdfinfo_from_path
+except ImportError:
+    convert_from_path = pdfinfo_from_path = None
+
+# Pixel box of one OCR word; line = (block, paragraph, line) within its page
+Word = namedtuple('Word', 'text left top right bottom line')
+Page = namedtuple('Page', 'width height words')
+
+# Vendor identity is copied from the template once it is found in the page text
+CONSTANT_FIELDS = ("Vendor_Name", "VATIN")
+
+# Fingerprint grid (columns x rows of page 1) and tolerance in cells
+GRID = (20, 40)
+MIN_FINGERPRINT_TOKENS = 10
+
+# Max distance (share of the page diagonal) between a label and its learned position
+ANCHOR_DRIFT = 0.15
+MAX_ANCHOR_WORDS = 3
+
+_DATE_RE = re.compile(r"\d{1,4}[\-/.]\d{1,2}[\-/.]\d{1,4}|\d{1,2}[\s\-]?[A-Za-z]{3,9}[\s\-,]*\d{2,4}")
+_AMOUNT_RE = re.compile(r"[A-Z]{0,3}\s?[\d,]*\d(?:\.\d{1,3})?")
+_ITEM_LINE_RE = re.compile(
+    r"^(?:(\d{1,3})[.)]?\s+)?(.*?[A-Za-z].*?)\s+(\d+(?:\.\d+)?)\s+(?:([A-Za-z]{1,6})\s+)?"
+    r"([\d,]*\d\.\d{2,3})\s+([\d,]*\d\.\d{2,3})\s*$"
+)
+
+
+def norm(text):
+    """Upper-case letters and digits only: 'Invoice No:' -> 'INVOICENO'."""
+    return re.sub(r"[^A-Z0-9]", "", str(text or "").upper())
+
+
+def value_kind(value):
+    value = str(value).strip()
+    if _DATE_RE.fullmatch(value):
+        return 'date'
+    if _AMOUNT_RE.fullmatch(value) and parse_amount(value)[0] is not None:
+        return 'amount'
+    return 'text'
+
+
+# ----------------------------------------------------------------------
+# OCR words
+# ----------------------------------------------------------------------
+
+def _split_label(text, box):
+    """'No:INV-123' -> 'No:' and 'INV-123', splitting the box in proportion."""
+    left, top, right, bottom = box
+    head, sep, tail = text.partition(':')
+    if not (sep and head and tail):
+        return [(text, box)]
+    cut = left + round((right - left) * (len(head) + 1) / len(text))
+    return [(head + sep, (left, top, cut, bottom)), (tail, (cut, top, right, bottom))]
+
+
+def page_from_data(data, width, height):
+    """Page of words from an image_to_data(output_type=DICT) result."""
+    words = []
+    for index, text in enumerate(data['text']):
+        text = (text or '').strip()
+        if not text:
+            continue
+        left, top = data['left'][index], data['top'][index]
+        box = (left, top, left + data['width'][index], top + data['height'][index])
+        line = (data['block_num'][index], data['par_num'][index], data['line_num'][index])
+        for part, part_box in _split_label(text, box):
+            words.append(Word(part, *part_box, line))
+    return Page(width, height, words)
+
+
+def lines_of(page):
+    """Words grouped by OCR line, in reading order."""
+    lines = collections.OrderedDict()
+    for word in page.words:
+        lines.setdefault(word.line, []).append(word)
+    return [sorted(words, key=lambda w: w.left) for words in lines.values()]
+
+
+def page_text(page):
+    """Plain text of a page: one line per OCR line, a blank line between blocks."""
+    out = []
+    previous = None
+    for words in lines_of(page):
+        block = words[0].line[0]
+        if previous is not None and block != previous:
+            out.append("")
+        out.append(" ".join(w.text for w in words))
+        previous = block
+    return "\n".join(out)
+
+
+def ocr_pages(file_path, dpi=300, tesseract_cmd=None, first_page=1, last_page=None):
+    """
+    OCR word boxes of the pages first_page..last_page (1-based, inclusive;
+    last_page=None = to the end) of a PDF or image.
+
+    Returns:
+        list: Page per page ([] when OCR is unavailable or fails)
+    """
+    if pytesseract is None:
+        return []
+    if tesseract_cmd:
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    if file_path.lower().endswith('.pdf'):
+        if convert_from_path is None:
+            return []
+        if first_page > 1 and first_page > pdfinfo_from_path(file_path)['Pages']:
+            return []
+        images = convert_from_path(file_path, dpi=dpi, first_page=first_page, last_page=last_page)
+    else:
+        if first_page > 1:
+            return []
+        from PIL import Image
+        images = [Image.open(file_path)]
+
+    pages = []
+    for image in images:
+        data = pytesseract.image_to_data(image, lang="eng", output_type=pytesseract.Output.DICT)
+        pages.append(page_from_data(data, *image.size))
+    return pages
+
+
+# ----------------------------------------------------------------------
+# Fingerprints
+# ----------------------------------------------------------------------
+
+def fingerprint(page):
+    """[token, column, row] for every word of 3+ letters on the page."""
+    cells = set()
+    for word in page.words:
+        token = norm(word.text)
+        if len(token) < 3 or not token.isalpha():
+            continue
+        column = int((word.left + word.right) / 2 / page.width * GRID[0])
+        row = int((word.top + word.bottom) / 2 / page.height * GRID[1])
+        cells.add((token, column, row))
+    return sorted([list(cell) for cell in cells])
+
+
+def _cell_index(cells):
+    index = collections.defaultdict(list)
+    for token, column, row in cells:
+        index[token].append((column, row))
+    return index
+
+
+def _present(index, token, column, row):
+    return any(abs(column - c) <= 1 and abs(row - r) <= 1 for c, r in index.get(token, ()))
+
+
+def match_score(template_cells, document_cells):
+    """Share of the template's static words found near the same place in the document."""
+    if len(template_cells) < MIN_FINGERPRINT_TOKENS:
+        return 0.0
+    index = _cell_index(document_cells)
+    found = sum(1 for token, column, row in template_cells if _present(index, token, column, row))
+    return found / len(template_cells)
+
+
+def merge_fingerprints(old, new):
+    """Words of `old` that are also in `new` (the static part of the layout)."""
+    index = _cell_index(new)
+    kept = [cell for cell in old if _present(index, *cell)]
+    return kept if len(kept) >= MIN_FINGERPRINT_TOKENS else new
+
+
+# ----------------------------------------------------------------------
+# Anchored field regions
+# ----------------------------------------------------------------------
+
+def _locate(page, value):
+    """Word span of `value` on the page, preferring one with a label on its left."""
+    target = norm(value)
+    if not target:
+        return None
+    spans = []
+    for words in lines_of(page):
+        for i in range(len(words)):
+            joined = ""
+            for j in range(i, min(i + 8, len(words))):
+                joined += norm(words[j].text)
+                if joined == target:
+                    spans.append((words, i, j))
+                if len(joined) >= len(target):
+                    break
+    if not spans:
+        return None
+    labelled = [s for s in spans if s[1] > 0 and re.search(r"[A-Za-z]", s[0][s[1] - 1].text)]
+    return (labelled or spans)[0]
+
+
+def _anchor_words(page, words, i, j):
+    """Label words for the span words[i..j]: on its left, else on the line above."""
+    height = max(w.bottom - w.top for w in words[i:j + 1])
+    label = []
+    k = i - 1
+    while k >= 0 and len(label) < MAX_ANCHOR_WORDS and re.search(r"[A-Za-z]", words[k].text):
+        nxt = label[0] if label else words[i]
+        if nxt.left - words[k].right > 3 * height:
+            break
+        label.insert(0, words[k])
+        k -= 1
+    if label:
+        return label, 'right'
+
+    top = words[i].top
+    left, right = words[i].left, words[j].right
+    above = []
+    for line in lines_of(page):
+        if line[0].bottom <= top and top - line[0].bottom <= 3 * height:
+            overlap = [w for w in line if w.right >= left - height and w.left <= right + height]
+            if overlap and re.search(r"[A-Za-z]", " ".join(w.text for w in overlap)):
+                above.append(overlap)
+    if not above:
+        return None, None
+    label = max(above, key=lambda ws: ws[0].bottom)[:MAX_ANCHOR_WORDS]
+    return label, 'below'
+
+
+def learn_field(pages, value):
+    """Rule for reading `value` back from this layout, or None if it cannot be anchored."""
+    for number, page in enumerate(pages):
+        found = _locate(page, value)
+        if not found:
+            continue
+        words, i, j = found
+        label, relation = _anchor_words(page, words, i, j)
+        if not label:
+            continue
+        return {
+            'page': 0 if number == 0 else (-1 if number == len(pages) - 1 else number),
+            'anchor': [norm(w.text) for w in label],
+            'relation': relation,
+            'at': [round(label[0].left / page.width, 4), round(label[0].top / page.height, 4)],
+            'words': j - i + 1,
+            'kind': value_kind(value),
+        }
+    return None
+
+
+def _find_anchor(page, rule):
+    """The anchor occurrence closest to its learned position (within ANCHOR_DRIFT)."""
+    anchor = rule['anchor']
+    best = None
+    for words in lines_of(page):
+        tokens = [norm(w.text) for w in words]
+        for i in range(len(words) - len(anchor) + 1):
+            if tokens[i:i + len(anchor)] != anchor:
+                continue
+            x, y = words[i].left / page.width, words[i].top / page.height
+            distance = ((x - rule['at'][0]) ** 2 + (y - rule['at'][1]) ** 2) ** 0.5
+            if distance <= ANCHOR_DRIFT and (best is None or distance < best[0]):
+                best = (distance, words, i, i + len(anchor) - 1)
+    return best and best[1:]
+
+
+def read_field(pages, rule):
+    """Value of one field by its rule, or None when the label or a valid value is missing."""
+    try:
+        page = pages[rule['page']]
+    except IndexError:
+        return None
+    found = _find_anchor(page, rule)
+    if not found:
+        return None
+    words, first, last = found
+    height = max(w.bottom - w.top for w in words[first:last + 1])
+    limit = rule['words'] if rule['kind'] != 'text' else rule['words'] + 3
+
+    if rule['relation'] == 'right':
+        candidates = words[last + 1:]
+    else:
+        left, right = words[first].left - height, words[last].right + height
+        below = [
+            line for line in lines_of(page)
+            if line[0].top >= words[first].bottom and line[0].top - words[first].bottom <= 3 * height
+        ]
+        if not below:
+            return None
+        line = min(below, key=lambda ws: ws[0].top)
+        candidates = [w for w in line if w.right >= left and w.left <= right + 10 * height]
+
+    value = []
+    for word in candidates:
+        if value and word.left - value[-1].right > 1.5 * height:
+            break
+        value.append(word)
+        if len(value) >= limit:
+            break
+    text = " ".join(w.text for w in value).strip(" :")
+    if not text or value_kind(text) != rule['kind'] and rule['kind'] != 'text':
+        return None
+    return text
+
+
+# ----------------------------------------------------------------------
+# Items
+# ----------------------------------------------------------------------
+
+def parse_item_lines(text):
+    """Item rows from lines ending in quantity, unit price and amount."""
+    items = []
+    for line in (text or "").splitlines():
+        match = _ITEM_LINE_RE.match(line.strip())
+        if not match:
+            continue
+        no, description, quantity, unit, price, amount = match.groups()
+        items.append({
+            "Item_No": no or str(len(items) + 1),
+            "Item_Description": description.strip(),
+            "Quantity": quantity,
+            "Unit": unit or "",
+            "Unit_Price": price,
+            "Amount": amount,
+        })
+    return items
+
+
+def _same_amounts(parsed, accepted):
+    if len(parsed) != len(accepted):
+        return False
+    for a, b in zip(parsed, accepted):
+        x, y = parse_amount(a.get("Amount"))[0], parse_amount(b.get("Amount"))[0]
+        if x is None or y is None or abs(x - y) > 0.01:
+            return False
+    return True
+
+
+# ----------------------------------------------------------------------
+# Learn / extract
+# ----------------------------------------------------------------------
+
+def learn(pages, text, data, fields):
+    """
+    Template rules from an accepted extraction of the document OCR'd as `pages`.
+
+    Returns:
+        dict: {'fields': {...}, 'items': bool, 'has_items': bool, 'constants': {...}}
+    """
+    rules = {'fields': {}, 'constants': {}}
+    for field in fields:
+        value = data.get(field)
+        if field == "Items" or not isinstance(value, str) or not value.strip():
+            continue
+        if field in CONSTANT_FIELDS:
+            rules['constants'][field] = value
+            continue
+        rule = learn_field(pages, value)
+        if rule:
+            rules['fields'][field] = rule
+
+    accepted = [i for i in data.get("Items") or [] if isinstance(i, dict)]
+    rules['has_items'] = bool(accepted)
+    rules['items'] = bool(accepted) and _same_amounts(parse_item_lines(text), accepted)
+    return rules
+
+
+def extract(rules, pages, text, fields):
+    """
+    Returns:
+        tuple: (data dict, problems list) - use the data only when problems is empty
+    """
+    data = {field: "" for field in fields if field != "Items"}
+    problems = []
+    for field, rule in rules['fields'].items():
+        value = read_field(pages, rule)
+        if value is None:
+            problems.append(f"{field}: no value at '{' '.join(rule['anchor'])}'")
+        elif field in data:
+            data[field] = value
+    # Vendors sharing one ERP layout match each other's fingerprint: the
+    # template's identity is only used when this document carries it
+    page = norm(text)
+    for field, value in rules['constants'].items():
+        if field not in data:
+            continue
+        if norm(value) and norm(value) in page:
+            data[field] = value
+        else:
+            problems.append(f"{field}: '{value}' not found on this document")
+
+    if "Items" in fields:
+        data["Items"] = parse_item_lines(text) if rules['items'] else []
+        if rules['has_items'] and not data["Items"]:
+            problems.append("Items: no item rule for this layout" if not rules['items'] else "Items: no item lines")
+    problems += validate_extraction(data)
+    return data, problems
+
+
+def best_match(templates, page, threshold):
+    """
+    Args:
+        templates: objects with a `fingerprint` list
+    Returns:
+        tuple: (template, score) of the best match at or above `threshold`, else (None, best score)
+    """
+    cells = fingerprint(page)
+    best, best_score = None, 0.0
+    for template in templates:
+        score = match_score(template.fingerprint, cells)
+        if score > best_score:
+            best, best_score = template, score
+    if best_score >= threshold:
+        return best, round(best_score, 3)
+    return None, round(best_score, 3)
+
+
+class FastPathStats:
+    """Process-wide fast-path counters: documents tried, template matches, hits and fallbacks."""
+
+    def __init__(self):
+        self._counts = collections.Counter()
+        self._reasons = collections.Counter()
+        self._lock = threading.Lock()
+
+    def record(self, outcome, reason=None):
+        with self._lock:
+            self._counts['documents'] += 1
+            self._counts[outcome] += 1
+            if reason:
+                self._reasons[reason] += 1
+
+    def status(self):
+        with self._lock:
+            counts = dict(self._counts)
+            reasons = dict(self._reasons.most_common(10))
+        documents = counts.get('documents', 0)
+        return {
+            'documents': documents,
+            'hits': counts.get('hit', 0),
+            'fallbacks': counts.get('fallback', 0),
+            'no_match': counts.get('no_match', 0),
+            'hit_rate': round(counts.get('hit', 0) / documents, 3) if documents else 0.0,
+            'fallback_reasons': reasons,
+        }
@@ -0,0 +1,141 @@
+"""
+Two-tier cache of successful LLM extraction results.
+
+Queue retries, re-runs after a reset and identical text-layer invoices all
+send byte-identical prompts. Results are keyed by a hash of the model,
+generation options, output format, whitespace-normalized prompt and image
+digests, kept in an in-process LRU and in JSON files on disk, and expire
+after a TTL.
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(prompt):
+    return " ".join((prompt or "").split())
+
+
+def cache_key(payload):
+    """
+    Stable hash of everything in a generate payload that affects the output.
+    Images may be given as base64 strings or raw bytes.
+    """
+    images = [
+        hashlib.sha256(image if isinstance(image, bytes) else image.encode('ascii')).hexdigest()
+        for image in payload.get('images') or []
+    ]
+    material = {
+        'model': payload.get('model'),
+        'options': payload.get('options') or {},
+        'format': payload.get('format'),
+        'prompt': normalize_prompt(payload.get('prompt')),
+        'images': images,
+    }
+    encoded = json.dumps(material, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    """
+    Args:
+        max_entries: size of the in-memory LRU tier
+        directory: folder for the disk tier (None = memory only)
+        ttl: seconds an entry stays valid
+    """
+
+    def __init__(self, max_entries=256, directory=None, ttl=7 * 24 * 3600):
+        self.max_entries = max_entries
+        self.directory = str(directory) if directory else None
+        self.ttl = ttl
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = collections.Counter()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _remember(self, key, expires, encoded):
+        self._memory[key] = (expires, encoded)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._counts['evictions'] += 1
+
+    def get(self, key):
+        """
+        Returns:
+            tuple: (value, tier) where tier is 'memory' or 'disk'; (None, None) on a miss
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self._counts['memory_hits'] += 1
+                    return json.loads(entry[1]), 'memory'
+                del self._memory[key]
+                self._counts['expired'] += 1
+
+        if self.directory:
+            path = self._path(key)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    stored = json.load(f)
+                if stored['expires'] > now:
+                    encoded = json.dumps(stored['value'])
+                    with self._lock:
+                        self._remember(key, stored['expires'], encoded)
+                        self._counts['disk_hits'] += 1
+                    return stored['value'], 'disk'
+                os.remove(path)
+                with self._lock:
+                    self._counts['expired'] += 1
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"[CACHE] Unreadable cache entry {path}: {e}")
+
+        with self._lock:
+            self._counts['misses'] += 1
+        return None, None
+
+    def set(self, key, value):
+        expires = time.time() + self.ttl
+        encoded = json.dumps(value)
+        with self._lock:
+            self._remember(key, expires, encoded)
+            self._counts['stores'] += 1
+
+        if self.directory:
+            path = self._path(key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Write-then-rename so concurrent readers never see a partial file
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump({'expires': expires, 'value': value}, f)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning(f"[CACHE] Could not write cache entry {path}: {e}")
+
+    def metrics(self):
+        with self._lock:
+            counts = dict(self._counts)
+            size = len(self._memory)
+        hits = counts.get('memory_hits', 0) + counts.get('disk_hits', 0)
+        lookups = hits + counts.get('misses', 0)
+        counts.update({
+            'memory_entries': size,
+            'hit_rate': round(hits / lookups, 3) if lookups else 0.0,
+        })
+        return counts
@@ -0,0 +1,63 @@
+"""
+Complexity-based model routing.
+
+Each document is scored from its page count, estimated number of line
+items, OCR quality and whether it has a native text layer. Simple invoices
+go to the small, fast model; the router only escalates to a larger model
+when the extraction fails validation.
+"""
+
+import re
+
+_AMOUNT_RE = re.compile(r"\d+[.,]\d{2,3}\b")
+_TOKEN_RE = re.compile(r"\S+")
+_CLEAN_TOKEN_RE = re.compile(r"^(?:[A-Za-z]{2,}|[\d.,/\-:%]+|[A-Za-z]+\d+|\d+[A-Za-z]+)[.,:;)]?$")
+
+
+def estimate_item_count(text):
+    """Lines that carry two or more money-like amounts are probably item lines."""
+    return sum(1 for line in (text or "").splitlines() if len(_AMOUNT_RE.findall(line)) >= 2)
+
+
+def ocr_confidence(text):
+    """
+    Share of tokens that look like real words or numbers (0..1).
+    OCR noise ('|', 'l1I', '~~') lowers it.
+    """
+    tokens = _TOKEN_RE.findall(text or "")
+    if not tokens:
+        return 0.0
+    clean = sum(1 for t in tokens if _CLEAN_TOKEN_RE.match(t))
+    return clean / len(tokens)
+
+
+def score_document(page_count, item_count, confidence, has_text_layer):
+    """
+    Complexity score (higher = harder). Roughly:
+    one clean single-page invoice with a few items scores below 1.
+
+    Returns:
+        tuple: (score, factors dict)
+    """
+    factors = {
+        'page_count': page_count,
+        'item_count': item_count,
+        'ocr_confidence': round(confidence, 3),
+        'has_text_layer': has_text_layer,
+    }
+    score = 0.0
+    score += max(0, page_count - 1) * 0.75
+    score += item_count / 15.0
+    score += max(0.0, 0.85 - confidence) * 5
+    if not has_text_layer:
+        score += 0.5
+    return round(score, 3), factors
+
+
+def choose_tier(score, thresholds):
+    """Index of the first model tier whose threshold the score does not exceed."""
+    for index, limit in enumerate(thresholds):
+        if score <= limit:
+            return index
+    return len(thresholds)
+
@@ -0,0 +1,166 @@
+"""
+Ollama model warm-up and keep-alive.
+
+Loading a model into memory is the slowest part of the first request after
+Ollama has unloaded it. Workers pre-load the configured models on every pool
+endpoint at startup and, during working hours, keep them resident by
+re-sending an empty generate request with a long keep_alive before the
+previous one expires. Outside working hours Ollama's own idle timeout
+applies so the memory is released.
+"""
+
+import logging
+import threading
+import time
+
+import requests
+from django.utils import timezone
+
+from .http_client import client as http_client
+from .ollama_pool import normalize_model
+
+logger = logging.getLogger(__name__)
+
+
+def in_working_hours(hours, days, now=None):
+    """
+    Args:
+        hours: (start_hour, end_hour) in local time, end exclusive
+        days: weekday numbers (Monday = 0)
+    """
+    now = now or timezone.localtime()
+    start, end = hours
+    return now.weekday() in days and start <= now.hour < end
+
+
+def loaded_models(base_url, timeout=5):
+    """Models resident on one Ollama host, from /api/ps."""
+    response = http_client.get(f"{base_url}/api/ps", timeout=timeout, max_retries=0)
+    response.raise_for_status()
+    return {
+        normalize_model(m.get('name')): {
+            'expires_at': m.get('expires_at'),
+            'size_vram': m.get('size_vram'),
+        }
+        for m in response.json().get('models', [])
+    }
+
+
+class ModelWarmer:
+    """
+    Args:
+        pool: OllamaPool whose endpoints are warmed
+        models: model names to keep loaded
+        keep_alive: keep_alive sent during working hours (e.g. '2h', -1 = forever)
+        hours / days: working hours window (see in_working_hours)
+        interval: seconds between keep-alive refreshes (must be shorter than keep_alive)
+        timeout: seconds allowed for one model load
+    """
+
+    def __init__(self, pool, models, keep_alive='2h', hours=(7, 20), days=(0, 1, 2, 3, 4, 5),
+                 interval=600, timeout=300):
+        self.pool = pool
+        self.models = [m for m in dict.fromkeys(models) if m]
+        self.keep_alive = keep_alive
+        self.hours = hours
+        self.days = days
+        self.interval = interval
+        self.timeout = timeout
+        self._records = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def keep_alive_value(self):
+        """keep_alive for generate payloads (None outside working hours = Ollama default)."""
+        if self.keep_alive is None or not in_working_hours(self.hours, self.days):
+            return None
+        return self.keep_alive
+
+    def warm(self, base_url, model):
+        """Load `model` on one host. An empty prompt makes Ollama load without generating."""
+        payload = {'model': model, 'prompt': '', 'stream': False}
+        keep_alive = self.keep_alive_value()
+        if keep_alive is not None:
+            payload['keep_alive'] = keep_alive
+
+        start = time.time()
+        record = {'last_warmed': None, 'load_seconds': None, 'error': ''}
+        try:
+            # A timed-out load is not repeated: the host is busy loading already
+            response = http_client.post(
+                f"{base_url}/api/generate", json=payload, timeout=self.timeout, idempotent=True, retry_timeouts=False,
+            )
+            response.raise_for_status()
+            body = response.json()
+            # load_duration is reported in nanoseconds; near zero when already resident
+            record['load_seconds'] = round(body.get('load_duration', 0) / 1e9, 2)
+            record['last_warmed'] = timezone.now().isoformat()
+            logger.info(f"[WARMUP] {model} on {base_url} ready (load {record['load_seconds']}s, {time.time() - start:.1f}s total)")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            record['error'] = str(e)
+            logger.warning(f"[WARMUP] Could not load {model} on {base_url}: {e}")
+
+        with self._lock:
+            self._records[(base_url, normalize_model(model))] = record
+        return not record['error']
+
+    def warm_all(self):
+        """Warm every model on every live endpoint that has it."""
+        results = {}
+        for endpoint in self.pool.endpoints:
+            if endpoint.ejected:
+                continue
+            for model in self.models:
+                if endpoint.has_model(model):
+                    results[(endpoint.url, model)] = self.warm(endpoint.url, model)
+        return results
+
+    def _loop(self):
+        # Always warm once at startup; afterwards only refresh during working hours
+        first = True
+        while True:
+            try:
+                if first or in_working_hours(self.hours, self.days):
+                    self.warm_all()
+            except Exception as e:
+                logger.error(f"[WARMUP] Warm-up loop error: {e}")
+            first = False
+            time.sleep(self.interval)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None or not self.models:
+                return
+            self._thread = threading.Thread(target=self._loop, name='ollama-warmup', daemon=True)
+            self._thread.start()
+
+    def status(self):
+        """Per endpoint and model: whether it is resident right now and the last warm-up."""
+        with self._lock:
+            records = dict(self._records)
+
+        endpoints = []
+        for endpoint in self.pool.status():
+            try:
+                resident = loaded_models(endpoint['url'])
+                error = ''
+            except (requests.exceptions.RequestException, ValueError) as e:
+                resident = None
+                error = str(e)
+
+            models = {}
+            for model in self.models:
+                name = normalize_model(model)
+                entry = {'loaded': None if resident is None else name in resident}
+                if resident and name in resident:
+                    entry.update(resident[name])
+                entry.update(records.get((endpoint['url'], name), {}))
+                models[model] = entry
+            endpoints.append(dict(endpoint, models=models, ps_error=error))
+
+        return {
+            'working_hours': in_working_hours(self.hours, self.days),
+            'keep_alive': self.keep_alive_value(),
+            'warmer_running': self._thread is not None,
+            'endpoints': endpoints,
+        }
@@ -0,0 +1,197 @@
+"""
+Load-balanced pool of Ollama endpoints.
+
+Each endpoint is health-checked in the background (/api/tags for the models
+it has, /api/ps for the models currently loaded in memory). Requests go to
+the healthy endpoint with the fewest outstanding requests; among equally
+busy hosts, one that already has the model loaded wins. Load comes first so
+a second host takes traffic (and loads the model) instead of sitting idle
+while requests queue on the host that happened to load it first. Endpoints
+that keep failing are ejected for a cool-down period and re-admitted once a
+health check passes.
+"""
+
+import contextlib
+import logging
+import random
+import threading
+import time
+
+import requests
+
+from .http_client import client as http_client
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_model(name):
+    """'llama3.2' and 'llama3.2:latest' are the same model to Ollama."""
+    if not name:
+        return name
+    return name if ':' in name else f"{name}:latest"
+
+
+class Endpoint:
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.healthy = True          # Optimistic until the first check says otherwise
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.available_models = None  # None = unknown (not checked yet)
+        self.loaded_models = set()
+        self.last_check = None
+        self.last_error = ''
+
+    @property
+    def ejected(self):
+        return time.time() < self.ejected_until
+
+    def has_model(self, model):
+        return self.available_models is None or normalize_model(model) in self.available_models
+
+    def as_dict(self):
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'ejected': self.ejected,
+            'outstanding': self.outstanding,
+            'consecutive_failures': self.consecutive_failures,
+            'available_models': sorted(self.available_models) if self.available_models is not None else None,
+            'loaded_models': sorted(self.loaded_models),
+            'last_check': self.last_check,
+            'last_error': self.last_error,
+        }
+
+
+class OllamaPool:
+    """
+    Args:
+        urls: Ollama base URLs
+        health_interval: seconds between background health checks
+        eject_after: consecutive failures before an endpoint is ejected
+        eject_seconds: cool-down before an ejected endpoint may be re-admitted
+    """
+
+    def __init__(self, urls, health_interval=15, eject_after=3, eject_seconds=30):
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.health_interval = health_interval
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self._lock = threading.Lock()
+        self._checker = None
+
+    # ------------------------------------------------------------------
+    # Health checks
+    # ------------------------------------------------------------------
+
+    def check(self, endpoint):
+        """Refresh one endpoint's model lists; re-admits it on success."""
+        try:
+            tags = http_client.get(f"{endpoint.url}/api/tags", timeout=5, max_retries=0)
+            tags.raise_for_status()
+            available = {normalize_model(m.get('name')) for m in tags.json().get('models', [])}
+            loaded = set()
+            try:
+                ps = http_client.get(f"{endpoint.url}/api/ps", timeout=5, max_retries=0)
+                if ps.ok:
+                    loaded = {normalize_model(m.get('name')) for m in ps.json().get('models', [])}
+            except requests.exceptions.RequestException:
+                pass
+        except (requests.exceptions.RequestException, ValueError) as e:
+            with self._lock:
+                endpoint.last_check = time.time()
+                endpoint.last_error = str(e)
+                endpoint.healthy = False
+                self._register_failure(endpoint)
+            return False
+
+        with self._lock:
+            if not endpoint.healthy or endpoint.ejected_until:
+                logger.info(f"[POOL] Re-admitting Ollama endpoint {endpoint.url}")
+            endpoint.available_models = available
+            endpoint.loaded_models = loaded
+            endpoint.healthy = True
+            endpoint.consecutive_failures = 0
+            endpoint.ejected_until = 0.0
+            endpoint.last_check = time.time()
+            endpoint.last_error = ''
+        return True
+
+    def check_all(self):
+        for endpoint in self.endpoints:
+            # Ejected endpoints are only probed once their cool-down has passed
+            if endpoint.ejected:
+                continue
+            self.check(endpoint)
+
+    def _health_loop(self):
+        while True:
+            try:
+                self.check_all()
+            except Exception as e:
+                logger.error(f"[POOL] Health check loop error: {e}")
+            time.sleep(self.health_interval)
+
+    def start_health_checks(self):
+        with self._lock:
+            if self._checker is not None or not self.health_interval:
+                return
+            self._checker = threading.Thread(target=self._health_loop, name='ollama-health', daemon=True)
+            self._checker.start()
+
+    # ------------------------------------------------------------------
+    # Routing
+    # ------------------------------------------------------------------
+
+    def _register_failure(self, endpoint):
+        endpoint.consecutive_failures += 1
+        if endpoint.consecutive_failures >= self.eject_after and not endpoint.ejected:
+            endpoint.ejected_until = time.time() + self.eject_seconds
+            logger.warning(f"[POOL] Ejecting Ollama endpoint {endpoint.url} for {self.eject_seconds}s")
+
+    def choose(self, model, exclude=()):
+        """Pick an endpoint for `model` (least outstanding, then model-loaded)."""
+        with self._lock:
+            live = [e for e in self.endpoints if e.url not in exclude and not e.ejected and e.healthy]
+            candidates = [e for e in live if e.has_model(model)] or live
+            if not candidates:
+                # Fail open: better to try a suspect host than to fail every task
+                pool = [e for e in self.endpoints if e.url not in exclude] or self.endpoints
+                return min(pool, key=lambda e: e.ejected_until)
+
+            target = normalize_model(model)
+            random.shuffle(candidates)  # Spread ties
+            return min(candidates, key=lambda e: (e.outstanding, target not in e.loaded_models))
+
+    @contextlib.contextmanager
+    def lease(self, model, exclude=()):
+        """
+        Reserve an endpoint for one request; yields its base URL.
+        Network failures inside the block count against the endpoint.
+        """
+        self.start_health_checks()
+        endpoint = self.choose(model, exclude)
+        with self._lock:
+            endpoint.outstanding += 1
+        try:
+            yield endpoint.url
+        except requests.exceptions.RequestException as e:
+            response = getattr(e, 'response', None)
+            # 4xx (e.g. unknown model) is the caller's problem, not the host's
+            if response is None or response.status_code >= 500:
+                with self._lock:
+                    endpoint.last_error = str(e)
+                    self._register_failure(endpoint)
+            raise
+        else:
+            with self._lock:
+                endpoint.consecutive_failures = 0
+                endpoint.loaded_models.add(normalize_model(model))
+        finally:
+            with self._lock:
+                endpoint.outstanding -= 1
+
+    def status(self):
+        with self._lock:
+            return [e.as_dict() for e in self.endpoints]
@@ -5,12 +5,42 @@ Integrates: Ollama, n8n, OCR, PO detection, VAT/TRN extraction, and Oracle DB in
 
 import requests
 import json
+import mimetypes
 import time
 import re
 import os
 import traceback
 import logging
+import contextlib
+import threading
+from decimal import Decimal
 from django.conf import settings
+from core.storage import local_copy
+from .http_client import client as http_client, is_read_timeout
+from .ollama_pool import OllamaPool
+from .model_warmup import ModelWarmer
+from .concurrency import (
+    AdaptiveLimiter, Cancelled, LatencyTracker, cancellation, cancelled, current_cancellation,
+)
+from .circuit_breaker import CircuitBreaker
+from .llm_cache import LLMCache, cache_key
+from .json_stream import IncrementalJSONScanner, SchemaDivergence, clean_keys, repair_json
+from .vision_payload import IMAGE_EXTENSIONS, StreamedGenerateBody, prepare_images
+from . import oracle_db
+from .po_matcher import PrefixMatcher
+from .trn_index import TrnIndex, normalize_trn
+from .candidates import PO_DIGITS, PO_FIELDS, VAT, CandidateScanner, best_prefixed, of_kind, unique_values
+from .prompt_builder import build_invoice_text, estimate_tokens
+from .item_chunks import chunk_lines, clean_text, header_text, merge_items
+from . import layout_templates
+from .layout_templates import FastPathStats, best_match, fingerprint, merge_fingerprints, page_text
+from .model_router import (
+    choose_tier, estimate_item_count, ocr_confidence, score_document,
+)
+from .validation import parse_amount, validate, validate_extraction
+from .invoice_splitter import (
+    PAGE_SEPARATOR, detect_invoice_segments, read_pdf_pages, segment_text, split_pages,
+)
 import logging
 from django.conf import settings
 
@@ -45,6 +75,130 @@ except ImportError:
 OLLAMA_BASE_URL = getattr(settings, 'OLLAMA_BASE_URL', 'http://127.0.0.1:11435')
 OLLAMA_MODEL = getattr(settings, 'OLLAMA_MODEL', 'llama3.1:latest')
 N8N_WEBHOOK_URL = getattr(settings, 'N8N_WEBHOOK_URL', 'http://localhost:5678/webhook/invoice_extract')
+N8N_TIMEOUT = getattr(settings, 'N8N_TIMEOUT', 300)
+# Skip n8n and go straight to direct Ollama while the webhook is failing or hanging
+n8n_breaker = CircuitBreaker('n8n', **getattr(settings, 'N8N_CIRCUIT_BREAKER', {}))
+n8n_latency = LatencyTracker()
+
+# Hedging: if n8n is slower than this percentile of its recent latency, race
+# direct Ollama on the OCR text and keep whichever valid result comes first
+HEDGE_N8N = getattr(settings, 'HEDGE_N8N', True)
+HEDGE_PERCENTILE = getattr(settings, 'HEDGE_PERCENTILE', 90)
+HEDGE_DEFAULT_DELAY = getattr(settings, 'HEDGE_DEFAULT_DELAY', 60)  # Until enough latencies are known
+HEDGE_MAX_INFLIGHT = getattr(settings, 'HEDGE_MAX_INFLIGHT', 2)     # Concurrent hedges sent to Ollama
+_hedge_slots = threading.BoundedSemaphore(max(1, HEDGE_MAX_INFLIGHT))
+
+# Pool of Ollama hosts (least-outstanding routing, health checks, ejection)
+OLLAMA_ENDPOINTS = getattr(settings, 'OLLAMA_ENDPOINTS', None) or [OLLAMA_BASE_URL]
+ollama_pool = OllamaPool(
+    OLLAMA_ENDPOINTS,
+    health_interval=getattr(settings, 'OLLAMA_HEALTH_INTERVAL', 15),
+    eject_after=getattr(settings, 'OLLAMA_EJECT_AFTER_FAILURES', 3),
+    eject_seconds=getattr(settings, 'OLLAMA_EJECT_SECONDS', 30),
+)
+
+# AIMD limit on concurrent /api/generate calls per endpoint, adapted to observed p95 latency
+OLLAMA_CONCURRENCY = getattr(settings, 'OLLAMA_CONCURRENCY', {})
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def generate_limiter(base_url):
+    """The adaptive concurrency limiter for one Ollama endpoint."""
+    with _limiters_lock:
+        limiter = _limiters.get(base_url)
+        if limiter is None:
+            limiter = _limiters[base_url] = AdaptiveLimiter(**OLLAMA_CONCURRENCY)
+        return limiter
+
+
+def concurrency_status():
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {url: limiter.status() for url, limiter in limiters.items()}
+
+# Stream /api/generate tokens and stop as soon as the JSON object closes (or diverges)
+OLLAMA_STREAMING = getattr(settings, 'OLLAMA_STREAMING', True)
+OLLAMA_STREAM_IDLE_TIMEOUT = getattr(settings, 'OLLAMA_STREAM_IDLE_TIMEOUT', 60)
+# Runaway-generation guard: abort a stream past this many characters (None = no limit).
+# Sized for long item lists, not for a typical invoice.
+OLLAMA_STREAM_MAX_CHARS = getattr(settings, 'OLLAMA_STREAM_MAX_CHARS', 200000)
+
+# Constrain Ollama's decoder: 'schema' (JSON schema, Ollama >= 0.5), 'json' (any JSON) or None
+OLLAMA_OUTPUT_FORMAT = getattr(settings, 'OLLAMA_OUTPUT_FORMAT', 'schema')
+
+# Model tiers, smallest first. Documents are routed by complexity score and
+# escalated one tier at a time when the extraction fails validation.
+OLLAMA_MODEL_TIERS = getattr(settings, 'OLLAMA_MODEL_TIERS', None) or [OLLAMA_MODEL]
+# Max complexity score for each tier except the last (which takes everything above)
+MODEL_ROUTING_THRESHOLDS = getattr(settings, 'MODEL_ROUTING_THRESHOLDS', [2.0])
+MODEL_ESCALATION = getattr(settings, 'MODEL_ESCALATION', True)
+
+# Pre-load models on every endpoint and keep them resident during working hours
+model_warmer = ModelWarmer(
+    ollama_pool,
+    models=getattr(settings, 'OLLAMA_WARM_MODELS', None) or OLLAMA_MODEL_TIERS,
+    keep_alive=getattr(settings, 'OLLAMA_KEEP_ALIVE', '2h'),
+    hours=getattr(settings, 'OLLAMA_WORKING_HOURS', (7, 20)),
+    days=getattr(settings, 'OLLAMA_WORKING_DAYS', (0, 1, 2, 3, 4, 5)),
+    interval=getattr(settings, 'OLLAMA_WARMUP_INTERVAL', 600),
+    timeout=getattr(settings, 'OLLAMA_WARMUP_TIMEOUT', 300),
+)
+
+# Cache of successful extractions keyed by (model, options, normalized prompt, images)
+LLM_CACHE_ENABLED = getattr(settings, 'LLM_CACHE_ENABLED', True)
+llm_cache = LLMCache(
+    max_entries=getattr(settings, 'LLM_CACHE_MAX_ENTRIES', 256),
+    directory=getattr(settings, 'LLM_CACHE_DIR', None),
+    ttl=getattr(settings, 'LLM_CACHE_TTL', 7 * 24 * 3600),
+)
+
+
+def cached_result(payload, use_cache):
+    """
+    Returns:
+        tuple: (cache key or None when caching is off, cached result or None)
+    """
+    if not (use_cache and LLM_CACHE_ENABLED):
+        return None, None
+    key = cache_key(payload)
+    value, tier = llm_cache.get(key)
+    if value is not None:
+        logger.info(f"[CACHE] {tier} hit for {payload.get('model')}")
+        value['cache'] = tier
+    return key, value
+
+
+def cacheable(data, repairs, partial=False):
+    """
+    Cut-off output and extractions whose numbers do not add up are not
+    cached, so a retry (or a forced restart) asks the model again.
+    Partial extractions (chunk calls) are judged only on the checks their
+    fields allow.
+    """
+    if 'truncated' in repairs:
+        return False
+    report = validate(data)
+    if not partial:
+        return report['valid']
+    return not any(flag['status'] == 'mismatch' for flag in report['fields'].values())
+
+
+# Vision path: downscale/re-encode images and render PDF pages before sending
+VISION_MAX_SIDE = getattr(settings, 'VISION_MAX_SIDE', 1344)
+VISION_JPEG_QUALITY = getattr(settings, 'VISION_JPEG_QUALITY', 85)
+VISION_MAX_PAGES = getattr(settings, 'VISION_MAX_PAGES', 3)
+VISION_PDF_DPI = getattr(settings, 'VISION_PDF_DPI', 150)
+
+# Max estimated tokens of invoice text placed in the prompt (None = no limit)
+PROMPT_TOKEN_BUDGET = getattr(settings, 'PROMPT_TOKEN_BUDGET', 2000)
+
+# Map-reduce extraction for long item tables: header fields once, items per overlapping chunk
+CHUNKED_EXTRACTION = getattr(settings, 'CHUNKED_EXTRACTION', True)
+CHUNK_MIN_ITEMS = getattr(settings, 'CHUNK_MIN_ITEMS', 25)        # Also chunk when text exceeds PROMPT_TOKEN_BUDGET
+CHUNK_TOKENS = getattr(settings, 'CHUNK_TOKENS', 800)
+CHUNK_OVERLAP_LINES = getattr(settings, 'CHUNK_OVERLAP_LINES', 3)
+CHUNK_WORKERS = getattr(settings, 'CHUNK_WORKERS', 4)
 
 # Folder Configuration
 SAVE_FOLDER = "static/invoices"
@@ -82,6 +236,12 @@ _base_prefixes = set(PO_PREFIXES)
 _base_prefixes.update(PREFIX_MAPPING.keys())
 SEARCH_PREFIXES = sorted(list(_base_prefixes), key=len, reverse=True)
 
+# All SEARCH_PREFIXES compiled into one pattern: one pass over a text finds every prefixed PO
+po_matcher = PrefixMatcher(SEARCH_PREFIXES, PREFIX_MAPPING)
+
+# One pass per text for prefixed POs, 8-digit POs and VAT/TRN numbers
+candidate_scanner = CandidateScanner(po_matcher)
+
 # Extraction prompt
 EXTRACTION_PROMPT = """You are given invoice data in various formats (text, PDF extraction, OCR, or raw text). Your task is to extract and output **only the valid JSON object** that strictly follows this format. Your output **must contain only the JSON object**, with **no additional text, explanations, comments, or markdown**. If a field is missing or empty, output it as an empty string `""`.
 
@@ -124,61 +284,148 @@ data = {invoice_text}
 """
 
 
-# ============================================================================
-# VAT/TRN EXTRACTION
-# ============================================================================
+# Top-level keys of the EXTRACTION_PROMPT schema
+EXTRACTION_FIELDS = [
+    "Invoice_No", "Invoice_Date", "PO_Number", "Order_Number", "Customer_Name",
+    "Customer_RefNo", "LPO_reference", "VATIN", "CustomerTRN", "Vendor_Name",
+    "VAT_Percentage", "Subtotal", "Total", "Items",
+]
+
+ITEM_FIELDS = ["Item_No", "Item_Description", "Quantity", "Unit", "Unit_Price", "Amount"]
+
 
-def extract_vat_numbers(text):
+def build_output_schema(fields, item_fields=ITEM_FIELDS):
     """
-    Extract all VAT/TRN numbers from a given text.
-    VAT format: OM followed by 10 digits (may contain spaces)
-    Returns a list of normalized VATs (spaces removed)
+    JSON schema for Ollama's constrained `format` output.
+    Every field is a required string; `Items` is an array of item objects.
     """
-    vat_numbers = []
-    # Match OM followed by 10 digits, allowing spaces anywhere
-    matches = re.findall(r"OM[\s]*\d[\d\s]{9,}", text, re.IGNORECASE)
-    for v in matches:
-        # Remove all spaces
-        v_clean = re.sub(r"\s+", "", v)
-        if len(v_clean) == 12 and v_clean.upper().startswith("OM"):
-            if v_clean not in vat_numbers:
-                vat_numbers.append(v_clean.upper())
-    return vat_numbers
+    properties = {}
+    for field in fields:
+        if field == "Items":
+            properties[field] = {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {f: {"type": "string"} for f in item_fields},
+                    "required": list(item_fields),
+                },
+            }
+        else:
+            properties[field] = {"type": "string"}
+    return {"type": "object", "properties": properties, "required": list(fields)}
+
+
+EXTRACTION_SCHEMA = build_output_schema(EXTRACTION_FIELDS)
+
+# Map-reduce prompts: header fields without items, and items only
+HEADER_FIELDS = [f for f in EXTRACTION_FIELDS if f != "Items"]
+
+HEADER_PROMPT = """You are given the first and last pages of an invoice (text, PDF extraction or OCR). Extract the invoice header and totals and output **only a valid JSON object** with exactly these fields. If a field is missing or empty, output it as an empty string `""`. Do not extract line items.
+
+{{
+  "Invoice_No": "string",
+  "Invoice_Date": "YYYY-MM-DD",
+  "PO_Number": "string",
+  "Order_Number": "string",
+  "Customer_Name": "string",
+  "Customer_RefNo": "entityId",
+  "LPO_reference": "string",
+  "VATIN": "string",
+  "CustomerTRN": "string",
+  "Vendor_Name": "string",
+  "VAT_Percentage": "string",
+  "Subtotal": "string",
+  "Total": "string"
+}}
+
+**Return only the JSON object, with no comments, explanations or markdown.**
+
+data = {invoice_text}
+"""
+
+ITEMS_PROMPT = """You are given part of an invoice's line-item table (text, PDF extraction or OCR). Output **only a valid JSON object** listing every line item that appears in this text, in order. Ignore headers, totals, and lines that are not items. If there are no items, output an empty array.
+
+{{
+  "Items": [
+    {{
+      "Item_No": "string",
+      "Item_Description": "string",
+      "Quantity": "string",
+      "Unit": "string",
+      "Unit_Price": "string",
+      "Amount": "string"
+    }}
+  ]
+}}
+
+**Return only the JSON object, with no comments, explanations or markdown.**
+
+data = {invoice_text}
+"""
 
 
 # ============================================================================
 # ORACLE DB INTEGRATION
 # ============================================================================
 
-def get_prefix_from_db(vat_number):
-    """
-    Query Oracle to get PO prefix based on VAT/TRN number.
-    vat_number should be like 'OM1100020467'
-    """
-    print(f"[SEARCH] Looking up PO prefix in DB for VAT/TRN: {vat_number}")
-    if not all([ORACLE_USER, ORACLE_PASSWORD, ORACLE_DSN]):
-         print("[WARNING] Oracle DB not configured. Skipping prefix lookup.")
-         return None
+def load_branch_prefixes():
+    """Every (TRN, PO prefix) row of the Axpert branch table."""
+    with oracle_db.connect(ORACLE_USER, ORACLE_PASSWORD, ORACLE_DSN) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT a1.TRNNO, a1.BRANCHCODE || 'PO' AS prefix FROM branch a1 WHERE a1.TRNNO IS NOT NULL"
+            )
+            return cursor.fetchall()
+
+
+# TRN -> prefix index (preloaded at startup, see FinanceConfig.ready)
+trn_index = TrnIndex(
+    load_branch_prefixes,
+    refresh_interval=getattr(settings, 'TRN_INDEX_REFRESH', 3600),
+    negative_ttl=getattr(settings, 'TRN_INDEX_NEGATIVE_TTL', 300),
+)
 
+
+def _query_prefix(vat_number):
+    """Single-TRN prefix query, used until the index has loaded."""
     try:
-        import oracledb
-        with oracledb.connect(user=ORACLE_USER, password=ORACLE_PASSWORD, dsn=ORACLE_DSN) as conn:
+        with oracle_db.connect(ORACLE_USER, ORACLE_PASSWORD, ORACLE_DSN) as conn:
             with conn.cursor() as cursor:
                 cursor.execute(
                     "SELECT a1.BRANCHCODE || 'PO' AS prefix FROM branch a1 WHERE trnno = :ptrnno",
                     ptrnno=vat_number
                 )
                 result = cursor.fetchone()
-                if result:
-                    print(f"[SUCCESS] Found prefix in DB: {result[0]}")
-                    return result[0]
-                else:
-                    print(f"[WARNING] No prefix found in DB for VAT/TRN {vat_number}")
+                return result[0] if result else None
     except Exception as e:
         print(f"[ERROR] DB prefix fetch error: {e}")
     return None
 
 
+def get_prefix_from_db(vat_number):
+    """
+    Get PO prefix based on VAT/TRN number, from the in-memory branch index
+    (falls back to querying Oracle while the index is not loaded).
+    vat_number should be like 'OM1100020467'
+    """
+    print(f"[SEARCH] Looking up PO prefix in DB for VAT/TRN: {vat_number}")
+    if not all([ORACLE_USER, ORACLE_PASSWORD, ORACLE_DSN]):
+         print("[WARNING] Oracle DB not configured. Skipping prefix lookup.")
+         return None
+
+    prefix, answered = trn_index.lookup(vat_number)
+    if not answered and trn_index.ensure_loaded():
+        prefix, answered = trn_index.lookup(vat_number)
+    if not answered:
+        prefix = _query_prefix(vat_number)
+
+    if prefix:
+        print(f"[SUCCESS] Found prefix in DB: {prefix}")
+    else:
+        print(f"[WARNING] No prefix found in DB for VAT/TRN {vat_number}")
+    return prefix
+
+
 def get_axpert_po_data(pono):
     """Fetch vendor + PO details from Oracle."""
     if not all([ORACLE_USER, ORACLE_PASSWORD, ORACLE_DSN]):
@@ -188,9 +435,8 @@ def get_axpert_po_data(pono):
     try:
         # Import pandas inside to ensure it's available or fail loudly
         import pandas as pd
-        import oracledb
         logger.info(f"[CONNECT] Connecting to Oracle DB for PO: {pono}")
-        with oracledb.connect(user=ORACLE_USER, password=ORACLE_PASSWORD, dsn=ORACLE_DSN) as conn:
+        with oracle_db.connect(ORACLE_USER, ORACLE_PASSWORD, ORACLE_DSN) as conn:
             with conn.cursor() as cursor:
                 # Vendor
                 vendor_query = """
@@ -299,7 +545,9 @@ def extract_text_via_ocr(file_path):
             print(f"[SEARCH] Performing OCR on PDF: {file_path}")
             images = convert_from_path(file_path, dpi=300)
             for img in images:
-                text += pytesseract.image_to_string(img, lang="eng") + "\n"
+                # Keep a form feed between pages so later stages can split per page
+                page_text = pytesseract.image_to_string(img, lang="eng").rstrip("\f")
+                text += page_text + "\n" + PAGE_SEPARATOR
         else:
             # Image file
             print(f"[SEARCH] Performing OCR on image: {file_path}")
@@ -319,306 +567,131 @@ def extract_text_via_ocr(file_path):
         return ""
 
 
-def extract_po_from_ocr(ocr_text):
-    """
-    Extract PO number from OCR text with intelligent prefix detection
-    """
-    print(f"[SEARCH] Extracting PO from OCR text...")
-    
-    # Print OCR text preview for debugging
-    print(f"[FILE] OCR Text Preview:\n{ocr_text[:500]}")
-    
-    # Check known PO prefixes first
-    for prefix in SEARCH_PREFIXES:
-        match = re.search(rf"({prefix}-?\d+)", ocr_text, re.IGNORECASE)
-        if match:
-            raw_match = match.group(1).replace("-", "").upper()
-            
-            # Check for 4-char mapping fix (ATCP -> ATCPO, handle 0 vs O)
-            if prefix in PREFIX_MAPPING:
-                full_prefix = PREFIX_MAPPING[prefix]
-                remainder = raw_match[len(prefix):]
-                # If remainder starts with 0, it's likely the 'O' from the prefix misread as '0'
-                if remainder.startswith("0"):
-                    remainder = remainder[1:]
-                po = full_prefix + remainder
-            else:
-                po = raw_match
-
-            print(f"✅ Found PO via OCR with prefix: {po}")
-            return po
-
-    # Check for 8-digit PO without prefix (YYMMXXXX format)
-    num_match = re.search(r"\b(\d{8})\b", ocr_text)
-    if num_match:
-        po_candidate = num_match.group(1)
-        yy, mm = int(po_candidate[:2]), int(po_candidate[2:4])
-        if 1 <= mm <= 12:  # Validate month
-            print(f"💡 Found PO via OCR without prefix: {po_candidate}")
-            
-            # Try to get VAT/TRN from OCR text and lookup prefix
-            vat_numbers = extract_vat_numbers(ocr_text)
-            if vat_numbers:
-                print(f"💡 Found VAT/TRN via OCR: {vat_numbers}")
-                for vat in vat_numbers:
-                    prefix = get_prefix_from_db(vat)
-                    if prefix:
-                        po_full = f"{prefix}{po_candidate}"
-                        print(f"✅ PO with DB prefix applied via OCR: {po_full}")
-                        return po_full
-            
-            return po_candidate
-    
-    print("⚠️ PO not found via OCR")
-    return ""
-
-
 # ============================================================================
 # PO NUMBER EXTRACTION (MAIN LOGIC)
 # ============================================================================
 
-def extract_po_number(json_data, pdf_path=None, ocr_text=None):
+def _ocr_pdf(pdf_path):
+    """Tesseract text of every page of `pdf_path` ('' when OCR is unavailable or fails)."""
+    try:
+        import pytesseract
+        from pdf2image import convert_from_path
+        if TESSERACT_PATH:
+            pytesseract.pytesseract.tesseract_cmd = TESSERACT_PATH
+    except ImportError:
+        print("⚠️ OCR libraries not installed (pytesseract/pdf2image)")
+        return ""
+
+    ocr_text = ""
+    try:
+        images = convert_from_path(pdf_path, dpi=300)
+        for img in images:
+            ocr_text += pytesseract.image_to_string(img, lang="eng") + "\n"
+    except Exception as e:
+        print(f"⚠️ OCR failed: {e}")
+    return ocr_text
+
+
+def extract_po_number(json_data, pdf_path=None, ocr_text=None, json_candidates=None):
     """
     Extract PO number with VAT/TRN detection (JSON first, then OCR)
     and apply DB prefix if PO has no prefix.
     Handles multiple VAT/TRN numbers in OCR.
+
+    The PO fields of the JSON and the OCR text are each scanned once for
+    candidates (see candidates.py); `json_candidates` may pass in an
+    earlier scan_json() of `json_data` to skip the JSON scan.
     """
     print("📝 Extracting PO from JSON data...")
 
-    fields_to_check = [
-        json_data.get("Invoice_No", ""),
-        json_data.get("PO_Number", ""),
-        json_data.get("Order_Number", ""),
-        json_data.get("LPO_reference", ""),
-        json_data.get("Customer_RefNo", "")
-    ]
-
-    # 1️⃣ Detect all VAT/TRN from JSON fields
-    vat_numbers = []
-    for field in fields_to_check:
-        if not field:
-            continue
-        vat_numbers += extract_vat_numbers(str(field))
-    vat_numbers = list(set(vat_numbers))
+    # 1️⃣ Candidates from the JSON PO fields, in field order
+    if json_candidates is None:
+        json_candidates = []
+        for field in PO_FIELDS:
+            value = json_data.get(field, "")
+            if value:
+                json_candidates += candidate_scanner.scan(str(value), 'json', field)
+    json_candidates = [c for c in json_candidates if c.field in PO_FIELDS]
+    json_candidates.sort(key=lambda c: PO_FIELDS.index(c.field))
+
+    vat_numbers = unique_values(of_kind(json_candidates, VAT))
     if vat_numbers:
         print(f"💡 Found VAT/TRN in JSON: {vat_numbers}")
 
-    # 2️⃣ If none found or to supplement, extract VAT/TRN via OCR
-    # ocr_text provided or extracted locally
-    
-    # Initialize imports to None
-    pytesseract = None
-    convert_from_path = None
-    
-    if pdf_path or ocr_text:
-        try:
-            # Only import if we might need them or to check availability
-            import pytesseract
-            from pdf2image import convert_from_path
-            if TESSERACT_PATH:
-                pytesseract.pytesseract.tesseract_cmd = TESSERACT_PATH
-        except ImportError:
-             print("⚠️ OCR libraries not installed (pytesseract/pdf2image)")
-
-        # Logic to get OCR text if not provided
-        if not ocr_text and pdf_path:
-            if pytesseract and convert_from_path:
-                try:
-                    ocr_text = ""
-                    images = convert_from_path(pdf_path, dpi=300)
-                    for img in images:
-                        ocr_text += pytesseract.image_to_string(img, lang="eng") + "\n"
-                except Exception as e:
-                    print(f"⚠️ OCR failed: {e}")
-            else:
-                 print("⚠️ Skipping OCR: dependencies missing")
-
-        if ocr_text and ocr_text.strip():
-            print(f"📄 OCR Text Preview:\n{ocr_text[:1000]}")
-            ocr_vats = extract_vat_numbers(ocr_text)
-            for v in ocr_vats:
-                if v not in vat_numbers:
-                    vat_numbers.append(v)
-            if ocr_vats:
-                print(f"💡 Found VAT/TRN via OCR: {ocr_vats}")
-            else:
-                print("⚠️ VAT/TRN not found via OCR")
+    # 2️⃣ Candidates from the OCR text (run OCR only if it was not passed in)
+    ocr_candidates = []
+    if not ocr_text and pdf_path:
+        ocr_text = _ocr_pdf(pdf_path)
+    if ocr_text and ocr_text.strip():
+        print(f"📄 OCR Text Preview:\n{ocr_text[:1000]}")
+        ocr_candidates = candidate_scanner.scan(ocr_text, 'ocr')
+        ocr_vats = unique_values(of_kind(ocr_candidates, VAT))
+        vat_numbers += [v for v in ocr_vats if v not in vat_numbers]
+        if ocr_vats:
+            print(f"💡 Found VAT/TRN via OCR: {ocr_vats}")
         else:
-            if not ocr_text: # If it's still empty
-                 print("⚠️ OCR returned empty text or was skipped")
-
-    # 3️⃣ Check PO numbers in JSON fields - Collect candidates, don't return yet
-    json_candidates = []
-    
-    for field in fields_to_check:
-        if not field:
-            continue
-        print(f"🔹 Checking field for PO: {field}")
-
-        # Known PO prefixes
-        for prefix in SEARCH_PREFIXES:
-            match = re.search(rf"({prefix}-?\d+)", str(field), re.IGNORECASE)
-            if match:
-                raw_match = match.group(1).replace("-", "").upper()
-                
-                # Check for 4-char mapping fix
-                if prefix in PREFIX_MAPPING:
-                    full_prefix = PREFIX_MAPPING[prefix]
-                    remainder = raw_match[len(prefix):]
-                    if remainder.startswith("0"):
-                        remainder = remainder[1:]
-                    po = full_prefix + remainder
-                else:
-                    po = raw_match
-                
-                print(f"✅ Found PO with known prefix in JSON: {po}")
-                alert(po, "JSON: PO WITH PREFIX")
-                json_candidates.append(('json_with_prefix', po))
-                break  # Found in this field with prefix, check next field
-
-        # PO without prefix: 8-digit YYMMXXXX
-        num_match = re.search(r"\b(\d{8})\b", str(field))
-        if num_match:
-            po_candidate = num_match.group(1)
-            yy, mm = int(po_candidate[:2]), int(po_candidate[2:4])
-            if 1 <= mm <= 12:
-                print(f"💡 Found PO without prefix in JSON: {po_candidate}")
-                alert(po_candidate, "JSON: PO WITHOUT PREFIX")
-
-                # Apply DB prefixes from all detected VATs
-                prefix_applied = False
-                for vat in vat_numbers:
-                    prefix = get_prefix_from_db(vat)
-                    if prefix:
-                        po_full = f"{prefix}{po_candidate}"
-                        print(f"✅ JSON PO with DB prefix applied: {po_full} (VAT: {vat})")
-                        alert(po_full, "JSON: PO + DB PREFIX")
-                        json_candidates.append(('json_with_db_prefix', po_full))
-                        prefix_applied = True
-                        break
-                
-                if not prefix_applied:
-                    # No DB prefix found
-                    json_candidates.append(('json_no_prefix', po_candidate))
+            print("⚠️ VAT/TRN not found via OCR")
+    elif pdf_path or ocr_text is not None:
+        print("⚠️ OCR returned empty text or was skipped")
 
-    # 4️⃣ OCR fallback - ALWAYS try OCR to get additional candidates
-    ocr_candidates = []
-    if pdf_path or ocr_text:
-        if not ocr_text:  # If OCR wasn't done yet for VAT detection
-            try:
-                pytesseract = None
-                convert_from_path = None
-                try:
-                    import pytesseract
-                    from pdf2image import convert_from_path
-                    if TESSERACT_PATH:
-                        pytesseract.pytesseract.tesseract_cmd = TESSERACT_PATH
-                except ImportError:
-                    print("⚠️ OCR libraries not installed (pytesseract/pdf2image)")
-                
-                if pytesseract and convert_from_path:
-                    try:
-                        images = convert_from_path(pdf_path, dpi=300)
-                        for img in images:
-                            ocr_text += pytesseract.image_to_string(img, lang="eng") + "\n"
-                    except Exception as e:
-                        print(f"⚠️ OCR failed: {e}")
-            except:
-                pass
-        
-        if ocr_text:
-            print("[SEARCH] Checking OCR for additional PO candidates...")
-            
-            # Check known PO prefixes in OCR
-            for prefix in SEARCH_PREFIXES:
-                match = re.search(rf"({prefix}-?\d+)", ocr_text, re.IGNORECASE)
-                if match:
-                    raw_match = match.group(1).replace("-", "").upper()
-                    
-                    # Check for 4-char mapping fix
-                    if prefix in PREFIX_MAPPING:
-                        full_prefix = PREFIX_MAPPING[prefix]
-                        remainder = raw_match[len(prefix):]
-                        if remainder.startswith("0"):
-                            remainder = remainder[1:]
-                        po = full_prefix + remainder
-                    else:
-                        po = raw_match
-
-                    print(f"💡 Found PO via OCR with prefix: {po}")
-                    ocr_candidates.append(('ocr_with_prefix', po))
-            
-            # Check for 8-digit PO without prefix in OCR
-            for num_match in re.finditer(r"\b(\d{8})\b", ocr_text):
-                po_candidate = num_match.group(1)
-                try:
-                    yy, mm = int(po_candidate[:2]), int(po_candidate[2:4])
-                    if 1 <= mm <= 12:
-                        print(f"💡 Found 8-digit PO via OCR: {po_candidate}")
-                        
-                        # Try to apply prefix
-                        for vat in vat_numbers:
-                            prefix = get_prefix_from_db(vat)
-                            if prefix:
-                                po_full = f"{prefix}{po_candidate}"
-                                print(f"💡 OCR PO with DB prefix: {po_full}")
-                                ocr_candidates.append(('ocr_with_db_prefix', po_full))
-                                break
-                        else:
-                            ocr_candidates.append(('ocr_no_prefix', po_candidate))
-                except:
-                    continue
-    
-    
-    # 5️⃣ Prioritize candidates - Check both JSON and OCR
     print("\n" + "="*60)
     print("CANDIDATE PRIORITIZATION")
     print("="*60)
     print(f"JSON candidates: {len(json_candidates)}")
     print(f"OCR candidates: {len(ocr_candidates)}")
-    
-    # Priority 1: POs with known prefixes (JSON first, then OCR)
-    for candidate_type, po in json_candidates:
-        if candidate_type == 'json_with_prefix':
-            print(f"✅ FINAL: Returning JSON PO with known prefix: {po}")
-            alert(po, "FINAL PO (JSON WITH PREFIX)")
-            return po
-    
-    for candidate_type, po in ocr_candidates:
-        if candidate_type == 'ocr_with_prefix':
-            print(f"✅ FINAL: Returning OCR PO with known prefix: {po}")
-            alert(po, "FINAL PO (OCR WITH PREFIX)")
-            return po
-    
-    # Priority 2: POs with DB-derived prefixes (OCR first for better accuracy)
-    for candidate_type, po in ocr_candidates:
-        if candidate_type == 'ocr_with_db_prefix':
-            print(f"✅ FINAL: Returning OCR PO with DB prefix: {po}")
-            alert(po, "FINAL PO (OCR + DB PREFIX)")
-            return po
-    
-    for candidate_type, po in json_candidates:
-        if candidate_type == 'json_with_db_prefix':
-            print(f"✅ FINAL: Returning JSON PO with DB prefix: {po}")
-            alert(po, "FINAL PO (JSON + DB PREFIX)")
-            return po
-    
+
+    # Priority 1: POs with known prefixes (JSON first, by field order, then OCR)
+    for field in PO_FIELDS:
+        best = best_prefixed([c for c in json_candidates if c.field == field])
+        if best:
+            print(f"✅ FINAL: Returning JSON PO with known prefix: {best.value} ({field})")
+            alert(best.value, "FINAL PO (JSON WITH PREFIX)")
+            return best.value
+
+    best = best_prefixed(ocr_candidates)
+    if best:
+        print(f"✅ FINAL: Returning OCR PO with known prefix: {best.value}")
+        alert(best.value, "FINAL PO (OCR WITH PREFIX)")
+        return best.value
+
+    # One 8-digit candidate per JSON field, like the field-by-field search
+    json_digits = []
+    for c in of_kind(json_candidates, PO_DIGITS):
+        if all(d.field != c.field for d in json_digits):
+            json_digits.append(c)
+    ocr_digits = of_kind(ocr_candidates, PO_DIGITS)
+    if not json_digits and not ocr_digits:
+        print("[WARNING] PO not found")
+        alert("NO PO FOUND", "ERROR")
+        return ""
+
+    # Priority 2: POs with DB-derived prefixes (OCR first for better accuracy).
+    # The prefix depends only on the VATs, so it is looked up once.
+    prefix = vat = None
+    for vat in vat_numbers:
+        prefix = get_prefix_from_db(vat)
+        if prefix:
+            break
+    if prefix:
+        if ocr_digits:
+            po_full = f"{prefix}{ocr_digits[0].value}"
+            print(f"✅ FINAL: Returning OCR PO with DB prefix: {po_full} (VAT: {vat})")
+            alert(po_full, "FINAL PO (OCR + DB PREFIX)")
+            return po_full
+        po_full = f"{prefix}{json_digits[0].value}"
+        print(f"✅ FINAL: Returning JSON PO with DB prefix: {po_full} (VAT: {vat})")
+        alert(po_full, "FINAL PO (JSON + DB PREFIX)")
+        return po_full
+
     # Priority 3: Raw POs without prefix (last resort)
-    for candidate_type, po in json_candidates:
-        if candidate_type == 'json_no_prefix':
-            print(f"⚠️ FINAL: Returning JSON PO without prefix: {po}")
-            alert(po, "FINAL PO (JSON NO PREFIX)")
-            return po
-    
-    for candidate_type, po in ocr_candidates:
-        if candidate_type == 'ocr_no_prefix':
-            print(f"⚠️ FINAL: Returning OCR PO without prefix: {po}")
-            alert(po, "FINAL PO (OCR NO PREFIX)")
-            return po
-
-    print("[WARNING] PO not found")
-    alert("NO PO FOUND", "ERROR")
-    return ""
+    if json_digits:
+        print(f"⚠️ FINAL: Returning JSON PO without prefix: {json_digits[0].value}")
+        alert(json_digits[0].value, "FINAL PO (JSON NO PREFIX)")
+        return json_digits[0].value
+
+    print(f"⚠️ FINAL: Returning OCR PO without prefix: {ocr_digits[0].value}")
+    alert(ocr_digits[0].value, "FINAL PO (OCR NO PREFIX)")
+    return ocr_digits[0].value
 
 
 
@@ -669,6 +742,155 @@ def extract_text_from_pdf(file_path):
         return extract_text_via_ocr(file_path)
 
 
+# ============================================================================
+# WORD DOCUMENT TEXT EXTRACTION (DOC/DOCX)
+# ============================================================================
+
+WORD_EXTENSIONS = ('.docx', '.doc')
+
+_W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+def _docx_part_text(xml_bytes):
+    """Render a WordprocessingML part as text, keeping table rows on one line."""
+    from xml.etree import ElementTree
+
+    root = ElementTree.fromstring(xml_bytes)
+    lines = []
+
+    def paragraph_text(p):
+        parts = []
+        for node in p.iter():
+            if node.tag == _W_NS + 't' and node.text:
+                parts.append(node.text)
+            elif node.tag == _W_NS + 'tab':
+                parts.append('\t')
+            elif node.tag in (_W_NS + 'br', _W_NS + 'cr'):
+                parts.append('\n')
+        return ''.join(parts)
+
+    def walk(container):
+        for child in container:
+            if child.tag == _W_NS + 'p':
+                text = paragraph_text(child)
+                if text.strip():
+                    lines.append(text)
+            elif child.tag == _W_NS + 'tbl':
+                for row in child.iter(_W_NS + 'tr'):
+                    cells = []
+                    for cell in row.findall(_W_NS + 'tc'):
+                        cell_text = ' '.join(
+                            paragraph_text(p).strip() for p in cell.iter(_W_NS + 'p')
+                        ).strip()
+                        cells.append(cell_text)
+                    if any(cells):
+                        lines.append(' | '.join(cells))
+            else:
+                walk(child)
+
+    walk(root)
+    return '\n'.join(lines)
+
+
+def extract_text_from_docx(file_path):
+    """
+    Extract text from a DOCX file natively (no rasterization or OCR).
+    Headers, body and footers are read straight from the OOXML parts;
+    table rows are rendered as pipe-separated lines.
+
+    Args:
+        file_path: Path to the DOCX file
+
+    Returns:
+        str: Extracted text
+    """
+    import zipfile
+
+    try:
+        with zipfile.ZipFile(file_path) as archive:
+            names = archive.namelist()
+            headers = sorted(n for n in names if re.match(r'word/header\d*\.xml$', n))
+            footers = sorted(n for n in names if re.match(r'word/footer\d*\.xml$', n))
+            sections = []
+            for name in headers + ['word/document.xml'] + footers:
+                if name in names:
+                    part_text = _docx_part_text(archive.read(name))
+                    if part_text.strip():
+                        sections.append(part_text)
+        text = '\n'.join(sections)
+        print(f"[FILE] DOCX extracted {len(text)} characters")
+        return text
+    except Exception as e:
+        print(f"[WARNING] DOCX extraction failed: {e}")
+        return ""
+
+
+def extract_text_from_doc(file_path):
+    """
+    Extract text from a legacy binary DOC file through a local converter
+    (antiword, catdoc or LibreOffice headless, whichever is installed).
+
+    Args:
+        file_path: Path to the DOC file
+
+    Returns:
+        str: Extracted text
+    """
+    import shutil
+    import subprocess
+    import tempfile
+
+    for tool in ('antiword', 'catdoc'):
+        exe = shutil.which(tool)
+        if not exe:
+            continue
+        try:
+            completed = subprocess.run(
+                [exe, file_path], capture_output=True, timeout=60, check=True
+            )
+            text = completed.stdout.decode('utf-8', errors='replace')
+            if text.strip():
+                print(f"[FILE] {tool} extracted {len(text)} characters")
+                return text
+        except Exception as e:
+            print(f"[WARNING] {tool} failed: {e}")
+
+    soffice = shutil.which('soffice') or shutil.which('libreoffice')
+    if soffice:
+        try:
+            with tempfile.TemporaryDirectory() as out_dir:
+                subprocess.run(
+                    [soffice, '--headless', '--convert-to', 'docx', '--outdir', out_dir, file_path],
+                    capture_output=True, timeout=120, check=True
+                )
+                converted = os.path.join(
+                    out_dir, os.path.splitext(os.path.basename(file_path))[0] + '.docx'
+                )
+                if os.path.exists(converted):
+                    return extract_text_from_docx(converted)
+        except Exception as e:
+            print(f"[WARNING] LibreOffice conversion failed: {e}")
+
+    print("[WARNING] No DOC converter available (install antiword, catdoc or LibreOffice)")
+    return ""
+
+
+def extract_document_text(file_path):
+    """
+    Format-dispatching text extractor.
+    DOC/DOCX are read natively, PDFs use the text layer (OCR fallback),
+    images go through OCR.
+    """
+    lower = file_path.lower()
+    if lower.endswith('.docx'):
+        return extract_text_from_docx(file_path)
+    if lower.endswith('.doc'):
+        return extract_text_from_doc(file_path)
+    if lower.endswith('.pdf'):
+        return extract_text_from_pdf(file_path)
+    return extract_text_via_ocr(file_path)
+
+
 # ============================================================================
 # N8N INTEGRATION
 # ============================================================================
@@ -677,6 +899,9 @@ def extract_invoice_via_n8n(file_path):
     """
     Extract invoice data using your n8n workflow
     
+    Calls go through the n8n circuit breaker: while it is open the call
+    fails immediately so the caller can fall back to direct Ollama.
+    
     Args:
         file_path: Path to the invoice file
         
@@ -686,12 +911,34 @@ def extract_invoice_via_n8n(file_path):
     if not N8N_WEBHOOK_URL:
         raise ValueError("N8N_WEBHOOK_URL not configured in settings")
     
+    if not n8n_breaker.allow():
+        logger.info("[CIRCUIT] n8n circuit is open; skipping webhook")
+        return {
+            'success': False,
+            'error': 'n8n circuit open (webhook recently failing or slow)',
+            'method': 'n8n',
+            'circuit_open': True
+        }
+    
+    start_time = time.time()
+    result = _call_n8n(file_path)
+    latency = time.time() - start_time
+    n8n_breaker.record(result['success'], latency)
+    if result['success']:
+        n8n_latency.record(latency)
+    return result
+
+
+def _call_n8n(file_path):
+    """POST the file to the n8n webhook and decode its output."""
     try:
         with open(file_path, 'rb') as f:
-            files = {'data': (os.path.basename(file_path), f, 'application/pdf')}
+            content_type = mimetypes.guess_type(file_path)[0] or 'application/pdf'
+            files = {'data': (os.path.basename(file_path), f, content_type)}
             print(f"[UPLOAD] Sending {file_path} to n8n webhook...")
             # Increased timeout to 5 minutes for complex invoices
-            response = requests.post(N8N_WEBHOOK_URL, files=files, timeout=300)
+            # Webhook runs a workflow: only retry failures that never reached n8n
+            response = http_client.post(N8N_WEBHOOK_URL, files=files, timeout=N8N_TIMEOUT, idempotent=False)
         
         print(f"[SUCCESS] Received response from n8n (status: {response.status_code})")
         response.raise_for_status()
@@ -703,64 +950,43 @@ def extract_invoice_via_n8n(file_path):
         if isinstance(result, list) and len(result) > 0:
             result = result[0]
         
+        repairs = []
         if isinstance(result, dict) and "output" in result:
+            output_str = result["output"]
             try:
-                output_str = result["output"].strip()
-                if output_str.startswith("```json"):
-                    output_str = output_str[7:].strip()
-                if output_str.startswith("```"):
-                    output_str = output_str[3:].strip()
-                if output_str.endswith("```"):
-                    output_str = output_str[:-3].strip()
-                    
-                # Attempt to clean common JSON errors (like invalid backslashes in paths)
-                try:
-                    result = json.loads(output_str)
-                except json.JSONDecodeError:
-                    # Retry with cleaned string: escape backslashes that aren't valid escapes
-                    print("[WARNING] Initial JSON parse failed. Attempting to fix invalid escapes...")
-                    # Regex to find backslashes that are NOT followed by valid escape chars
-                    cleaned_str = re.sub(r'\\(?!["\\/bfnrtu])', r'\\\\', output_str)
-                    result = json.loads(cleaned_str)
-
+                # One pass: fences, escaped underscores, invalid backslashes, trailing commas, keys
+                result, repairs = repair_json(output_str)
             except json.JSONDecodeError as e:
                 print(f"[ERROR] Error decoding 'output' JSON: {e}")
-                print(f"[FILE] Problematic output start: {output_str[:200]}...")
+                print(f"[FILE] Problematic output start: {str(output_str)[:200]}...")
                 return {
                     'success': False,
                     'error': f'Failed to parse n8n output: {str(e)}',
                     'method': 'n8n',
                     'raw_output': str(output_str)[:500]
                 }
+            if repairs:
+                print(f"[WARNING] Repaired n8n JSON output: {', '.join(repairs)}")
+        else:
+            # [CLEAN] Clean keys (remove backslashes often added by some models)
+            result = clean_keys(result)
         
         print(f"[SUCCESS] Final extracted data has {len(result)} fields")
         
-        # [CLEAN] Clean keys (remove backslashes often added by some models)
-        def clean_json_keys(data):
-            if isinstance(data, dict):
-                clean_data = {}
-                for k, v in data.items():
-                    clean_key = k.replace('\\', '')
-                    clean_data[clean_key] = clean_json_keys(v)
-                return clean_data
-            elif isinstance(data, list):
-                return [clean_json_keys(item) for item in data]
-            else:
-                return data
-
-        result = clean_json_keys(result)
-
-        return {
+        extraction = {
             'success': True,
             'data': result,
             'method': 'n8n'
         }
+        if repairs:
+            extraction['json_repairs'] = repairs
+        return extraction
         
     except requests.exceptions.Timeout as e:
         print(f"[TIMEOUT] Timeout error: {e}")
         return {
             'success': False,
-            'error': f'Request timeout after 300 seconds: {str(e)}',
+            'error': f'Request timeout after {N8N_TIMEOUT} seconds: {str(e)}',
             'method': 'n8n'
         }
     except requests.exceptions.RequestException as e:
@@ -784,26 +1010,171 @@ def extract_invoice_via_n8n(file_path):
 # OLLAMA DIRECT INTEGRATION
 # ============================================================================
 
-def extract_invoice_via_ollama(invoice_text):
+def ollama_generate(payload, timeout, scanner=None, images=None):
+    """
+    POST to Ollama /api/generate through the shared pooled client.
+    Only connection failures and 502/503 responses are retried: a timed-out
+    generation is not repeated on the same (probably saturated) host.
+
+    Raw image bytes passed as `images` are base64-encoded into the request
+    body as it is streamed out instead of being built up front.
+
+    With a scanner (and OLLAMA_STREAMING enabled) tokens are consumed as they
+    arrive: the call returns as soon as the top-level JSON object closes and
+    raises SchemaDivergence as soon as the output stops matching the schema.
+
+    Requests are routed through the endpoint pool; a connection failure on
+    one host is retried once on another healthy host. Each host
+    admits only as many concurrent calls as its adaptive limiter allows. During
+    working hours a long keep_alive keeps the model resident between calls.
+
+    Returns:
+        dict: Decoded Ollama response body ('response' holds the generated text)
+    """
+    if cancelled():
+        raise Cancelled()
+    keep_alive = model_warmer.keep_alive_value()
+    if keep_alive is not None:
+        payload = dict(payload, keep_alive=keep_alive)
+    tried = []
+    while True:
+        try:
+            with ollama_pool.lease(payload.get('model'), exclude=tried) as base_url:
+                tried.append(base_url)
+                with generate_limiter(base_url).slot():
+                    return _generate_on(base_url, payload, timeout, scanner, images)
+        except requests.exceptions.ConnectionError as e:
+            # The lease has recorded the failure against that host (timeouts are not retried)
+            if len(tried) >= min(2, len(ollama_pool.endpoints)):
+                raise
+            logger.warning(f"[POOL] {tried[-1]} failed ({e.__class__.__name__}); trying another endpoint")
+
+
+def _request_body(payload, images):
+    if images:
+        return {'data': StreamedGenerateBody(payload, images), 'headers': {'Content-Type': 'application/json'}}
+    return {'json': payload}
+
+
+def _generate_on(base_url, payload, timeout, scanner, images=None):
+    """Single /api/generate call against one Ollama host."""
+    url = f"{base_url}/api/generate"
+    if scanner is None or not OLLAMA_STREAMING:
+        response = http_client.post(
+            url, timeout=timeout, idempotent=True, retry_timeouts=False,
+            **_request_body(dict(payload, stream=False), images),
+        )
+        response.raise_for_status()
+        return response.json()
+
+    deadline = time.time() + timeout
+    response = http_client.post(
+        url,
+        **_request_body(dict(payload, stream=True), images),
+        # (connect, idle-between-tokens): a stalled stream fails without waiting for the full timeout
+        timeout=(10, min(timeout, OLLAMA_STREAM_IDLE_TIMEOUT)),
+        idempotent=True,
+        retry_timeouts=False,
+        stream=True,
+    )
+    try:
+        response.raise_for_status()
+        final = {}
+        lines = _stream_lines(response)
+        for line in lines:
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if chunk.get('error'):
+                raise requests.exceptions.RequestException(f"Ollama error: {chunk['error']}")
+            if scanner.feed(chunk.get('response', '')):
+                # Object closed: stop generating instead of waiting for trailing tokens.
+                # Peek at a couple more lines for the 'done' chunk carrying timing stats.
+                final = chunk
+                for _ in range(2):
+                    if final.get('done'):
+                        break
+                    line = next(lines, None)
+                    if not line:
+                        break
+                    final = json.loads(line)
+                break
+            if chunk.get('done'):
+                final = chunk
+                break
+            if time.time() > deadline:
+                raise requests.exceptions.Timeout(f"Ollama generation exceeded {timeout}s")
+            if cancelled():
+                raise Cancelled()
+        final['response'] = scanner.text
+        return final
+    finally:
+        # Closing mid-stream drops the connection, which makes Ollama stop generating
+        response.close()
+
+
+def _stream_lines(response):
+    """
+    response.iter_lines(), with a stall between tokens raised as a Timeout
+    (requests reports it as ConnectionError) so the host's limiter backs off.
+    """
+    try:
+        yield from response.iter_lines()
+    except requests.exceptions.ConnectionError as e:
+        if is_read_timeout(e):
+            raise requests.exceptions.ReadTimeout(f"Ollama stream stalled between tokens: {e}") from e
+        raise
+
+
+def ollama_output_format(schema=EXTRACTION_SCHEMA):
+    """Value for the /api/generate `format` field (None when unconstrained)."""
+    if OLLAMA_OUTPUT_FORMAT == 'schema':
+        return schema
+    if OLLAMA_OUTPUT_FORMAT == 'json':
+        return 'json'
+    return None
+
+
+def parse_ollama_output(text):
+    """
+    Parse generated JSON in one pass. Constrained output parses as plain
+    JSON; free-form output also gets fences, escapes, keys and truncation
+    repaired (see json_stream.repair_json).
+
+    Returns:
+        tuple: (data, list of repairs applied)
+    """
+    data, repairs = repair_json(text)
+    if repairs:
+        print(f"[WARNING] Repaired model JSON output: {', '.join(repairs)}")
+    return data, repairs
+
+
+def extract_invoice_via_ollama(invoice_text, model=None, use_cache=True,
+                               prompt_template=EXTRACTION_PROMPT, fields=EXTRACTION_FIELDS):
     """
     Extract invoice data using Ollama directly (pure Python)
     
     Args:
         invoice_text: Text content of the invoice (from OCR or PDF extraction)
+        model: Ollama model to use (defaults to OLLAMA_MODEL)
+        use_cache: Reuse a cached result for an identical prompt (False = always call Ollama)
+        prompt_template / fields: prompt and top-level output fields (full schema by default)
         
     Returns:
         dict: Extracted invoice data
     """
     start_time = time.time()
+    model = model or OLLAMA_MODEL
     
     try:
-        # Prepare the prompt
-        prompt = EXTRACTION_PROMPT.format(invoice_text=invoice_text)
+        # Prepare the prompt: normalized, de-duplicated and fitted to the token budget
+        prompt_text, prompt_stats = build_invoice_text(invoice_text, PROMPT_TOKEN_BUDGET)
+        prompt = prompt_template.format(invoice_text=prompt_text)
         
         # Call Ollama API
-        url = f"{OLLAMA_BASE_URL}/api/generate"
         payload = {
-            "model": OLLAMA_MODEL,
+            "model": model,
             "prompt": prompt,
             "stream": False,
             "options": {
@@ -811,52 +1182,59 @@ def extract_invoice_via_ollama(invoice_text):
                 "top_p": 0.9
             }
         }
+        output_format = ollama_output_format(EXTRACTION_SCHEMA if fields is EXTRACTION_FIELDS else build_output_schema(fields))
+        if output_format:
+            payload["format"] = output_format
         
-        response = requests.post(url, json=payload, timeout=120)
-        response.raise_for_status()
+        key, cached = cached_result(payload, use_cache)
+        if cached is not None:
+            cached['processing_time'] = time.time() - start_time
+            return cached
         
-        result = response.json()
+        result = ollama_generate(payload, timeout=120, scanner=IncrementalJSONScanner(fields, OLLAMA_STREAM_MAX_CHARS))
         generated_text = result.get('response', '')
         
-        # Try to parse the JSON from the response
-        # Remove markdown code blocks if present
-        cleaned_text = generated_text.strip()
-        if cleaned_text.startswith('```json'):
-            cleaned_text = cleaned_text[7:]
-        if cleaned_text.startswith('```'):
-            cleaned_text = cleaned_text[3:]
-        if cleaned_text.endswith('```'):
-            cleaned_text = cleaned_text[:-3]
-        cleaned_text = cleaned_text.strip()
-        
-        # Parse JSON
-        extracted_data = json.loads(cleaned_text)
-
-        # [CLEAN] Clean keys (remove backslashes often added by some models)
-        def clean_json_keys(data):
-            if isinstance(data, dict):
-                clean_data = {}
-                for k, v in data.items():
-                    clean_key = k.replace('\\', '')
-                    clean_data[clean_key] = clean_json_keys(v)
-                return clean_data
-            elif isinstance(data, list):
-                return [clean_json_keys(item) for item in data]
-            else:
-                return data
-
-        extracted_data = clean_json_keys(extracted_data)
+        # Parse JSON (schema-constrained output needs no repair)
+        extracted_data, repairs = parse_ollama_output(generated_text)
         
         processing_time = time.time() - start_time
+
+        # Estimate prompt-eval time saved from Ollama's measured per-token rate
+        eval_count = result.get('prompt_eval_count')
+        eval_ns = result.get('prompt_eval_duration')
+        if eval_count and eval_ns:
+            per_token = eval_ns / 1e9 / eval_count
+            trimmed = max(0, prompt_stats['original_tokens'] - prompt_stats['prompt_tokens'])
+            prompt_stats['prompt_eval_count'] = eval_count
+            prompt_stats['prompt_eval_seconds'] = round(eval_ns / 1e9, 3)
+            prompt_stats['estimated_seconds_saved'] = round(trimmed * per_token, 3)
         
-        return {
+        extraction = {
             'success': True,
             'data': extracted_data,
             'method': 'ollama_direct',
             'processing_time': processing_time,
-            'model': OLLAMA_MODEL
+            'model': model,
+            'prompt_stats': prompt_stats
         }
+        if repairs:
+            extraction['json_repairs'] = repairs
+        if key and cacheable(extracted_data, repairs, partial=fields is not EXTRACTION_FIELDS):
+            llm_cache.set(key, extraction)
+        return extraction
         
+    except SchemaDivergence as e:
+        return {
+            'success': False,
+            'error': f'Aborted generation (output diverged from schema): {str(e)}',
+            'method': 'ollama_direct'
+        }
+    except Cancelled:
+        return {
+            'success': False,
+            'error': 'Cancelled: another backend returned first',
+            'method': 'ollama_direct'
+        }
     except json.JSONDecodeError as e:
         return {
             'success': False,
@@ -878,62 +1256,427 @@ def extract_invoice_via_ollama(invoice_text):
         }
 
 
+# ============================================================================
+# CHUNKED (MAP-REDUCE) EXTRACTION
+# ============================================================================
+
+def needs_chunking(invoice_text, item_count):
+    """Long item tables overflow the model's context or come back truncated."""
+    if not CHUNKED_EXTRACTION:
+        return False
+    over_budget = bool(PROMPT_TOKEN_BUDGET) and estimate_tokens(clean_text(invoice_text)) > PROMPT_TOKEN_BUDGET
+    return item_count >= CHUNK_MIN_ITEMS or over_budget
+
+
+def extract_chunked(invoice_text, model=None, use_cache=True):
+    """
+    Map-reduce extraction: header fields from the first/last page in one
+    call, `Items` from overlapping line chunks extracted in parallel, merged
+    in chunk order.
+
+    Returns:
+        dict: extraction result (same shape as extract_invoice_via_ollama) with 'chunking' stats
+    """
+    start_time = time.time()
+    chunks = chunk_lines(invoice_text, CHUNK_TOKENS, CHUNK_OVERLAP_LINES)
+    logger.info(f"[CHUNK] Extracting header + {len(chunks)} item chunk(s) with {CHUNK_WORKERS} worker(s)")
+    cancel = current_cancellation()
+
+    def run(text, prompt_template, fields):
+        with cancellation(cancel):
+            return extract_invoice_via_ollama(
+                text, model=model, use_cache=use_cache, prompt_template=prompt_template, fields=fields,
+            )
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, CHUNK_WORKERS)) as executor:
+        future_header = executor.submit(run, header_text(invoice_text), HEADER_PROMPT, HEADER_FIELDS)
+        future_chunks = [executor.submit(run, chunk, ITEMS_PROMPT, ["Items"]) for chunk in chunks]
+        header = future_header.result()
+        chunk_results = [f.result() for f in future_chunks]
+
+    if not header.get('success'):
+        header['processing_time'] = time.time() - start_time
+        return header
+
+    failed = [index for index, r in enumerate(chunk_results) if not r.get('success')]
+    if failed:
+        logger.warning(f"[CHUNK] {len(failed)} of {len(chunks)} item chunk(s) failed: {failed}")
+    data = dict(header['data'])
+    data['Items'] = merge_items([r['data'].get('Items') for r in chunk_results if r.get('success')])
+
+    return {
+        'success': True,
+        'data': data,
+        'method': 'ollama_chunked',
+        'processing_time': time.time() - start_time,
+        'model': model or OLLAMA_MODEL,
+        'prompt_stats': header.get('prompt_stats'),
+        'chunking': {
+            'chunks': len(chunks),
+            'failed_chunks': failed,
+            'items': len(data['Items']),
+            'workers': CHUNK_WORKERS,
+        },
+    }
+
+
+# ============================================================================
+# MODEL ROUTING
+# ============================================================================
+
+def document_profile(file_path, text, pages=None):
+    """
+    Complexity inputs for the model router.
+    `pages`: 0-based PDF page indices when the text is one invoice of a split document.
+    """
+    text_pages = split_pages(text)
+    page_count = len(text_pages) or 1
+    has_text_layer = False
+    if file_path.lower().endswith('.pdf'):
+        layer_pages = read_pdf_pages(file_path)
+        if pages is not None:
+            layer_pages = [layer_pages[index] for index in pages if index < len(layer_pages)]
+        page_count = max(page_count, len(layer_pages))
+        has_text_layer = len("".join(layer_pages).strip()) >= 100
+    elif file_path.lower().endswith(WORD_EXTENSIONS):
+        has_text_layer = True
+    return page_count, estimate_item_count(text), ocr_confidence(text), has_text_layer
+
+
+def extract_with_routing(invoice_text, file_path, use_cache=True, pages=None):
+    """
+    Pick a model tier from the document's complexity, extract, and escalate
+    to the next larger model while validation fails.
+    use_cache=False bypasses the LLM cache (forced re-extraction); `pages`
+    limits the complexity profile to one invoice's pages of a split PDF.
+
+    Returns:
+        dict: extraction result with a 'routing' record
+    """
+    score, factors = score_document(*document_profile(file_path, invoice_text, pages))
+    tier = min(choose_tier(score, MODEL_ROUTING_THRESHOLDS), len(OLLAMA_MODEL_TIERS) - 1)
+    routing = {
+        'score': score,
+        'factors': factors,
+        'initial_model': OLLAMA_MODEL_TIERS[tier],
+        'escalations': [],
+    }
+    logger.info(f"[ROUTER] Complexity {score} -> {OLLAMA_MODEL_TIERS[tier]}")
+    use_chunks = needs_chunking(invoice_text, factors['item_count'])
+
+    while True:
+        model = OLLAMA_MODEL_TIERS[tier]
+        if use_chunks:
+            result = extract_chunked(invoice_text, model=model, use_cache=use_cache)
+        else:
+            result = extract_invoice_via_ollama(invoice_text, model=model, use_cache=use_cache)
+        problems = validate_extraction(result['data']) if result.get('success') else [result.get('error', 'Extraction failed')]
+        can_escalate = MODEL_ESCALATION and tier + 1 < len(OLLAMA_MODEL_TIERS)
+        if not problems or not can_escalate:
+            break
+        next_model = OLLAMA_MODEL_TIERS[tier + 1]
+        logger.warning(f"[ROUTER] Escalating {model} -> {next_model}: {problems}")
+        routing['escalations'].append({'from': model, 'to': next_model, 'reasons': problems})
+        tier += 1
+
+    routing['model'] = model
+    routing['validation_problems'] = problems if result.get('success') else []
+    result['routing'] = routing
+    return result
+
+
+# ============================================================================
+# NUMERIC VALIDATION & RE-EXTRACTION
+# ============================================================================
+
+# Re-extract with direct Ollama (routing + escalation) when n8n, vision or
+# template output fails the numeric checks, instead of leaving it for review
+VALIDATION_REEXTRACT = getattr(settings, 'VALIDATION_REEXTRACT', True)
+
+
+def reextract_if_invalid(result, ocr_text, file_path, use_cache=True):
+    """
+    Validate a successful extraction that did not come through the router
+    and re-extract it once when its numbers do not add up.
+
+    Returns:
+        tuple: (result with the fewest problems, OCR text)
+    """
+    if not VALIDATION_REEXTRACT or not result.get('success') or 'routing' in result:
+        return result, ocr_text
+    problems = validate_extraction(result['data'])
+    if not problems:
+        return result, ocr_text
+
+    text = fallback_text(ocr_text, file_path)
+    if not text or len(text.strip()) < 50:
+        return result, ocr_text
+    method = result.get('method', 'extraction')
+    logger.warning(f"[VALIDATE] {method} output failed validation: {problems}. Re-extracting...")
+
+    retry = extract_with_routing(text, file_path, use_cache)
+    retry_problems = retry['routing']['validation_problems'] if retry.get('success') else None
+    replaced = retry_problems is not None and len(retry_problems) < len(problems)
+    chosen = retry if replaced else result
+    chosen['reextraction'] = {
+        'from': method,
+        'problems': problems,
+        'retry_problems': retry_problems,
+        'replaced': replaced,
+    }
+    logger.info(f"[VALIDATE] Re-extraction {'replaced' if replaced else 'did not improve'} the {method} result")
+    return chosen, text
+
+
 # ============================================================================
 # VISION EXTRACTION
 # ============================================================================
-def extract_invoice_vision(file_path):
+def extract_invoice_vision(file_path, use_cache=True):
     """
     Extract invoice data using Vision model (e.g. Moondream) directly on image
+    (use_cache=False always calls Ollama instead of reusing a cached result)
+    
+    Images are downscaled to VISION_MAX_SIDE and re-encoded as JPEG; PDFs are
+    sent as their first VISION_MAX_PAGES rendered pages.
     """
-    import base64
     print(f"[VISION] Using Vision extraction with {OLLAMA_MODEL} for {file_path}")
+    start_time = time.time()
     
     try:
-        with open(file_path, "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
+        images, vision_stats = prepare_images(
+            file_path,
+            max_side=VISION_MAX_SIDE,
+            quality=VISION_JPEG_QUALITY,
+            max_pages=VISION_MAX_PAGES,
+            dpi=VISION_PDF_DPI,
+        )
+        print(f"[VISION] {vision_stats['pages']} image(s): {vision_stats['original_bytes']} -> {vision_stats['payload_bytes']} bytes base64")
             
-        url = f"{OLLAMA_BASE_URL}/api/generate"
-        
         # Modified prompt for Vision
         vision_prompt = """Analyze this invoice image and extract the data into a JSON object.
         Focus on: Invoice_No, Invoice_Date, PO_Number, Vendor_Name, Total.
         Return ONLY valid JSON.
         """ + EXTRACTION_PROMPT.split('data =')[0] # Reuse the schema part
+        if len(images) > 1:
+            vision_prompt = f"The {len(images)} images are consecutive pages of one invoice.\n" + vision_prompt
         
         payload = {
             "model": OLLAMA_MODEL,
             "prompt": vision_prompt,
-            "images": [encoded_string],
             "stream": False,
             "options": {"temperature": 0.1}
         }
+        output_format = ollama_output_format()
+        if output_format:
+            payload["format"] = output_format
         
-        print("[UPLOAD] Sending image to Ollama...")
-        response = requests.post(url, json=payload, timeout=180)
-        response.raise_for_status()
+        key, cached = cached_result(dict(payload, images=images), use_cache)
+        if cached is not None:
+            return cached
         
-        result = response.json()
+        print("[UPLOAD] Sending image to Ollama...")
+        generate_start = time.time()
+        result = ollama_generate(payload, timeout=180, scanner=IncrementalJSONScanner(EXTRACTION_FIELDS, OLLAMA_STREAM_MAX_CHARS), images=images)
+        vision_stats['generate_seconds'] = round(time.time() - generate_start, 3)
+        vision_stats['total_seconds'] = round(time.time() - start_time, 3)
         output_text = result.get('response', '')
         
-        # Clean and parse JSON (Reuse logic from extract_invoice_direct)
-        cleaned_text = output_text.strip()
-        if cleaned_text.startswith('```json'): cleaned_text = cleaned_text[7:]
-        if cleaned_text.startswith('```'): cleaned_text = cleaned_text[3:]
-        if cleaned_text.endswith('```'): cleaned_text = cleaned_text[:-3]
-        cleaned_text = cleaned_text.strip()
-        
         try:
-            data = json.loads(cleaned_text)
-            return {'success': True, 'data': data, 'model': OLLAMA_MODEL}
+            data, repairs = parse_ollama_output(output_text)
+            extraction = {'success': True, 'data': data, 'model': OLLAMA_MODEL, 'vision_stats': vision_stats}
+            if repairs:
+                extraction['json_repairs'] = repairs
+            if key and cacheable(data, repairs):
+                llm_cache.set(key, extraction)
+            return extraction
         except json.JSONDecodeError:
-            print(f"[ERROR] Failed to parse Vision JSON: {cleaned_text[:100]}...")
-            return {'success': False, 'error': 'Failed to parse Vision output', 'raw_output': cleaned_text}
+            print(f"[ERROR] Failed to parse Vision JSON: {output_text[:100]}...")
+            return {'success': False, 'error': 'Failed to parse Vision output', 'raw_output': output_text}
             
     except Exception as e:
         print(f"[ERROR] Vision extraction error: {e}")
         return {'success': False, 'error': f'Vision error: {str(e)}'}
 
 
+# ============================================================================
+# VENDOR LAYOUT TEMPLATES (FAST PATH)
+# ============================================================================
+
+# Recurring vendor layouts are extracted from learned anchored regions of the
+# OCR word boxes, without an LLM call (falls back to the LLM on any doubt)
+LAYOUT_TEMPLATES = getattr(settings, 'LAYOUT_TEMPLATES', True)
+LAYOUT_TEMPLATE_MIN_SAMPLES = getattr(settings, 'LAYOUT_TEMPLATE_MIN_SAMPLES', 2)
+LAYOUT_TEMPLATE_MATCH = getattr(settings, 'LAYOUT_TEMPLATE_MATCH', 0.7)
+fast_path_stats = FastPathStats()
+
+
+def active_layout_templates():
+    """Templates the fast path may use ([] when disabled or Tesseract is not installed)."""
+    if not LAYOUT_TEMPLATES or layout_templates.pytesseract is None:
+        return []
+    from finance.models import VendorTemplate
+    return list(VendorTemplate.objects.filter(enabled=True, samples__gte=LAYOUT_TEMPLATE_MIN_SAMPLES))
+
+
+def layout_template_status():
+    from finance.models import VendorTemplate
+    status = fast_path_stats.status()
+    status['templates'] = VendorTemplate.objects.count()
+    status['active_templates'] = VendorTemplate.objects.filter(
+        enabled=True, samples__gte=LAYOUT_TEMPLATE_MIN_SAMPLES
+    ).count()
+    return status
+
+
+def ocr_first_page(file_path):
+    """Word boxes of page 1 only: enough to match a vendor layout ([] on failure)."""
+    try:
+        return layout_templates.ocr_pages(file_path, tesseract_cmd=TESSERACT_PATH, last_page=1)
+    except Exception as e:
+        print(f"[WARNING] OCR of page 1 failed: {e}")
+        return []
+
+
+def ocr_with_layout(file_path, head=None):
+    """
+    OCR text and word boxes from a single Tesseract pass.
+
+    Args:
+        head: pages already OCR'd from the start of the document (page 1 from
+              template matching); only the pages after them are OCR'd
+
+    Returns:
+        tuple: (text, list of layout_templates.Page)
+    """
+    pages = list(head or [])
+    try:
+        print(f"[SEARCH] Performing OCR with word boxes: {file_path}")
+        pages += layout_templates.ocr_pages(file_path, tesseract_cmd=TESSERACT_PATH, first_page=len(pages) + 1)
+    except Exception as e:
+        print(f"[WARNING] OCR failed: {e}")
+        if not pages:
+            return "", []
+    if file_path.lower().endswith('.pdf'):
+        text = "".join(page_text(page) + "\n" + PAGE_SEPARATOR for page in pages)
+    else:
+        text = page_text(pages[0]) if pages else ""
+    print(f"[FILE] OCR extracted {len(text)} characters")
+    return text, pages
+
+
+def match_layout_template(templates, head):
+    """
+    Vendor template whose page-1 fingerprint matches the document.
+
+    Returns:
+        tuple: (template or None, score)
+    """
+    if not head:
+        return None, 0.0
+    try:
+        template, score = best_match(templates, head[0], LAYOUT_TEMPLATE_MATCH)
+    except Exception as e:
+        fast_path_stats.record('fallback', 'error')
+        logger.error(f"[TEMPLATE] Template matching error: {e}")
+        return None, 0.0
+    if template is None:
+        fast_path_stats.record('no_match')
+        logger.info(f"[TEMPLATE] No vendor template matches (best score {score})")
+    return template, score
+
+
+def template_fast_path(template, score, pages, ocr_text):
+    """
+    Extract with a matched vendor template.
+
+    Returns:
+        dict: extraction result, or None to use the LLM
+    """
+    if not pages:
+        return None
+    from django.db.models import F
+    from finance.models import VendorTemplate
+
+    start = time.time()
+    try:
+        data, problems = layout_templates.extract(template.rules, pages, ocr_text, EXTRACTION_FIELDS)
+    except Exception as e:
+        fast_path_stats.record('fallback', 'error')
+        logger.error(f"[TEMPLATE] Template extraction error: {e}")
+        return None
+    vendor = template.vendor_name or template.vendor_key
+    if problems:
+        fast_path_stats.record('fallback', problems[0].split(':')[0])
+        VendorTemplate.objects.filter(pk=template.pk).update(fallbacks=F('fallbacks') + 1)
+        logger.info(f"[TEMPLATE] {vendor} layout matched ({score}) but: {'; '.join(problems)}. Using the LLM")
+        return None
+
+    fast_path_stats.record('hit')
+    VendorTemplate.objects.filter(pk=template.pk).update(hits=F('hits') + 1)
+    info = {'template_id': template.pk, 'vendor': vendor, 'score': score, 'seconds': round(time.time() - start, 3)}
+    logger.info(f"[TEMPLATE] Extracted with the {vendor} layout template in {info['seconds']}s (no LLM call)")
+    return {
+        'success': True,
+        'data': data,
+        'method': 'layout_template',
+        'model': f"template:{template.vendor_key}",
+        'template': info,
+    }
+
+
+# Fields process_invoice overwrites with the enhanced PO and Axpert names
+DOCUMENT_VALUE_FIELDS = ("Vendor_Name", "Customer_Name", "PO_Number")
+
+
+def vendor_template_key(data):
+    """Vendor TRN when the extraction has a valid one, else the normalized vendor name."""
+    trn = normalize_trn(data.get('VATIN'))
+    if re.fullmatch(r"OM\d{10}", trn):
+        return trn
+    return re.sub(r"[^A-Z0-9]+", " ", str(data.get('Vendor_Name') or '').upper()).strip()[:100]
+
+
+def learn_layout_template(file_path, extracted_data):
+    """
+    Create or refine the vendor's layout template from an accepted extraction.
+
+    Returns:
+        VendorTemplate or None when the document cannot be learned from
+    """
+    from finance.models import VendorTemplate
+
+    # Learn what is printed on the document, not the Axpert vendor/branch names
+    # and enhanced PO that process_invoice put in their place
+    data = dict(extracted_data or {})
+    data.update(data.pop('model_values', None) or {})
+    key = vendor_template_key(data)
+    if not key or not file_path.lower().endswith(IMAGE_EXTENSIONS + ('.pdf',)):
+        return None
+    text, pages = ocr_with_layout(file_path)
+    if not pages:
+        return None
+
+    rules = layout_templates.learn(pages, text, data, EXTRACTION_FIELDS)
+    cells = fingerprint(pages[0])
+    template, created = VendorTemplate.objects.get_or_create(vendor_key=key)
+    if created:
+        template.fingerprint = cells
+    else:
+        template.fingerprint = merge_fingerprints(template.fingerprint, cells)
+        # Fields not found this time keep the rule learned earlier
+        rules['fields'] = dict(template.rules.get('fields', {}), **rules['fields'])
+        rules['constants'] = dict(template.rules.get('constants', {}), **rules['constants'])
+    template.rules = rules
+    template.vendor_name = str(data.get('Vendor_Name') or template.vendor_name)[:255]
+    template.samples += 1
+    template.save()
+    logger.info(
+        f"[TEMPLATE] Learned {template.vendor_name or key} layout: {len(rules['fields'])} anchored field(s), "
+        f"{len(template.fingerprint)} static words, {template.samples} sample(s)"
+    )
+    return template
+
+
 # ============================================================================
 # EXCEL & EMAIL FUNCTIONALITY
 # ============================================================================
@@ -945,35 +1688,45 @@ def extract_invoice_vision(file_path):
 # MAIN PROCESSING FUNCTION
 # ============================================================================
 
-def process_invoice(submission):
+def extract_document(file_path, use_cache=True, known_ocr_text=None):
     """
-    Main function to process an invoice submission with enhanced extraction
+    Run the extraction pipeline for a single document file.
     Parallelizes AI extraction (Ollama/N8n) with OCR data reading.
-    
+
     Args:
-        submission: Submission model instance
-        
+        file_path: Path to the document file
+        use_cache: False re-runs every LLM call instead of replaying cached results
+        known_ocr_text: OCR text already read (e.g. by the invoice splitter), reused instead of OCR
+
     Returns:
-        dict: Processing result with extracted data, PO info, and Axpert data
+        tuple: (extraction result dict, OCR text)
     """
-    sys.stderr.write(f"\n[START] Starting process_invoice for submission {submission.id}\n")
-    sys.stderr.flush()
-    start_time = time.time()
-    
-    # Get the invoice document
-    invoice_doc = submission.documents.filter(document_type='invoice').first()
-    
-    if not invoice_doc:
-        return {
-            'success': False,
-            'error': 'No invoice document found'
-        }
-    
-    file_path = invoice_doc.file.path
-    logger.info(f"[FILE] Processing invoice: {file_path}")
-    
+    logger.info(f"[FILE] Processing document: {file_path}")
+
+    # Word documents carry a native text layer: skip n8n, vision and OCR
+    if file_path.lower().endswith(WORD_EXTENSIONS):
+        logger.info("[PROCESS] Word document detected. Using native text extraction...")
+        text = extract_document_text(file_path)
+        if not text or len(text.strip()) < 50:
+            return {
+                'success': False,
+                'error': 'Failed to extract text from Word document.'
+            }, text
+        return extract_with_routing(text, file_path, use_cache), text
+
+    # Known vendor layouts skip the LLM: decide on page 1 before any LLM call is made
+    templates = active_layout_templates()
+    head = ocr_first_page(file_path) if templates else []
+    template, score = match_layout_template(templates, head)
+    layout_text = None
+    if template:
+        layout_text, pages = ocr_with_layout(file_path, head)
+        result = template_fast_path(template, score, pages, layout_text)
+        if result:
+            return result, layout_text
+
     # Define Parallel Tasks
-    
+
     def task_ai_extraction():
         """Attempts N8N or Vision extraction. Returns result or None if fallback needed."""
         if N8N_WEBHOOK_URL:
@@ -983,12 +1736,12 @@ def process_invoice(submission):
                 return res
             logger.warning(f"[WARNING] n8n extraction failed. Falling back...")
 
-        # VISION PATH: If model is Moondream/Vision AND finding is an Image
-        is_image = file_path.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp'))
+        # VISION PATH: If model is Moondream/Vision AND the file is an image or PDF
+        is_image = file_path.lower().endswith(IMAGE_EXTENSIONS + ('.pdf',))
         is_vision_model = 'moondream' in OLLAMA_MODEL or 'llava' in OLLAMA_MODEL
         
         if is_image and is_vision_model:
-            res = extract_invoice_vision(file_path)
+            res = extract_invoice_vision(file_path, use_cache)
             if res['success']: 
                 return res
             logger.warning("[WARNING] Vision extraction failed...")
@@ -997,7 +1750,15 @@ def process_invoice(submission):
 
     def task_ocr_reading():
         """Performs heavy OCR reading for text content and PO detection."""
+        if known_ocr_text:
+            return known_ocr_text
+        if layout_text is not None:
+            # Already read in full for the template attempt
+            return layout_text
         logger.info("[PARALLEL] Starting OCR data reading...")
+        if head:
+            # Page 1 was OCR'd for template matching; read only the rest
+            return ocr_with_layout(file_path, head)[0]
         # Use robust OCR (Tesseract) for best PO detection accuracy
         # This runs in parallel with AI extraction
         if file_path.lower().endswith('.pdf'):
@@ -1012,59 +1773,466 @@ def process_invoice(submission):
     result = None
     ocr_text = ""
     
-    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=3)
+    try:
         future_ai = executor.submit(task_ai_extraction)
         future_ocr = executor.submit(task_ocr_reading)
         
         logger.info("[PROCESS] Waiting for parallel tasks (AI + OCR)...")
         try:
-            result = future_ai.result()
-            ocr_text = future_ocr.result()
+            if N8N_WEBHOOK_URL and HEDGE_N8N:
+                result, ocr_text = hedge_n8n(executor, future_ai, future_ocr, file_path, use_cache)
+            else:
+                result = future_ai.result()
+                ocr_text = future_ocr.result()
         except Exception as e:
             logger.error(f"[ERROR] Parallel execution error: {e}")
             traceback.print_exc()
+    finally:
+        # A losing n8n call cannot be recalled; let it finish in the background
+        executor.shutdown(wait=False)
 
     # Fallback / Local Text-Based Ollama
     if not result:
         logger.info(f"[PROCESS] AI Extraction returned None. Using Ollama direct extraction with {OLLAMA_MODEL}...")
         
         # Use the OCR text we just computed in parallel!
-        if not ocr_text or len(ocr_text.strip()) < 50:
-             logger.warning("[WARNING] OCR text is empty or poor. Trying PyPDF2 fallback if PDF...")
-             if file_path.lower().endswith('.pdf'):
-                 ocr_text = extract_text_from_pdf(file_path)
+        ocr_text = fallback_text(ocr_text, file_path)
         
         if not ocr_text or len(ocr_text.strip()) < 50:
             logger.error("[ERROR] Failed to extract meaningful text from document.")
             return {
                 'success': False,
                 'error': 'Failed to extract text from document (scanned/empty content). OCR may be required.'
-            }
+            }, ocr_text
         
-        result = extract_invoice_via_ollama(ocr_text)
+        result = extract_with_routing(ocr_text, file_path, use_cache)
+    else:
+        result, ocr_text = reextract_if_invalid(result, ocr_text, file_path, use_cache)
+
+    return result, ocr_text
+
+
+# ============================================================================
+# HEDGED EXTRACTION (N8N vs DIRECT OLLAMA)
+# ============================================================================
+
+def fallback_text(ocr_text, file_path):
+    """OCR text, or the PDF text layer when OCR came back empty or poor."""
+    if not ocr_text or len(ocr_text.strip()) < 50:
+        logger.warning("[WARNING] OCR text is empty or poor. Trying PyPDF2 fallback if PDF...")
+        if file_path.lower().endswith('.pdf'):
+            return extract_text_from_pdf(file_path)
+    return ocr_text
+
+
+def hedge_n8n(executor, future_ai, future_ocr, file_path, use_cache=True):
+    """
+    Wait for the n8n extraction up to HEDGE_PERCENTILE of its recent latency.
+    If it is still running, start direct Ollama on the OCR text and use
+    whichever successful result arrives first; a losing Ollama call is
+    cancelled mid-stream.
+
+    Returns:
+        tuple: (result dict or None to fall back, OCR text)
+    """
+    started = time.time()
+    delay = n8n_latency.percentile(HEDGE_PERCENTILE, default=HEDGE_DEFAULT_DELAY)
+    done, _ = concurrent.futures.wait([future_ai], timeout=delay)
+    ocr_text = future_ocr.result()
+    if done or future_ai.done():
+        return future_ai.result(), ocr_text
+
+    text = fallback_text(ocr_text, file_path)
+    if not text or len(text.strip()) < 50:
+        return future_ai.result(), ocr_text
+    if not _hedge_slots.acquire(blocking=False):
+        logger.info("[HEDGE] Hedge cap reached; waiting for n8n")
+        return future_ai.result(), ocr_text
+
+    logger.info(f"[HEDGE] n8n slower than {delay:.1f}s; racing direct Ollama")
+    cancel = threading.Event()
+
+    def task_direct():
+        try:
+            with cancellation(cancel):
+                return extract_with_routing(text, file_path, use_cache)
+        finally:
+            _hedge_slots.release()
+
+    future_direct = executor.submit(task_direct)
+    backends = {future_ai: 'n8n', future_direct: 'ollama_direct'}
+    hedge = {'delay': round(delay, 2), 'winner': None}
+    direct_result = None
+    pending = set(backends)
+    while pending:
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            res = future.result()
+            if future is future_direct:
+                direct_result = res
+            if res and res.get('success'):
+                hedge['winner'] = backends[future]
+                if future is future_ai:
+                    cancel.set()
+                logger.info(f"[HEDGE] {backends[future]} won after {time.time() - started:.1f}s")
+                res['hedge'] = hedge
+                return res, text
+
+    # Neither succeeded: return the direct result so the fallback is not run again
+    if direct_result is not None:
+        direct_result['hedge'] = hedge
+    return direct_result, text
+
+
+# ============================================================================
+# MULTI-INVOICE PDF SPLITTING
+# ============================================================================
+
+MULTI_INVOICE_SPLITTING = getattr(settings, 'MULTI_INVOICE_SPLITTING', True)
+MAX_SPLIT_WORKERS = getattr(settings, 'MAX_SPLIT_WORKERS', 4)
+
+
+def split_multi_invoice(file_path):
+    """
+    Detect several invoices scanned into one PDF before anything is sent to
+    the LLM: from the text layer, or OCR when the PDF is scanned.
+
+    Returns:
+        tuple: (segments ({'pages', 'invoice_no', 'text'}) when more than one
+                invoice is found, otherwise an empty list;
+                OCR text when OCR had to run, for reuse, otherwise None)
+    """
+    if not file_path.lower().endswith('.pdf'):
+        return [], None
+
+    pages = read_pdf_pages(file_path)
+    if len(pages) < 2:
+        return [], None
+    ocr_text = None
+    if len("".join(pages).strip()) < 100:
+        ocr_text = extract_text_via_ocr(file_path)
+        # Blank pages are kept so segment page indices stay those of the PDF
+        pages = split_pages(ocr_text, keep_empty=True)
+        if sum(1 for page in pages if page.strip()) < 2:
+            return [], ocr_text
+
+    segments = detect_invoice_segments(pages)
+    for segment in segments:
+        segment['text'] = segment_text(pages, segment)
+    # Blank leading pages form a segment of their own: nothing to extract
+    segments = [segment for segment in segments if segment['text'].strip()]
+    if len(segments) < 2:
+        return [], ocr_text
+    return segments, ocr_text
+
+
+def extract_split_invoices(segments, file_path, use_cache=True):
+    """
+    Fan out one routed extraction per invoice segment in parallel.
+
+    Returns:
+        list: one entry per invoice, in page order
+    """
+    def run(segment):
+        entry = {
+            'pages': [index + 1 for index in segment['pages']],
+            'invoice_no': segment['invoice_no'] or '',
+        }
+        res = extract_with_routing(segment['text'], file_path, use_cache, pages=segment['pages'])
+        entry['success'] = bool(res.get('success'))
+        entry['model'] = res.get('model', '')
+        entry['routing'] = res.get('routing')
+        if not entry['success']:
+            entry['error'] = res.get('error', 'Extraction failed')
+            return entry
+
+        data = res['data']
+        po = extract_po_number(data, ocr_text=segment['text'])
+        if po:
+            data['PO_Number'] = po
+        entry['data'] = data
+        entry['po_number'] = po
+        return entry
+
+    workers = max(1, min(len(segments), MAX_SPLIT_WORKERS))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run, segments))
+
+
+# ============================================================================
+# INWARD (INVOICE + DO + PO) RECONCILIATION
+# ============================================================================
+
+INWARD_DOCUMENT_TYPES = ('invoice', 'delivery_order', 'purchase_order')
+
+# Extract DO and PO alongside the invoice for inward submissions
+INWARD_PARALLEL_EXTRACTION = getattr(settings, 'INWARD_PARALLEL_EXTRACTION', True)
+
+# Relative tolerance when comparing amounts across documents (1%)
+RECONCILIATION_TOLERANCE = getattr(settings, 'RECONCILIATION_TOLERANCE', 0.01)
+
+
+def _amount(value):
+    """Decimal amount or quantity ('1,234.500 OMR', '1.234,50'), None when missing or unreadable."""
+    return parse_amount(value)[0]
 
-    if not result or not result['success']:
-        return result or {'success': False, 'error': 'Extraction failed'}
+
+def _amount_str(value):
+    return str(value) if value is not None else None
+
+
+def _normalize_description(text):
+    return re.sub(r"[^a-z0-9]+", " ", str(text or "").lower()).strip()
+
+
+def reconcile_inward_documents(documents):
+    """
+    Cross-check the invoice against its delivery order and purchase order.
+
+    Args:
+        documents: dict of document_type -> {'data': extracted dict, 'po_number': str}
+
+    Returns:
+        dict: Reconciliation record with a status per check and an overall status
+    """
+    checks = {}
+
+    # 1. PO number must agree on every document that carries one
+    po_numbers = {
+        doc_type: doc['po_number'] for doc_type, doc in documents.items() if doc.get('po_number')
+    }
+    if len(po_numbers) < 2:
+        checks['po_number'] = {'status': 'missing', 'values': po_numbers}
+    else:
+        status = 'match' if len(set(po_numbers.values())) == 1 else 'mismatch'
+        checks['po_number'] = {'status': status, 'values': po_numbers}
+
+    # 2. Invoice total should not exceed / differ from the ordered total
+    invoice_data = documents.get('invoice', {}).get('data') or {}
+    po_data = documents.get('purchase_order', {}).get('data') or {}
+    # Amounts are Decimals (stored as strings, like the validation report)
+    invoice_total = _amount(invoice_data.get('Total'))
+    po_total = _amount(po_data.get('Total'))
+    if invoice_total is None or po_total is None:
+        checks['total'] = {
+            'status': 'missing', 'invoice': _amount_str(invoice_total), 'purchase_order': _amount_str(po_total),
+        }
+    else:
+        diff = abs(invoice_total - po_total)
+        within = diff <= max(abs(po_total), Decimal(1)) * Decimal(str(RECONCILIATION_TOLERANCE))
+        checks['total'] = {
+            'status': 'match' if within else 'mismatch',
+            'invoice': str(invoice_total),
+            'purchase_order': str(po_total),
+            'difference': str(invoice_total - po_total),
+        }
+
+    # 3. Invoiced quantities should have been delivered
+    do_data = documents.get('delivery_order', {}).get('data') or {}
+    delivered = {}
+    for item in do_data.get('Items') or []:
+        if not isinstance(item, dict):
+            continue
+        key = _normalize_description(item.get('Item_Description'))
+        qty = _amount(item.get('Quantity'))
+        if key and qty is not None:
+            delivered[key] = delivered.get(key, Decimal(0)) + qty
+
+    item_results = []
+    for item in invoice_data.get('Items') or []:
+        if not isinstance(item, dict):
+            continue
+        key = _normalize_description(item.get('Item_Description'))
+        invoiced_qty = _amount(item.get('Quantity'))
+        delivered_qty = delivered.get(key)
+        if invoiced_qty is None or delivered_qty is None:
+            status = 'missing'
+        elif invoiced_qty <= delivered_qty:
+            status = 'match'
+        else:
+            status = 'mismatch'
+        item_results.append({
+            'description': item.get('Item_Description', ''),
+            'invoiced': _amount_str(invoiced_qty),
+            'delivered': _amount_str(delivered_qty),
+            'status': status,
+        })
+    if not item_results:
+        checks['items'] = {'status': 'missing', 'lines': []}
+    else:
+        statuses = {line['status'] for line in item_results}
+        overall = 'mismatch' if 'mismatch' in statuses else ('missing' if 'missing' in statuses else 'match')
+        checks['items'] = {'status': overall, 'lines': item_results}
+
+    statuses = {check['status'] for check in checks.values()}
+    if 'mismatch' in statuses:
+        status = 'mismatch'
+    elif statuses == {'match'}:
+        status = 'matched'
+    else:
+        status = 'incomplete'
+
+    return {'status': status, 'checks': checks}
+
+
+def extract_inward_documents(documents, use_cache=True, ocr_texts=None):
+    """
+    Extract the delivery order and purchase order concurrently with the invoice.
+    Wall-clock time tracks the slowest document instead of the sum.
+
+    Args:
+        documents: dict of document_type -> file path
+        ocr_texts: dict of document_type -> OCR text already read (not OCR'd again)
+
+    Returns:
+        dict: document_type -> (extraction result, OCR text)
+    """
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(documents)) as executor:
+        futures = {
+            executor.submit(extract_document, path, use_cache, (ocr_texts or {}).get(doc_type)): doc_type
+            for doc_type, path in documents.items()
+        }
+        for future in concurrent.futures.as_completed(futures):
+            doc_type = futures[future]
+            try:
+                results[doc_type] = future.result()
+            except Exception as e:
+                logger.error(f"[ERROR] {doc_type} extraction error: {e}")
+                traceback.print_exc()
+                results[doc_type] = ({'success': False, 'error': str(e)}, "")
+    return results
+
+
+def process_invoice(submission, use_cache=True):
+    """
+    Main function to process an invoice submission with enhanced extraction
+    Parallelizes AI extraction (Ollama/N8n) with OCR data reading.
+    For inward submissions the DO and PO are extracted in parallel as well
+    and reconciled against the invoice.
     
-    # Step 2: Enhance extracted data with PO detection (Using validated OCR text)
-    extracted_data = result['data']
-    alert(extracted_data, "EXTRACTED AI DATA")
+    Args:
+        submission: Submission model instance
+        use_cache: False bypasses the LLM cache (forced restart)
+        
+    Returns:
+        dict: Processing result with extracted data, PO info, and Axpert data
+    """
+    sys.stderr.write(f"\n[START] Starting process_invoice for submission {submission.id}\n")
+    sys.stderr.flush()
+    start_time = time.time()
     
-    # Pass the pre-computed OCR text to avoid re-running OCR
-    po_number = extract_po_number(extracted_data, file_path, ocr_text=ocr_text)
-    alert(po_number, "DETECTED PO NUMBER")
+    # Get the invoice document
+    invoice_doc = submission.documents.filter(document_type='invoice').first()
     
+    if not invoice_doc:
+        return {
+            'success': False,
+            'error': 'No invoice document found'
+        }
+    
+    with contextlib.ExitStack() as stack:
+        # Documents are read through the storage backend (local or remote)
+        file_path = stack.enter_context(local_copy(invoice_doc.file))
+        logger.info(f"[FILE] Processing invoice: {invoice_doc.file.name}")
+
+        # Several invoices in one PDF: split on the text layer / OCR first and
+        # extract each one separately, in parallel (the mixed document never goes to the LLM)
+        segments, ocr_text = split_multi_invoice(file_path) if MULTI_INVOICE_SPLITTING else ([], None)
+        sub_invoices = []
+        if segments:
+            logger.info(f"[PARALLEL] Detected {len(segments)} invoices in one document. Splitting...")
+            sub_invoices = extract_split_invoices(segments, file_path, use_cache)
+            alert([(s['pages'], s['invoice_no'], s['success']) for s in sub_invoices], "SPLIT INVOICES")
+        primary = next((s for s in sub_invoices if s['success']), None)
+        if sub_invoices and not primary:
+            logger.warning("[WARNING] No split invoice could be extracted. Extracting the whole document...")
+
+        supporting_results = {}
+        if submission.submission_type == 'inward' and INWARD_PARALLEL_EXTRACTION:
+            paths = {} if primary else {'invoice': file_path}
+            for doc in submission.documents.filter(document_type__in=INWARD_DOCUMENT_TYPES[1:]):
+                if doc.document_type not in paths:
+                    paths[doc.document_type] = stack.enter_context(local_copy(doc.file))
+            if paths:
+                logger.info(f"[PARALLEL] Inward mode: extracting {', '.join(paths)} concurrently")
+                # The splitter's OCR of the invoice (if it ran) is reused
+                supporting_results = extract_inward_documents(paths, use_cache, {'invoice': ocr_text})
+            if not primary:
+                result, ocr_text = supporting_results.pop('invoice')
+        elif not primary:
+            result, ocr_text = extract_document(file_path, use_cache, known_ocr_text=ocr_text)
+
+        if primary:
+            result = {
+                'success': True,
+                'data': primary['data'],
+                'method': 'split_invoices',
+                'model': primary['model'],
+                'routing': primary['routing'],
+            }
+        if not result or not result['success']:
+            return result or {'success': False, 'error': 'Extraction failed'}
+
+        # Step 2: Enhance extracted data with PO detection (Using validated OCR text)
+        extracted_data = result['data']
+        alert(extracted_data, "EXTRACTED AI DATA")
+
+        json_candidates = None
+        if primary:
+            # Lead with the first invoice; every invoice is kept under 'invoices'
+            extracted_data = dict(primary['data'])
+            extracted_data['invoices'] = sub_invoices
+            po_number = primary['po_number']
+        else:
+            # Pass the pre-computed OCR text to avoid re-running OCR
+            # (the local copy is still available if OCR has to run again)
+            json_candidates = candidate_scanner.scan_json(extracted_data)
+            po_number = extract_po_number(extracted_data, file_path, ocr_text=ocr_text, json_candidates=json_candidates)
+        alert(po_number, "DETECTED PO NUMBER")
+
+    # The values as printed, before the enhanced PO and the Axpert names replace
+    # them: layout templates are learned from these (see learn_layout_template)
+    extracted_data['model_values'] = {field: extracted_data.get(field, "") for field in DOCUMENT_VALUE_FIELDS}
+
     if po_number:
         extracted_data['PO_Number'] = po_number
         logger.info(f"[SUCCESS] Enhanced PO Number: {po_number}")
     
-    # Step 3: Extract VAT/TRN numbers
-    vat_numbers = extract_vat_numbers(json.dumps(extracted_data))
+    # Step 3: Extract VAT/TRN numbers (from the candidates PO detection already found)
+    if json_candidates is None:
+        json_candidates = candidate_scanner.scan_json(extracted_data)
+    vat_numbers = unique_values(of_kind(json_candidates, VAT))
     if vat_numbers:
         extracted_data['extracted_vat_numbers'] = vat_numbers
         alert(vat_numbers, "EXTRACTED VAT NUMBERS")
         logger.info(f"[SUCCESS] Extracted VAT/TRN: {vat_numbers}")
     
+    # Step 3b: Reconcile inward documents (invoice vs DO vs PO)
+    if supporting_results:
+        reconciliation_docs = {'invoice': {'data': extracted_data, 'po_number': po_number}}
+        inward_data = {}
+        for doc_type, (doc_result, doc_ocr_text) in supporting_results.items():
+            if not doc_result or not doc_result.get('success'):
+                inward_data[doc_type] = {'error': (doc_result or {}).get('error', 'Extraction failed')}
+                continue
+            doc_data = doc_result['data']
+            doc_po = extract_po_number(doc_data, ocr_text=doc_ocr_text)
+            inward_data[doc_type] = doc_data
+            reconciliation_docs[doc_type] = {'data': doc_data, 'po_number': doc_po}
+        extracted_data['inward_documents'] = inward_data
+        extracted_data['reconciliation'] = reconcile_inward_documents(reconciliation_docs)
+        alert(extracted_data['reconciliation'], "INWARD RECONCILIATION")
+
+    # Step 3c: Numeric validation (qty x price, items vs Subtotal, Subtotal x VAT vs Total)
+    validation = validate(extracted_data)
+    extracted_data['validation'] = validation
+    if validation['valid']:
+        logger.info(f"[VALIDATE] Amounts consistent (confidence {validation['confidence']})")
+    else:
+        logger.warning(f"[VALIDATE] {len(validation['problems'])} problem(s): {validation['problems']}")
+
     # Step 4: Fetch Axpert data if PO is available
     axpert_data = None
     if po_number and ORACLE_USER:
@@ -1128,7 +2296,32 @@ def process_invoice(submission):
 
     
     processing_time = time.time() - start_time
-    
+
+    # Per-task metrics stored on ExtractionTask.extraction_metrics
+    metrics = {}
+    if result.get('prompt_stats'):
+        metrics['prompt'] = result['prompt_stats']
+    routing = result.get('routing')
+    if routing:
+        metrics['routing'] = routing
+    if result.get('hedge'):
+        metrics['hedge'] = result['hedge']
+    if result.get('chunking'):
+        metrics['chunking'] = result['chunking']
+    if result.get('vision_stats'):
+        metrics['vision'] = result['vision_stats']
+    if result.get('template'):
+        metrics['template'] = result['template']
+    if result.get('json_repairs'):
+        metrics['json_repairs'] = result['json_repairs']
+    if result.get('reextraction'):
+        metrics['reextraction'] = result['reextraction']
+    metrics['validation'] = {
+        'valid': validation['valid'],
+        'problems': len(validation['problems']),
+        'confidence': validation['confidence'],
+    }
+
     return {
         'success': True,
         'data': extracted_data,
@@ -1137,7 +2330,10 @@ def process_invoice(submission):
         'model': result.get('model', OLLAMA_MODEL),
         'po_number': po_number,
         'vat_numbers': vat_numbers,
-        'has_axpert_data': axpert_data is not None
+        'has_axpert_data': axpert_data is not None,
+        'metrics': metrics,
+        'initial_model': routing['initial_model'] if routing else '',
+        'escalated': bool(routing and routing['escalations'])
     }
 
 
@@ -0,0 +1,134 @@
+"""
+Connections to the Axpert Oracle database.
+
+ORACLE_DSN normally points at the real Oracle instance and connections come
+from oracledb. For offline and load testing a DSN of the form
+
+    sqlite:/path/to/axpert.db?latency=0.05&error_rate=0.01
+
+connects to a SQLite stand-in instead (see `run_fake_backends`). The
+adapter understands the subset of Oracle SQL the extraction service uses
+(named binds, ||, DECODE, TRIM/LOWER) and adds the configured per-query
+latency and error rate.
+"""
+
+import random
+import sqlite3
+import time
+from urllib.parse import parse_qs, urlsplit
+
+SQLITE_PREFIX = 'sqlite:'
+
+# Tables and columns the extraction service reads
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS branch (
+    branchid INTEGER PRIMARY KEY, branchcode TEXT, branchname TEXT, trnno TEXT
+);
+CREATE TABLE IF NOT EXISTS currency (
+    currencyid INTEGER PRIMARY KEY, currency TEXT
+);
+CREATE TABLE IF NOT EXISTS vendor (
+    vendorid INTEGER PRIMARY KEY, vendorname TEXT, creditdays INTEGER, currency INTEGER,
+    trnno TEXT, cancel TEXT DEFAULT 'F', inactive TEXT DEFAULT 'F', controlaccount INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS pohdr (
+    pohdrid INTEGER PRIMARY KEY, docid TEXT, docdt TEXT, totpovalue REAL, netcostamt REAL,
+    payterm TEXT, currency INTEGER, supplier INTEGER, branchname INTEGER,
+    cancel TEXT DEFAULT 'F', approval TEXT DEFAULT 'Yes'
+);
+CREATE INDEX IF NOT EXISTS pohdr_docid ON pohdr (docid);
+CREATE INDEX IF NOT EXISTS branch_trnno ON branch (trnno);
+"""
+
+
+def _decode(value, *pairs):
+    """Oracle DECODE(expr, search1, result1, ..., default)."""
+    default = pairs[-1] if len(pairs) % 2 else None
+    for index in range(0, len(pairs) - 1, 2):
+        if value == pairs[index] or (value is None and pairs[index] is None):
+            return pairs[index + 1]
+    return default
+
+
+class SQLiteCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self._cursor = connection.raw.cursor()
+
+    @property
+    def description(self):
+        # Oracle reports column names in upper case
+        return [(d[0].upper(),) + tuple(d[1:]) for d in self._cursor.description or []]
+
+    def execute(self, sql, parameters=None, **kwargs):
+        self.connection.simulate()
+        params = dict(parameters or {}, **kwargs)
+        self._cursor.execute(sql, params)
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SQLiteConnection:
+    """oracledb-style connection (context manager, cursor()) over SQLite."""
+
+    def __init__(self, path, latency=0.0, error_rate=0.0):
+        self.raw = sqlite3.connect(path, check_same_thread=False)
+        self.raw.create_function('DECODE', -1, _decode, deterministic=True)
+        self.latency = latency
+        self.error_rate = error_rate
+
+    def simulate(self):
+        if self.latency:
+            time.sleep(random.expovariate(1.0 / self.latency))
+        if self.error_rate and random.random() < self.error_rate:
+            raise sqlite3.OperationalError('Simulated Oracle error (ORA-03113: end-of-file on communication channel)')
+
+    def cursor(self):
+        return SQLiteCursor(self)
+
+    def commit(self):
+        self.raw.commit()
+
+    def close(self):
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def parse_sqlite_dsn(dsn):
+    """'sqlite:/tmp/axpert.db?latency=0.05' -> ('/tmp/axpert.db', {'latency': 0.05, ...})"""
+    parts = urlsplit(dsn[len(SQLITE_PREFIX):])
+    query = parse_qs(parts.query)
+    profile = {
+        'latency': float(query.get('latency', ['0'])[0]),
+        'error_rate': float(query.get('error_rate', ['0'])[0]),
+    }
+    return parts.path, profile
+
+
+def connect(user, password, dsn):
+    """oracledb connection, or the SQLite stand-in for a 'sqlite:' DSN."""
+    if dsn.startswith(SQLITE_PREFIX):
+        path, profile = parse_sqlite_dsn(dsn)
+        return SQLiteConnection(path, **profile)
+
+    import oracledb
+    return oracledb.connect(user=user, password=password, dsn=dsn)
@@ -0,0 +1,95 @@
+"""
+Single-pass PO prefix matching.
+
+All known prefixes (full prefixes and their 4-character OCR-error keys) are
+compiled into one trie-shaped regex, so a text is scanned once regardless of
+how many prefixes there are. Matching follows the original per-prefix loop:
+the longest prefix found anywhere in the text wins, and a 4-character key
+is expanded through PREFIX_MAPPING with a leading '0' (a misread 'O')
+dropped from the number.
+"""
+
+import re
+import string
+from collections import namedtuple
+
+PrefixHit = namedtuple('PrefixHit', 'prefix start end raw po')
+
+# Length-preserving upper-casing (str.upper() can expand characters like 'ß')
+_ASCII_UPPER = str.maketrans(string.ascii_lowercase, string.ascii_uppercase)
+
+
+def trie_pattern(words):
+    """
+    Regex alternation factored into a trie (case-sensitive on the given
+    words). Greedy optional groups make the longest word win at a position.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = True
+
+    def build(node):
+        terminal = '' in node
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        # Longer continuations first so alternation prefers the longest word
+        branches.sort(key=len, reverse=True)
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if terminal:
+            return '(?:' + body + ')?'
+        return body
+
+    return build(trie)
+
+
+class PrefixMatcher:
+    """
+    Args:
+        prefixes: every string to search for (full prefixes and 4-char keys)
+        mapping: 4-char key -> full prefix (PREFIX_MAPPING)
+    """
+
+    def __init__(self, prefixes, mapping):
+        self.mapping = {k.upper(): v for k, v in mapping.items()}
+        self.prefixes = {p.upper() for p in prefixes}
+        # Zero-width lookahead so hits may overlap, like independent per-prefix searches.
+        # Texts are upper-cased before matching: a case-sensitive pattern scans much faster.
+        self.regex = re.compile(
+            r"(?=(?P<prefix>" + trie_pattern(sorted(self.prefixes)) + r")(?P<dash>-?)(?P<digits>\d+))"
+        )
+
+    def _po(self, prefix, digits):
+        if prefix in self.mapping:
+            # 'ATCP0123' is 'ATCPO123' with the O read as a zero
+            if digits.startswith("0"):
+                digits = digits[1:]
+            return self.mapping[prefix] + digits
+        return prefix + digits
+
+    def find_all(self, text):
+        """Every prefix hit in `text`, in text order."""
+        hits = []
+        text = text or ""
+        for match in self.regex.finditer(text.translate(_ASCII_UPPER)):
+            prefix = match.group('prefix')
+            digits = match.group('digits')
+            start = match.start()
+            end = start + len(match.group('prefix')) + len(match.group('dash')) + len(digits)
+            hits.append(PrefixHit(prefix, start, end, text[start:end], self._po(prefix, digits)))
+        return hits
+
+    def ranked(self, text):
+        """One hit per prefix (its first occurrence), longest prefix first, then text order."""
+        first = {}
+        for hit in self.find_all(text):
+            first.setdefault(hit.prefix, hit)
+        return sorted(first.values(), key=lambda h: (-len(h.prefix), h.start))
+
+    def best(self, text):
+        """The PO number the original prefix loop would pick, or None."""
+        ranked = self.ranked(text)
+        return ranked[0].po if ranked else None
@@ -0,0 +1,184 @@
+"""
+Token-budgeted prompt construction from OCR text.
+
+OCR output is normalized, repeated page headers/footers are removed, and
+when the text is still over budget the blocks most relevant to the
+extraction schema are kept (in their original order).
+"""
+
+import math
+import re
+
+# Rough chars-per-token for Llama-family tokenizers on invoice text
+CHARS_PER_TOKEN = 4
+
+PAGE_SEPARATOR = "\f"
+
+# Lines this close to the top/bottom of a page are header/footer candidates
+EDGE_LINES = 6
+
+FIELD_KEYWORDS = {
+    'invoice': 3, 'inv': 2, 'tax': 1, 'date': 2, 'po': 3, 'lpo': 3, 'order': 2,
+    'customer': 2, 'bill': 1, 'ship': 1, 'trn': 3, 'vat': 3, 'vatin': 3, 'total': 3,
+    'subtotal': 3, 'net': 1, 'gross': 1, 'amount': 2, 'qty': 2, 'quantity': 2,
+    'unit': 1, 'price': 2, 'rate': 1, 'description': 2, 'item': 2, 'no': 1, 'ref': 1,
+}
+
+BOILERPLATE_KEYWORDS = (
+    'terms and conditions', 'terms & conditions', 'bank', 'iban', 'swift',
+    'signature', 'thank you', 'authorized signatory', 'e&oe', 'goods once sold',
+)
+
+_WORD_RE = re.compile(r"[a-z]+")
+_NUMBER_RE = re.compile(r"\d[\d,]*\.?\d*")
+_AMOUNT_RE = re.compile(r"\d\.\d{2,3}\b")
+
+
+def estimate_tokens(text):
+    return int(math.ceil(len(text or "") / CHARS_PER_TOKEN))
+
+
+def normalize_whitespace(text):
+    """Collapse runs of spaces/tabs, strip lines and squeeze blank lines (page breaks kept)."""
+    pages = []
+    for page in (text or "").split(PAGE_SEPARATOR):
+        lines = [re.sub(r"[ \t\r\v]+", " ", line).strip() for line in page.split("\n")]
+        squeezed = []
+        for line in lines:
+            if line or (squeezed and squeezed[-1]):
+                squeezed.append(line)
+        pages.append("\n".join(squeezed).strip())
+    return PAGE_SEPARATOR.join(page for page in pages if page)
+
+
+def _line_key(line):
+    # Page numbers differ between pages; compare headers/footers without digits.
+    # Lines with decimal amounts are data (item rows): they only match exactly
+    if _AMOUNT_RE.search(line):
+        return line.lower()
+    return re.sub(r"\d+", "#", line.lower())
+
+
+def remove_repeated_edges(text):
+    """
+    Drop header/footer lines repeated across pages, keeping the first copy.
+
+    Returns:
+        tuple: (text, number of lines removed)
+    """
+    pages = text.split(PAGE_SEPARATOR)
+    if len(pages) < 2:
+        return text, 0
+
+    counts = {}
+    within_page = set()
+    for page in pages:
+        lines = page.split("\n")
+        edges = set(_line_key(l) for l in lines[:EDGE_LINES] + lines[-EDGE_LINES:] if l.strip())
+        for key in edges:
+            counts[key] = counts.get(key, 0) + 1
+        # Item rows look alike once digits are masked; a real header/footer occurs once per page
+        seen_on_page = set()
+        for line in lines:
+            key = _line_key(line)
+            if key in seen_on_page:
+                within_page.add(key)
+            elif line.strip():
+                seen_on_page.add(key)
+
+    threshold = max(2, len(pages) // 2 + 1)
+    repeated = {key for key, count in counts.items() if count >= threshold and key not in within_page}
+    if not repeated:
+        return text, 0
+
+    removed = 0
+    seen = set()
+    out_pages = []
+    for page in pages:
+        lines = page.split("\n")
+        kept = []
+        for index, line in enumerate(lines):
+            key = _line_key(line)
+            at_edge = index < EDGE_LINES or index >= len(lines) - EDGE_LINES
+            if at_edge and key in repeated:
+                if key in seen:
+                    removed += 1
+                    continue
+                seen.add(key)
+            kept.append(line)
+        out_pages.append("\n".join(kept))
+    return PAGE_SEPARATOR.join(out_pages), removed
+
+
+def split_blocks(text, max_lines=12):
+    """Blank-line separated blocks, long blocks cut into groups of max_lines."""
+    blocks = []
+    for raw in re.split(r"\n\s*\n|" + PAGE_SEPARATOR, text):
+        lines = [l for l in raw.split("\n") if l.strip()]
+        for start in range(0, len(lines), max_lines):
+            chunk = "\n".join(lines[start:start + max_lines])
+            if chunk:
+                blocks.append(chunk)
+    return blocks
+
+
+def score_block(block, position, total):
+    """Relevance of a block to the extraction schema."""
+    lower = block.lower()
+    words = _WORD_RE.findall(lower)
+    score = sum(FIELD_KEYWORDS.get(w, 0) for w in words)
+    numbers = len(_NUMBER_RE.findall(block))
+    score += min(numbers, 20) * 0.5
+    if any(k in lower for k in BOILERPLATE_KEYWORDS):
+        score -= 5
+    # Invoice headers live at the top; totals near the end
+    if position == 0:
+        score += 5
+    elif position == total - 1:
+        score += 2
+    # Normalize by size so one huge block does not win on volume alone
+    return score / max(1.0, math.sqrt(len(block) / 200.0))
+
+
+def build_invoice_text(text, token_budget):
+    """
+    Fit OCR text to a token budget.
+
+    Returns:
+        tuple: (prompt text, stats dict)
+    """
+    original_tokens = estimate_tokens(text)
+    normalized = normalize_whitespace(text)
+    deduped, removed_lines = remove_repeated_edges(normalized)
+
+    stats = {
+        'original_tokens': original_tokens,
+        'normalized_tokens': estimate_tokens(deduped),
+        'removed_repeated_lines': removed_lines,
+        'dropped_blocks': 0,
+        'token_budget': token_budget,
+    }
+
+    if not token_budget or estimate_tokens(deduped) <= token_budget:
+        stats['prompt_tokens'] = estimate_tokens(deduped)
+        return deduped, stats
+
+    blocks = split_blocks(deduped)
+    ranked = sorted(
+        range(len(blocks)),
+        key=lambda i: score_block(blocks[i], i, len(blocks)),
+        reverse=True,
+    )
+    chosen = set()
+    used = 0
+    for index in ranked:
+        cost = estimate_tokens(blocks[index]) + 1
+        if used + cost > token_budget:
+            continue
+        chosen.add(index)
+        used += cost
+
+    fitted = "\n\n".join(blocks[i] for i in sorted(chosen))
+    stats['dropped_blocks'] = len(blocks) - len(chosen)
+    stats['prompt_tokens'] = estimate_tokens(fitted)
+    return fitted, stats
@@ -0,0 +1,154 @@
+"""
+In-process index of Axpert branch TRN numbers -> PO prefix.
+
+The branch table is small and rarely changes, so it is loaded whole
+(TRNNO -> BRANCHCODE || 'PO') and prefix lookups become dictionary reads
+instead of an Oracle connection each. The index is reloaded every
+`refresh_interval` seconds by a background thread (or on demand), and a
+TRN that is not in the table is remembered as missing for `negative_ttl`
+seconds; after that a lookup of it schedules one reload of the table in
+the background, so a branch added in Axpert is picked up without waiting
+for the next refresh and without holding up the request that asked.
+"""
+
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_trn(trn):
+    return re.sub(r"\s+", "", str(trn or "")).upper()
+
+
+class TrnIndex:
+    """
+    Args:
+        loader: callable returning an iterable of (trn, prefix) rows
+        refresh_interval: seconds between background reloads
+        negative_ttl: seconds a missing TRN is answered from the cache
+    """
+
+    def __init__(self, loader, refresh_interval=3600, negative_ttl=300):
+        self.loader = loader
+        self.refresh_interval = refresh_interval
+        self.negative_ttl = negative_ttl
+        self._prefixes = None
+        self._missing = {}
+        self._loaded_at = None
+        self._attempted_at = None
+        self._load_seconds = None
+        self._error = ''
+        self._counts = {'hits': 0, 'misses': 0, 'negative_hits': 0, 'reloads': 0}
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._thread = None
+        self._reloader = None
+
+    @property
+    def loaded(self):
+        return self._prefixes is not None
+
+    def refresh(self):
+        """Reload the whole table. Returns False (keeping the old index) on failure."""
+        with self._load_lock:
+            start = self._attempted_at = time.time()
+            try:
+                prefixes = {}
+                for trn, prefix in self.loader():
+                    trn = normalize_trn(trn)
+                    if trn and prefix:
+                        prefixes.setdefault(trn, prefix)
+            except Exception as e:
+                with self._lock:
+                    self._error = str(e)
+                logger.warning(f"[TRN] Could not load branch TRN index: {e}")
+                return False
+
+            with self._lock:
+                self._prefixes = prefixes
+                self._missing = {}
+                self._loaded_at = time.time()
+                self._load_seconds = round(self._loaded_at - start, 3)
+                self._error = ''
+                self._counts['reloads'] += 1
+            logger.info(f"[TRN] Loaded {len(prefixes)} branch TRN(s) in {self._load_seconds}s")
+            return True
+
+    def ensure_loaded(self):
+        """
+        Load now if nothing else will: no background thread running and no
+        failed attempt within the last `negative_ttl` seconds.
+        """
+        if self.loaded:
+            return True
+        if self._thread is not None:
+            return False
+        if self._attempted_at and time.time() - self._attempted_at < self.negative_ttl:
+            return False
+        return self.refresh()
+
+    def lookup(self, trn):
+        """
+        Returns:
+            tuple: (prefix or None, answered) - answered is False when the
+            index has never loaded and the caller has to ask the database
+        """
+        trn = normalize_trn(trn)
+        now = time.time()
+        with self._lock:
+            if self._prefixes is None:
+                return None, False
+            prefix = self._prefixes.get(trn)
+            if prefix:
+                self._counts['hits'] += 1
+                return prefix, True
+            missing_since = self._missing.get(trn)
+            if missing_since is not None and now - missing_since < self.negative_ttl:
+                self._counts['negative_hits'] += 1
+                return None, True
+            # Unknown or expired miss: reload only if the index is older than the TTL
+            last_load = max(self._loaded_at or 0, self._attempted_at or 0)
+            if now - last_load >= self.negative_ttl:
+                self._reload_in_background()
+            self._missing[trn] = now
+            self._counts['misses'] += 1
+        return None, True
+
+    def _reload_in_background(self):
+        """Start a one-off reload unless one is already running (caller holds _lock)."""
+        if self._reloader is not None and self._reloader.is_alive():
+            return
+        self._reloader = threading.Thread(target=self.refresh, name='trn-index-reload', daemon=True)
+        self._reloader.start()
+
+    def _loop(self):
+        while True:
+            if not self.refresh() and not self.loaded:
+                # Not loaded yet (Oracle down at startup): retry sooner
+                time.sleep(min(self.refresh_interval, 60))
+                continue
+            time.sleep(self.refresh_interval)
+
+    def start(self):
+        """Load in the background now and keep refreshing."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name='trn-index', daemon=True)
+            self._thread.start()
+
+    def status(self):
+        with self._lock:
+            return dict(
+                self._counts,
+                loaded=self._prefixes is not None,
+                entries=len(self._prefixes or ()),
+                negative_entries=len(self._missing),
+                loaded_at=time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self._loaded_at)) if self._loaded_at else None,
+                load_seconds=self._load_seconds,
+                refresh_running=self._thread is not None,
+                error=self._error,
+            )
@@ -0,0 +1,215 @@
+"""
+Numeric validation of extracted invoices.
+
+All amounts of an extraction (item quantities, unit prices and amounts,
+Subtotal, VAT_Percentage, Total) are parsed in one batch into Decimals.
+The per-item check runs vectorized with NumPy when it is installed (plain
+Decimal arithmetic otherwise); sums stay in Decimal so money adds up exactly.
+
+    quantity x unit price  ~ amount      per item
+    sum of item amounts    ~ Subtotal
+    Subtotal x (1 + VAT%)  ~ Total
+
+Every checked field gets a status (ok / mismatch / missing / unparsed /
+unchecked) and a confidence. The problems list drives model escalation and
+automatic re-extraction.
+"""
+
+import re
+from decimal import Decimal, InvalidOperation
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+REQUIRED_FIELDS = ("Invoice_No", "Invoice_Date", "Total")
+
+# Relative tolerance when checking that amounts add up
+AMOUNT_TOLERANCE = Decimal("0.02")
+
+# Oman standard VAT rate, tried when VAT_Percentage was not extracted
+DEFAULT_VAT_RATES = (Decimal("5"), Decimal("0"))
+
+CONFIDENCE = {'ok': 1.0, 'unchecked': 0.6, 'mismatch': 0.3, 'unparsed': 0.2, 'missing': 0.0}
+
+_DIGITS_RE = re.compile(r"\d[\d,.' ]*\d|\d")
+
+
+def parse_amount(value):
+    """
+    '1,234.500', 'OMR 1.234,50', '(12.00)', '5%', 12 -> Decimal.
+
+    Returns:
+        tuple: (Decimal or None, status) - status is 'ok', 'missing' or 'unparsed'
+    """
+    if value is None or value == "":
+        return None, 'missing'
+    if isinstance(value, bool):
+        return None, 'unparsed'
+    if isinstance(value, (int, float, Decimal)):
+        return Decimal(str(value)), 'ok'
+
+    text = str(value).strip()
+    match = _DIGITS_RE.search(text)
+    if not match:
+        return None, ('missing' if not text else 'unparsed')
+    digits = match.group().replace(" ", "").replace("'", "")
+
+    if "," in digits and "." in digits:
+        # The last separator is the decimal point
+        if digits.rfind(",") > digits.rfind("."):
+            digits = digits.replace(".", "").replace(",", ".")
+        else:
+            digits = digits.replace(",", "")
+    elif "," in digits:
+        head, _, tail = digits.rpartition(",")
+        if digits.count(",") == 1 and len(tail) != 3:
+            digits = head + "." + tail  # Decimal comma: 12,50
+        else:
+            digits = digits.replace(",", "")
+    elif digits.count(".") > 1:
+        digits = digits.replace(".", "")  # 1.234.567
+
+    negative = text.startswith("(") and text.endswith(")") or text[:match.start()].rstrip().endswith("-")
+    try:
+        number = Decimal(digits)
+    except InvalidOperation:
+        return None, 'unparsed'
+    return (-number if negative else number), 'ok'
+
+
+def parse_amounts(values):
+    """parse_amount over a batch: (list of Decimal or None, list of statuses)."""
+    parsed = [parse_amount(v) for v in values]
+    return [p[0] for p in parsed], [p[1] for p in parsed]
+
+
+def close(a, b):
+    return abs(a - b) <= max(abs(b), Decimal(1)) * AMOUNT_TOLERANCE
+
+
+def _check_items(quantities, prices, amounts):
+    """Per item: True / False for qty x price ~ amount, None when a value is missing."""
+    if np is not None and amounts:
+        to_array = lambda values: np.array([float(v) if v is not None else np.nan for v in values], dtype=float)
+        q, p, a = to_array(quantities), to_array(prices), to_array(amounts)
+        known = ~(np.isnan(q) | np.isnan(p) | np.isnan(a))
+        with np.errstate(invalid='ignore'):
+            ok = np.abs(q * p - a) <= np.maximum(np.abs(a), 1.0) * float(AMOUNT_TOLERANCE)
+        return [bool(o) if k else None for o, k in zip(ok, known)]
+    return [
+        close(q * p, a) if None not in (q, p, a) else None
+        for q, p, a in zip(quantities, prices, amounts)
+    ]
+
+
+def _flag(status):
+    return {'status': status, 'confidence': CONFIDENCE[status]}
+
+
+def validate(data):
+    """
+    Check an extraction's numbers.
+
+    Returns:
+        dict: {'valid', 'problems', 'fields', 'items', 'confidence', 'engine'}
+    """
+    if not isinstance(data, dict):
+        return {'valid': False, 'problems': ["Extraction is not a JSON object"], 'fields': {}, 'items': [],
+                'confidence': 0.0, 'engine': None}
+
+    problems = [f"Missing {field}" for field in REQUIRED_FIELDS if not str(data.get(field) or "").strip()]
+    fields = {}
+
+    # One batch: every item value plus the three totals
+    items = [i for i in data.get("Items") or [] if isinstance(i, dict)]
+    n = len(items)
+    batch = (
+        [i.get("Quantity") for i in items] + [i.get("Unit_Price") for i in items] + [i.get("Amount") for i in items]
+        + [data.get("Subtotal"), data.get("VAT_Percentage"), data.get("Total")]
+    )
+    values, statuses = parse_amounts(batch)
+    quantities, prices, amounts = values[:n], values[n:2 * n], values[2 * n:3 * n]
+    (subtotal, vat, total), (subtotal_status, vat_status, total_status) = values[3 * n:], statuses[3 * n:]
+
+    # quantity x unit price ~ amount
+    item_flags = []
+    for index, (item, check) in enumerate(zip(items, _check_items(quantities, prices, amounts))):
+        if check is None:
+            status = statuses[2 * n + index] if amounts[index] is None else 'unchecked'
+        else:
+            status = 'ok' if check else 'mismatch'
+        if status == 'mismatch':
+            problems.append(f"Item '{item.get('Item_Description', '')}' quantity x price != amount")
+        item_flags.append(_flag(status))
+
+    # sum of item amounts ~ Subtotal
+    items_sum = sum(amounts, Decimal(0)) if amounts and None not in amounts else None
+    fields['Subtotal'] = _flag(subtotal_status)
+    if subtotal is not None and items_sum is not None:
+        if close(items_sum, subtotal):
+            fields['Subtotal'] = _flag('ok')
+        else:
+            fields['Subtotal'] = _flag('mismatch')
+            problems.append("Item amounts do not add up to Subtotal")
+    elif subtotal is not None:
+        fields['Subtotal'] = _flag('unchecked')
+
+    # Subtotal x (1 + VAT%) ~ Total
+    base = subtotal if subtotal is not None else items_sum
+    if vat is not None and not (0 <= vat <= 100):
+        vat, vat_status = None, 'unparsed'
+    fields['VAT_Percentage'] = _flag(vat_status)
+    fields['Total'] = _flag(total_status)
+    inferred_vat = None
+    if base is not None and total is not None:
+        rates = [vat] if vat is not None else DEFAULT_VAT_RATES
+        matching = [rate for rate in rates if close(base * (1 + rate / 100), total)]
+        if matching:
+            fields['Total'] = _flag('ok')
+            if vat is not None:
+                fields['VAT_Percentage'] = _flag('ok')
+            else:
+                inferred_vat = str(matching[0])
+        else:
+            fields['Total'] = _flag('mismatch')
+            if vat is not None:
+                fields['VAT_Percentage'] = _flag('mismatch')
+            problems.append("Subtotal x VAT does not match Total")
+    elif total is not None:
+        fields['Total'] = _flag('unchecked')
+
+    if items:
+        fields['Items'] = _flag(
+            'mismatch' if any(f['status'] == 'mismatch' for f in item_flags)
+            else 'ok' if all(f['status'] == 'ok' for f in item_flags) else 'unchecked'
+        )
+    for field in REQUIRED_FIELDS:
+        if field not in fields:
+            fields[field] = _flag('ok' if str(data.get(field) or "").strip() else 'missing')
+
+    scores = [f['confidence'] for f in fields.values()]
+    report = {
+        'valid': not problems,
+        'problems': problems,
+        'fields': fields,
+        'items': item_flags,
+        'confidence': round(sum(scores) / len(scores), 3) if scores else 0.0,
+        'engine': 'numpy' if np is not None else 'decimal',
+    }
+    if items_sum is not None:
+        report['items_sum'] = str(items_sum)
+    if inferred_vat is not None:
+        report['inferred_vat'] = inferred_vat
+    return report
+
+
+def validate_extraction(data):
+    """
+    Cheap sanity checks on an extraction.
+
+    Returns:
+        list: human-readable problems (empty when the extraction looks sound)
+    """
+    return validate(data)['problems']
@@ -0,0 +1,108 @@
+"""
+Compact image payloads for the vision extraction path.
+
+Phone photos and scans are downscaled to the resolution vision models
+actually use and re-encoded as JPEG; PDFs are rendered page by page. The
+/api/generate body is streamed, base64-encoding each image in slices, so
+the full base64 string is never held in memory.
+"""
+
+import base64
+import io
+import json
+import os
+import time
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+    ImageOps = None
+
+try:
+    from pdf2image import convert_from_path
+except ImportError:
+    convert_from_path = None
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp')
+
+# Raw bytes per base64 slice (multiple of 3 so slices concatenate cleanly)
+_B64_SLICE = 3 * 16384
+
+
+def _compact(image, max_side, quality):
+    if ImageOps is not None:
+        image = ImageOps.exif_transpose(image)  # Phone photos carry rotation in EXIF
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return buffer.getvalue(), image.size
+
+
+def prepare_images(file_path, max_side=1344, quality=85, max_pages=3, dpi=150):
+    """
+    Images to send to the vision model, one per page.
+
+    Returns:
+        tuple: (list of image bytes, stats dict)
+
+    Raises:
+        ValueError: the file cannot be turned into images here (PDF without pdf2image)
+    """
+    start = time.time()
+    original_bytes = os.path.getsize(file_path)
+    sizes = []
+    images = []
+
+    if file_path.lower().endswith('.pdf'):
+        if convert_from_path is None:
+            raise ValueError("pdf2image is not installed; cannot render PDF pages for vision")
+        pages = convert_from_path(file_path, dpi=dpi, first_page=1, last_page=max_pages)
+        for page in pages:
+            data, size = _compact(page, max_side, quality)
+            images.append(data)
+            sizes.append(size)
+    elif Image is None:
+        # Without Pillow the original file is sent unchanged
+        with open(file_path, 'rb') as f:
+            images.append(f.read())
+    else:
+        with Image.open(file_path) as image:
+            data, size = _compact(image, max_side, quality)
+        images.append(data)
+        sizes.append(size)
+
+    stats = {
+        'pages': len(images),
+        'original_bytes': original_bytes,
+        'image_bytes': sum(len(i) for i in images),
+        'payload_bytes': sum(4 * ((len(i) + 2) // 3) for i in images),
+        'image_sizes': sizes,
+        'prepare_seconds': round(time.time() - start, 3),
+    }
+    return images, stats
+
+
+class StreamedGenerateBody:
+    """
+    JSON body for /api/generate with `images` appended as streamed base64.
+
+    Iterable more than once, so the HTTP client can re-send it on retry.
+    """
+
+    def __init__(self, payload, images):
+        self.payload = payload
+        self.images = images
+
+    def __iter__(self):
+        head = json.dumps(self.payload)
+        # Re-open the object to append the images array
+        yield (head[:-1] + (', ' if len(head) > 2 else '') + '"images": [').encode('utf-8')
+        for index, data in enumerate(self.images):
+            yield b',"' if index else b'"'
+            for start in range(0, len(data), _B64_SLICE):
+                yield base64.b64encode(data[start:start + _B64_SLICE])
+            yield b'"'
+        yield b']}'
@@ -1,3 +1,1076 @@
-from django.test import TestCase
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import zipfile
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.apps import apps
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from finance.management.commands.benchmark_json_repair import defects, synthetic_invoice
+from finance.management.commands.benchmark_po_matcher import legacy_find, synthetic_text
+from finance.models import VendorTemplate
+from finance.services import layout_templates, ollama_service, validation
+from finance.services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from finance.services.concurrency import AdaptiveLimiter, cancelled
+from finance.services.fake_backends import fake_extraction
+from finance.services.http_client import BackendClient
+from finance.services.candidates import PO_DIGITS, PO_PREFIXED, VAT, CandidateScanner, best_prefixed, of_kind
+from finance.services.item_chunks import merge_items
+from finance.services.layout_templates import Page, Word, page_text
+from finance.services.json_stream import repair_json
+from finance.services.llm_cache import LLMCache, cache_key
+from finance.services.ollama_pool import OllamaPool
+from finance.services.ollama_service import po_matcher
+from finance.services.po_matcher import PrefixMatcher
+from finance.services.prompt_builder import build_invoice_text, estimate_tokens, normalize_whitespace, remove_repeated_edges
+from finance.services.trn_index import TrnIndex
+from finance.services.validation import parse_amount, validate
+
+
+def invoice(**fields):
+    data = {
+        "Invoice_No": "INV-1", "Invoice_Date": "01/02/2025",
+        "Subtotal": "200.000", "VAT_Percentage": "5%", "Total": "210.000",
+        "Items": [
+            {"Item_Description": "Cement", "Quantity": "2", "Unit_Price": "50.000", "Amount": "100.000"},
+            {"Item_Description": "Sand", "Quantity": "4", "Unit_Price": "25", "Amount": "100"},
+        ],
+    }
+    data.update(fields)
+    return data
+
+
+class ParseAmountTests(SimpleTestCase):
+    def test_formats(self):
+        cases = {
+            '1.234,50': Decimal('1234.50'),
+            '(12.00)': Decimal('-12.00'),
+            'OMR 1,234.500': Decimal('1234.500'),
+            '1,234': Decimal('1234'),
+            '12,50': Decimal('12.50'),
+            '1.234.567': Decimal('1234567'),
+            '5%': Decimal('5'),
+            '-3.5': Decimal('-3.5'),
+            12: Decimal('12'),
+            0.1: Decimal('0.1'),
+        }
+        for value, expected in cases.items():
+            self.assertEqual(parse_amount(value), (expected, 'ok'), value)
+
+    def test_missing_and_unparsed(self):
+        self.assertEqual(parse_amount(None), (None, 'missing'))
+        self.assertEqual(parse_amount(''), (None, 'missing'))
+        self.assertEqual(parse_amount('N/A'), (None, 'unparsed'))
+        self.assertEqual(parse_amount(True), (None, 'unparsed'))
+
+
+class ValidateTests(SimpleTestCase):
+    def test_consistent_invoice(self):
+        report = validate(invoice())
+        self.assertTrue(report['valid'])
+        self.assertEqual(report['problems'], [])
+        self.assertEqual(report['confidence'], 1.0)
+        self.assertEqual(report['items_sum'], '200.000')
+
+    def test_vat_inferred_when_missing(self):
+        report = validate(invoice(VAT_Percentage=""))
+        self.assertTrue(report['valid'])
+        self.assertEqual(report['inferred_vat'], '5')
+        self.assertEqual(report['fields']['VAT_Percentage']['status'], 'missing')
+
+        report = validate(invoice(VAT_Percentage=None, Total="200.000"))
+        self.assertTrue(report['valid'])
+        self.assertEqual(report['inferred_vat'], '0')
+
+    def test_mismatches(self):
+        items = invoice()["Items"]
+        report = validate(invoice(Total="300", Items=[dict(items[0], Amount="90"), items[1]]))
+        self.assertFalse(report['valid'])
+        self.assertEqual(report['problems'], [
+            "Item 'Cement' quantity x price != amount",
+            "Item amounts do not add up to Subtotal",
+            "Subtotal x VAT does not match Total",
+        ])
+        self.assertEqual([f['status'] for f in report['items']], ['mismatch', 'ok'])
+        self.assertEqual(report['fields']['Total']['status'], 'mismatch')
+
+    def test_missing_required_fields(self):
+        self.assertEqual(validation.validate_extraction({"Total": "1"}), ["Missing Invoice_No", "Missing Invoice_Date"])
+        self.assertEqual(validation.validate_extraction([]), ["Extraction is not a JSON object"])
+
+    def test_decimal_engine(self):
+        with mock.patch.object(validation, 'np', None):
+            report = validate(invoice(Items=invoice()["Items"] + [{"Quantity": "1", "Unit_Price": "9", "Amount": "1"}]))
+        self.assertEqual(report['engine'], 'decimal')
+        self.assertEqual([f['status'] for f in report['items']], ['ok', 'ok', 'mismatch'])
+
+    def test_numpy_and_decimal_engines_agree(self):
+        if validation.np is None:
+            self.skipTest("NumPy is not installed")
+        rng = random.Random(3)
+        items = [
+            {"Quantity": str(q), "Unit_Price": f"{p:.3f}", "Amount": f"{q * p * rng.choice([1, 1, 1.1]):.3f}"}
+            for q, p in ((rng.randint(1, 50), rng.uniform(0.1, 99)) for _ in range(200))
+        ]
+        items.append({"Quantity": "", "Unit_Price": "1", "Amount": "1"})
+        data = invoice(Items=items)
+        with_numpy = validate(data)
+        with mock.patch.object(validation, 'np', None):
+            with_decimal = validate(data)
+        self.assertEqual(with_numpy['engine'], 'numpy')
+        self.assertEqual(with_numpy['items'], with_decimal['items'])
+        self.assertEqual(with_numpy['problems'], with_decimal['problems'])
+
+
+class RepairJsonTests(SimpleTestCase):
+    def test_clean_output_needs_no_repairs(self):
+        data = {"Invoice_No": "INV-1", "Total": "10.500", "Items": [{"Amount": 1.5}], "Paid": False}
+        self.assertEqual(repair_json(json.dumps(data)), (data, []))
+
+    def test_defects(self):
+        text = '```json\n{"Invoice\\_No": "A\\_1", "Path": "C:\\Users", "Items": [1, 2,],}\n```'
+        value, repairs = repair_json(text)
+        self.assertEqual(value, {"Invoice_No": "A_1", "Path": "C:\\Users", "Items": [1, 2]})
+        self.assertEqual(set(repairs), {'fence', 'escaped_underscore', 'invalid_escape', 'trailing_comma'})
+
+    def test_missing_comma_and_backslashed_key(self):
+        value, repairs = repair_json('{"Invoice\\\\_No": "1" "Total": "2"}')
+        self.assertEqual(value, {"Invoice_No": "1", "Total": "2"})
+        self.assertIn('missing_comma', repairs)
+        self.assertIn('backslashed_key', repairs)
+
+    def test_valid_escapes_are_kept(self):
+        value, repairs = repair_json('{"a": "x\\\\_y \\u00e9 \\n", "b": "\\_"}')
+        self.assertEqual(value, {"a": "x\\_y \u00e9 \n", "b": "_"})
+        self.assertEqual(repairs, ['escaped_underscore'])
+
+    def test_truncated_output_keeps_complete_members(self):
+        value, repairs = repair_json('{"Invoice_No": "1", "Items": [{"Amount": "1"}, {"Amount": "2"}, {"Amou')
+        self.assertEqual(value, {"Invoice_No": "1", "Items": [{"Amount": "1"}, {"Amount": "2"}]})
+        self.assertEqual(repairs, ['truncated'])
+        self.assertEqual(repair_json('{"Invoice_No": "1'), ({}, ['truncated']))
+
+    def test_no_json(self):
+        with self.assertRaises(json.JSONDecodeError):
+            repair_json("The invoice could not be read.")
+        with self.assertRaises(json.JSONDecodeError):
+            repair_json('{"Total": }')
+
+    def test_fuzz_defects(self):
+        rng = random.Random(7)
+        for _ in range(100):
+            doc = synthetic_invoice(rng, rng.randint(0, 15))
+            for label, text, expected in defects(rng, doc):
+                value, repairs = repair_json(text)
+                if expected is not None:
+                    self.assertEqual(value, expected, label)
+                    if label == 'clean':
+                        self.assertEqual(repairs, [])
+                    continue
+                # Truncated: complete items are kept in order, nothing is invented
+                items = value.get('Items', [])
+                self.assertEqual(items, doc['Items'][:len(items)], label)
+                self.assertTrue(all(value[k] == doc[k] for k in value if k != 'Items'), label)
+
+    def test_fuzz_prefixes_and_corruptions_only_raise_decode_errors(self):
+        rng = random.Random(11)
+        alphabet = '{}[]",:\\ntu0_ `'
+        for _ in range(40):
+            text = json.dumps(synthetic_invoice(rng, rng.randint(0, 10)))
+            for _ in range(25):
+                mutated = list(text[:rng.randint(0, len(text))])
+                for _ in range(rng.randint(0, 3)):
+                    if mutated:
+                        mutated[rng.randrange(len(mutated))] = rng.choice(alphabet)
+                try:
+                    repair_json(''.join(mutated))
+                except json.JSONDecodeError:
+                    pass
+
+
+class MergeItemsTests(SimpleTestCase):
+    def item(self, n):
+        return {"Item_Description": f"Item {n}", "Quantity": "1", "Amount": f"{n}.000"}
+
+    def test_overlap_is_dropped(self):
+        chunks = [[self.item(1), self.item(2), self.item(3)], [self.item(2), self.item(3), self.item(4)]]
+        self.assertEqual(merge_items(chunks), [self.item(n) for n in (1, 2, 3, 4)])
+
+    def test_repeated_lines_elsewhere_are_kept(self):
+        chunks = [[self.item(1), self.item(2)], [self.item(3), self.item(1)]]
+        self.assertEqual(merge_items(chunks), [self.item(n) for n in (1, 2, 3, 1)])
+
+    def test_empty_and_malformed_items(self):
+        chunks = [None, [self.item(1), "text", {"Amount": " "}], []]
+        self.assertEqual(merge_items(chunks), [self.item(1)])
+
+
+class PrefixMatcherTests(SimpleTestCase):
+    def test_agrees_with_legacy_loop(self):
+        rng = random.Random(5)
+        for _ in range(100):
+            text = synthetic_text(rng, 2000)
+            old, new = legacy_find(text), po_matcher.best(text)
+            if old != new:
+                # Equal-length prefixes were tried in set order by the loop
+                self.assertIn(old, {h.po for h in po_matcher.ranked(text)})
+
+    def test_ocr_zero_and_dash(self):
+        matcher = PrefixMatcher(["ATCPO", "ATCP"], {"ATCP": "ATCPO"})
+        self.assertEqual(matcher.best("ref atcp025080595 x"), "ATCPO25080595")
+        self.assertEqual(matcher.best("PO: ATCPO-25080595"), "ATCPO25080595")
+        self.assertIsNone(matcher.best("no purchase order here"))
+
+    def test_longest_prefix_wins(self):
+        matcher = PrefixMatcher(["KAYPO", "KAYAPO"], {})
+        self.assertEqual(matcher.best("KAYPO111 then KAYAPO222"), "KAYAPO222")
+
+
+class CandidateScannerTests(SimpleTestCase):
+    scanner = CandidateScanner(PrefixMatcher(["ATCPO", "ATCP"], {"ATCP": "ATCPO"}))
+
+    def test_kinds(self):
+        found = self.scanner.scan("VAT OM 1100 020467, PO ATCP025080595, ref 25080596, date 20251399", 'ocr')
+        self.assertEqual([c.kind for c in found], [VAT, PO_PREFIXED, PO_DIGITS])
+        self.assertEqual([c.value for c in found], ["OM1100020467", "ATCPO25080595", "25080596"])
+        self.assertLess(found[1].confidence, 0.9)  # Recovered from an O/0 misread
+
+    def test_scan_json(self):
+        data = {"PO_Number": 25080595, "Paid": True, "Items": [{"Item_Description": "ATCPO25080001 cement"}]}
+        found = self.scanner.scan_json(data)
+        self.assertEqual([(c.kind, c.field) for c in found], [(PO_DIGITS, "PO_Number"), (PO_PREFIXED, "Items")])
+        self.assertEqual(best_prefixed(found).value, "ATCPO25080001")
+        self.assertEqual(of_kind(found, VAT), [])
+
+
+class TrnIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.rows = [("OM1100020467", "ATCPO")]
+        self.loads = 0
+        self.now = 1000.0
+
+    def loader(self):
+        self.loads += 1
+        return list(self.rows)
+
+    def lookup(self, index, trn):
+        with mock.patch('finance.services.trn_index.time.time', return_value=self.now):
+            result = index.lookup(trn)
+            if index._reloader is not None:
+                index._reloader.join()
+            return result
+
+    def test_hit_and_normalization(self):
+        index = TrnIndex(self.loader, negative_ttl=300)
+        self.assertEqual(self.lookup(index, "OM1100020467"), (None, False))  # Not loaded yet
+        with mock.patch('finance.services.trn_index.time.time', return_value=self.now):
+            index.refresh()
+        self.assertEqual(self.lookup(index, "om 1100 020467"), ("ATCPO", True))
+
+    def test_negative_ttl(self):
+        index = TrnIndex(self.loader, negative_ttl=300)
+        with mock.patch('finance.services.trn_index.time.time', return_value=self.now):
+            index.refresh()
+        self.assertEqual(self.lookup(index, "OM9999999999"), (None, True))
+        self.assertEqual(self.loads, 1)  # Index is fresh: no reload for an unknown TRN
+
+        # Added in Axpert; still answered from the negative cache within the TTL
+        self.rows.append(("OM9999999999", "NEWPO"))
+        self.now += 100
+        self.assertEqual(self.lookup(index, "OM9999999999"), (None, True))
+        self.assertEqual(index.status()['negative_hits'], 1)
+
+        # After the TTL the miss is answered at once and the stale index reloads in the background
+        self.now += 300
+        self.assertEqual(self.lookup(index, "OM9999999999"), (None, True))
+        self.assertEqual(self.loads, 2)
+        self.assertEqual(self.lookup(index, "OM9999999999"), ("NEWPO", True))
+
+    def test_reload_does_not_block_lookups(self):
+        index = TrnIndex(self.loader, negative_ttl=300)
+        with mock.patch('finance.services.trn_index.time.time', return_value=self.now):
+            index.refresh()
+        release = threading.Event()
+        index.loader = lambda: release.wait(5) and self.rows
+        self.now += 400
+        with mock.patch('finance.services.trn_index.time.time', return_value=self.now):
+            self.assertEqual(index.lookup("OM9999999999"), (None, True))
+            self.assertEqual(index.lookup("OM8888888888"), (None, True))  # One reload at a time
+            release.set()
+            index._reloader.join()
+        self.assertEqual(index.status()['reloads'], 2)
+
+
+class AdaptiveLimiterTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 0.0
+        patcher = mock.patch('finance.services.concurrency.time.time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def calls(self, limiter, latency, count=None, parallel=1):
+        """Run `count` calls in batches of `parallel` overlapping calls taking `latency` seconds."""
+        for _ in range((count or limiter.window) // parallel):
+            with contextlib.ExitStack() as stack:
+                for _ in range(parallel):
+                    stack.enter_context(limiter.slot())
+                self.now += latency
+
+    def time_out(self, limiter, parallel=1):
+        """`parallel` overlapping calls that all time out."""
+        slots = [limiter.slot() for _ in range(parallel)]
+        for slot in slots:
+            slot.__enter__()
+        for slot in slots:
+            timeout = requests.exceptions.Timeout()
+            self.assertFalse(slot.__exit__(type(timeout), timeout, None))  # Re-raised, not swallowed
+
+    def test_increase_after_fast_saturated_window(self):
+        limiter = AdaptiveLimiter(initial=2, maximum=4, window=10)
+        self.calls(limiter, 1.0, parallel=2)   # Sets the baseline
+        self.calls(limiter, 1.0, parallel=2)
+        self.assertEqual(limiter.limit, 3)
+        self.calls(limiter, 1.0, count=12, parallel=3)
+        self.assertEqual(limiter.limit, 4)
+        self.assertEqual(limiter.status()['increases'], 2)
+
+    def test_no_increase_when_not_saturated(self):
+        limiter = AdaptiveLimiter(initial=2, maximum=4, window=10)
+        self.calls(limiter, 1.0, count=30)
+        self.assertEqual(limiter.limit, 2)
+
+    def test_decrease_on_p95_latency(self):
+        limiter = AdaptiveLimiter(initial=8, maximum=8, window=10, tolerance=1.5, backoff=0.75)
+        self.calls(limiter, 1.0)
+        self.calls(limiter, 2.0)
+        self.assertEqual(limiter.limit, 6)
+        self.assertEqual(limiter.status()['p95'], 2.0)
+
+    def test_concurrent_timeouts_cut_once(self):
+        limiter = AdaptiveLimiter(initial=8, maximum=8, window=20)
+        self.time_out(limiter, parallel=4)
+        self.assertEqual(limiter.limit, 4)
+        self.assertEqual(limiter.status()['timeouts'], 4)
+
+    def test_sustained_timeouts_keep_cutting(self):
+        limiter = AdaptiveLimiter(initial=8, maximum=8, window=20)
+        for expected in (4, 2, 1, 1):
+            self.time_out(limiter)
+            self.assertEqual(limiter.limit, expected)
+        self.assertEqual(limiter.status()['decreases'], 3)
+
+    def test_window_counts_timeouts(self):
+        limiter = AdaptiveLimiter(initial=2, maximum=4, window=4)
+        self.calls(limiter, 1.0, count=4, parallel=2)   # Baseline
+        self.time_out(limiter)
+        self.assertEqual(limiter.limit, 1)
+        self.calls(limiter, 1.0, count=3)               # Closes the window with the cut: no increase
+        self.assertEqual(limiter.limit, 1)
+        self.calls(limiter, 1.0, count=4)               # Saturated at 1 and fast again
+        self.assertEqual(limiter.limit, 2)
+
+
+def layout_page(lines):
+    """OCR page of `lines`, one 12px-wide character per column and 30px per line."""
+    words = []
+    for row, line in enumerate(lines):
+        column = 0
+        for token in line.split(" "):
+            if token:
+                left, top = 100 + column * 12, 100 + row * 30
+                words.append(Word(token, left, top, left + len(token) * 12, top + 20, (1, 1, row)))
+            column += len(token) + 1
+    return Page(1000, 1400, words)
+
+
+def invoice_page(no, date, po="25080595", vendor="Acme Trading LLC"):
+    return layout_page([
+        vendor, "Muscat Sultanate of Oman", "TAX INVOICE",
+        f"Invoice No: {no}", f"Invoice Date: {date}", f"Purchase Order: {po}",
+        "Customer: Atlas Contracting", "Description Quantity Price Amount",
+        "1 Cement bags 2 50.000 100.000", "Grand Total: 100.000", "Thank you for your business",
+    ])
+
+
+class LayoutTemplateTests(SimpleTestCase):
+    fields = ["Invoice_No", "Invoice_Date", "PO_Number", "Vendor_Name", "Total", "Items"]
+    accepted = {
+        "Invoice_No": "INV-1001", "Invoice_Date": "01/02/2025", "PO_Number": "25080595",
+        "Vendor_Name": "Acme Trading LLC", "Total": "100.000", "Items": [{"Amount": "100.000"}],
+    }
+
+    def learn(self, data):
+        page = invoice_page("INV-1001", "01/02/2025")
+        return layout_templates.learn([page], page_text(page), data, self.fields)
+
+    def extract(self, rules, page):
+        return layout_templates.extract(rules, [page], page_text(page), self.fields)
+
+    def test_learn_and_extract(self):
+        rules = self.learn(self.accepted)
+        self.assertEqual(set(rules['fields']), {"Invoice_No", "Invoice_Date", "PO_Number", "Total"})
+        self.assertEqual(rules['constants'], {"Vendor_Name": "Acme Trading LLC"})
+        self.assertTrue(rules['items'])
+
+        data, problems = self.extract(rules, invoice_page("INV-1002", "03/02/2025", po="25080600"))
+        self.assertEqual(problems, [])
+        self.assertEqual(
+            [data[f] for f in ("Invoice_No", "Invoice_Date", "PO_Number", "Vendor_Name", "Total")],
+            ["INV-1002", "03/02/2025", "25080600", "Acme Trading LLC", "100.000"],
+        )
+        self.assertEqual(data["Items"][0]["Item_Description"], "Cement bags")
+
+    def test_constant_must_be_printed(self):
+        rules = self.learn(self.accepted)
+        data, problems = self.extract(rules, invoice_page("INV-1002", "03/02/2025", vendor="Other Trading"))
+        self.assertEqual(data["Vendor_Name"], "")
+        self.assertEqual(problems, ["Vendor_Name: 'Acme Trading LLC' not found on this document"])
+
+    def test_missing_label_falls_back(self):
+        rules = self.learn(self.accepted)
+        page = layout_page(["Acme Trading LLC", "Invoice Date: 03/02/2025", "Grand Total: 100.000"])
+        self.assertIn("Invoice_No: no value at 'INVOICE NO'", self.extract(rules, page)[1])
+
+    def test_learns_printed_values_not_axpert_overwrites(self):
+        page = invoice_page("INV-1001", "01/02/2025")
+        extracted = dict(
+            self.accepted, Vendor_Name="ACME TRADING & CONTRACTING", PO_Number="ATCPO25080595",
+            model_values={"Vendor_Name": "Acme Trading LLC", "Customer_Name": "", "PO_Number": "25080595"},
+        )
+        template = VendorTemplate(vendor_key="x")
+        with mock.patch.object(ollama_service, 'ocr_with_layout', return_value=(page_text(page), [page])), \
+                mock.patch.object(VendorTemplate, 'objects') as objects, \
+                mock.patch.object(VendorTemplate, 'save'):
+            objects.get_or_create.return_value = (template, True)
+            self.assertIs(ollama_service.learn_layout_template("invoice.pdf", extracted), template)
+        objects.get_or_create.assert_called_once_with(vendor_key="ACME TRADING LLC")
+        self.assertEqual(template.rules['constants']["Vendor_Name"], "Acme Trading LLC")
+        self.assertIn("PO_Number", template.rules['fields'])
+        self.assertEqual(template.vendor_name, "Acme Trading LLC")
+
+
+class BackgroundWorkerTests(SimpleTestCase):
+    def ready(self, argv):
+        with mock.patch.object(ollama_service.model_warmer, 'start') as warmer, \
+                mock.patch.object(ollama_service.trn_index, 'start') as index, \
+                mock.patch('sys.argv', argv):
+            apps.get_app_config('finance').ready()
+        return warmer.called, index.called
+
+    @override_settings(FINANCE_BACKGROUND_WORKERS=False, OLLAMA_WARMUP_ON_STARTUP=True, TRN_INDEX_PRELOAD=True)
+    def test_not_started_unless_enabled(self):
+        self.assertEqual(self.ready(['gunicorn']), (False, False))
+        self.assertEqual(self.ready(['script.py']), (False, False))
+
+    @override_settings(FINANCE_BACKGROUND_WORKERS=True, OLLAMA_WARMUP_ON_STARTUP=True, TRN_INDEX_PRELOAD=True)
+    def test_started_in_enabled_workers(self):
+        self.assertEqual(self.ready(['gunicorn']), (True, True))
+        self.assertEqual(self.ready(['manage.py', 'migrate']), (False, False))
+
+
+def ocr_pdf(*pages):
+    """OCR text as extract_text_via_ocr returns it: every page followed by a form feed."""
+    return "".join(page + "\n\f" for page in pages)
+
+
+class SplitMultiInvoiceTests(SimpleTestCase):
+    first = "ACME TRADING\nTAX INVOICE\nInvoice No: INV-1001\nPage 1 of 2\nCement 2 50.000 100.000"
+    second = "ACME TRADING\nTAX INVOICE\nInvoice No: INV-1002\nPage 1 of 1\nSand 4 25.000 100.000"
+
+    def split(self, layer, ocr_text=None):
+        with mock.patch.object(ollama_service, 'read_pdf_pages', return_value=layer), \
+                mock.patch.object(ollama_service, 'extract_text_via_ocr', return_value=ocr_text) as ocr:
+            segments, text = ollama_service.split_multi_invoice("scan.pdf")
+        return segments, text, ocr.called
+
+    def test_text_layer(self):
+        segments, text, ocr_ran = self.split([self.first, "continued " * 20, self.second])
+        self.assertEqual([(s['pages'], s['invoice_no']) for s in segments], [([0, 1], "INV-1001"), ([2], "INV-1002")])
+        self.assertIsNone(text)
+        self.assertFalse(ocr_ran)
+
+    def test_ocr_keeps_blank_pages_aligned(self):
+        ocr_text = ocr_pdf("", self.first, "", self.second)
+        segments, text, ocr_ran = self.split(["", "", "", ""], ocr_text)
+        self.assertTrue(ocr_ran)
+        self.assertEqual(text, ocr_text)
+        self.assertEqual([(s['pages'], s['invoice_no']) for s in segments], [([1, 2], "INV-1001"), ([3], "INV-1002")])
+        self.assertIn("INV-1002", segments[1]['text'])
+
+    def test_single_invoice_is_not_split(self):
+        self.assertEqual(self.split([self.first, "continued " * 20])[:2], ([], None))
+        self.assertEqual(self.split(["", ""], ocr_pdf(self.first, ""))[0], [])
+        self.assertEqual(ollama_service.split_multi_invoice("scan.png"), ([], None))
+
+    def test_segments_are_extracted_with_their_pages(self):
+        segments = [
+            {'pages': [0, 1], 'invoice_no': "INV-1001", 'text': self.first},
+            {'pages': [2], 'invoice_no': "INV-1002", 'text': self.second},
+        ]
+        result = {'success': True, 'data': {"Invoice_No": "X"}, 'model': "m", 'routing': {}}
+        with mock.patch.object(ollama_service, 'extract_with_routing', return_value=result) as routed, \
+                mock.patch.object(ollama_service, 'extract_po_number', return_value=""):
+            entries = ollama_service.extract_split_invoices(segments, "scan.pdf", use_cache=False)
+        self.assertEqual([e['pages'] for e in entries], [[1, 2], [3]])
+        self.assertTrue(all(e['success'] for e in entries))
+        routed.assert_any_call(self.second, "scan.pdf", False, pages=[2])
+
+    def test_inward_documents_reuse_ocr_text(self):
+        with mock.patch.object(ollama_service, 'extract_document', return_value=({'success': True}, "")) as extract:
+            ollama_service.extract_inward_documents({'invoice': "a.pdf", 'po': "b.pdf"}, True, {'invoice': "OCR"})
+        extract.assert_any_call("a.pdf", True, "OCR")
+        extract.assert_any_call("b.pdf", True, None)
+
+
+class ReconcileInwardTests(SimpleTestCase):
+    def reconcile(self, invoice_total, po_total, invoiced, delivered, po_numbers=("ATCPO1", "ATCPO1")):
+        items = lambda lines: [{"Item_Description": d, "Quantity": q} for d, q in lines]
+        return ollama_service.reconcile_inward_documents({
+            'invoice': {'data': {"Total": invoice_total, "Items": items(invoiced)}, 'po_number': po_numbers[0]},
+            'purchase_order': {'data': {"Total": po_total}, 'po_number': po_numbers[1]},
+            'delivery_order': {'data': {"Items": items(delivered)}, 'po_number': ""},
+        })
+
+    def test_matched(self):
+        result = self.reconcile(
+            "OMR 1.234,50", "1,234.500",
+            [("Cement Bags", "2"), ("Sand", "1,5")], [("cement bags", "1"), ("CEMENT-BAGS", "1"), ("Sand", "1.5")],
+        )
+        self.assertEqual(result['checks']['total'], {
+            'status': 'match', 'invoice': '1234.50', 'purchase_order': '1234.500', 'difference': '0.000',
+        })
+        self.assertEqual([line['delivered'] for line in result['checks']['items']['lines']], ['2', '1.5'])
+        self.assertEqual(result['status'], 'matched')
+        json.dumps(result)  # Stored on the task as JSON
+
+    def test_mismatches(self):
+        result = self.reconcile(
+            "1,300.000", "1,234.500", [("Cement", "5")], [("Cement", "3")], po_numbers=("ATCPO1", "ATCPO2"),
+        )
+        self.assertEqual(result['checks']['total']['difference'], '65.500')
+        self.assertEqual(
+            {name: check['status'] for name, check in result['checks'].items()},
+            {'po_number': 'mismatch', 'total': 'mismatch', 'items': 'mismatch'},
+        )
+        self.assertEqual(result['status'], 'mismatch')
+
+    def test_unreadable_amounts_are_missing(self):
+        result = self.reconcile("N/A", "100", [("Cement", "")], [])
+        self.assertEqual(result['checks']['total']['status'], 'missing')
+        self.assertEqual(result['checks']['items']['lines'][0]['status'], 'missing')
+
+
+def refused():
+    return requests.exceptions.ConnectionError(MaxRetryError(None, "/api/generate", reason=NewConnectionError(None, "refused")))
+
+
+def http_response(status):
+    response = requests.Response()
+    response.status_code = status
+    response.raw = io.BytesIO()
+    return response
+
+
+class BackendClientTests(SimpleTestCase):
+    url = "http://ollama:11434/api/generate"
+
+    def setUp(self):
+        self.client = BackendClient(max_retries=2, backoff_base=0.5, backoff_max=8.0)
+        self.session = self.client._session("http://ollama:11434")
+        patcher = mock.patch('finance.services.http_client.time.sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def send(self, *outcomes, **kwargs):
+        with mock.patch.object(self.session, 'request', side_effect=list(outcomes)) as request:
+            try:
+                return self.client.post(self.url, **kwargs).status_code, request.call_count
+            except requests.exceptions.RequestException as exc:
+                return exc.__class__.__name__, request.call_count
+
+    def test_connection_refused_is_always_retried(self):
+        self.assertEqual(self.send(refused(), refused(), http_response(200), idempotent=False, retry_timeouts=False), (200, 3))
+        self.assertEqual(self.send(refused(), refused(), refused(), idempotent=False), ('ConnectionError', 3))
+
+    def test_timeouts_of_generate_calls_are_not_retried(self):
+        timeout = requests.exceptions.ReadTimeout()
+        self.assertEqual(self.send(timeout, http_response(200), retry_timeouts=False), ('ReadTimeout', 1))
+        self.assertEqual(self.send(timeout, http_response(200)), (200, 2))
+        self.assertEqual(self.send(timeout, http_response(200), idempotent=False), ('ReadTimeout', 1))
+
+    def test_retried_statuses(self):
+        self.assertEqual(self.send(http_response(503), http_response(200), retry_timeouts=False), (200, 2))
+        self.assertEqual(self.send(http_response(504), http_response(200), retry_timeouts=False), (504, 1))
+        self.assertEqual(self.send(http_response(504), http_response(200)), (200, 2))
+        self.assertEqual(self.send(http_response(503), idempotent=False), (503, 1))
+        self.assertEqual(self.send(*[http_response(502)] * 3), (502, 3))
+
+    def test_full_jitter_backoff(self):
+        with mock.patch('finance.services.http_client.random.uniform', side_effect=lambda low, high: high):
+            self.send(refused(), refused(), http_response(200))
+            self.assertEqual([c.args[0] for c in self.sleep.call_args_list], [0.5, 1.0])
+            self.assertEqual(self.client._backoff(10), 8.0)
+
+    def test_files_are_rewound_before_a_retry(self):
+        upload = mock.Mock()
+        self.send(refused(), http_response(200), files={'file': ("inv.pdf", upload)})
+        upload.seek.assert_called_with(0)
+
+    def test_metrics(self):
+        self.send(refused(), http_response(200))
+        self.send(requests.exceptions.ReadTimeout(), retry_timeouts=False)
+        metrics = self.client.metrics()["http://ollama:11434"]
+        self.assertEqual(
+            {k: metrics[k] for k in ('calls', 'attempts', 'retries', 'failures', 'statuses')},
+            {'calls': 2, 'attempts': 3, 'retries': 1, 'failures': 1, 'statuses': {200: 1}},
+        )
+
+    def test_metrics_in_model_status(self):
+        from finance import views
+        request = RequestFactory().get('/finance/extraction/model-status/')
+        request.user = mock.Mock(is_authenticated=True, user_type='finance')
+        with mock.patch.object(views.http_client, 'metrics', return_value={"http://ollama:11434": {'calls': 1}}), \
+                mock.patch.object(views.model_warmer, 'status', return_value={}), \
+                mock.patch.object(views, 'layout_template_status', return_value={}):
+            response = views.model_status(request)
+        self.assertEqual(json.loads(response.content)['http'], {"http://ollama:11434": {'calls': 1}})
+
+
+class FakeExtractionTests(SimpleTestCase):
+    fields = ["Invoice_No", "Invoice_Date", "PO_Number", "Total", "Items"]
+
+    def test_invoice_number_needs_a_label(self):
+        for text in (
+            "TAX INVOICE\nInvoice No: INV-1001",
+            "Invoice No.: INV-1001",
+            "INVOICE NUMBER INV-1001",
+            "Invoice # INV-1001",
+        ):
+            self.assertEqual(fake_extraction(text, self.fields)["Invoice_No"], "INV-1001", text)
+        self.assertEqual(fake_extraction("TAX INVOICE\nNotes: none", self.fields)["Invoice_No"], "")
+
+    def test_fields_and_items(self):
+        text = "Invoice No: INV-7\nDate: 01/02/2025\nPO ATCPO25080595\n1 Cement bags 2 50.00 100.00\nGrand Total: 105.00"
+        data = fake_extraction(text, self.fields)
+        self.assertEqual(
+            [data[f] for f in ("Invoice_No", "Invoice_Date", "PO_Number", "Total")],
+            ["INV-7", "01/02/2025", "ATCPO25080595", "105.00"],
+        )
+        self.assertEqual(data["Items"][0]["Amount"], "100.00")
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('finance.services.circuit_breaker.time.time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker('n8n', window=4, min_calls=4, failure_rate=0.5, slow_call_seconds=60, open_seconds=120)
+
+    def calls(self, *outcomes):
+        for success, latency in outcomes:
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record(success, latency)
+
+    def test_opens_on_failure_rate_after_min_calls(self):
+        self.calls((False, 1), (False, 1), (True, 1))
+        self.assertEqual(self.breaker.state, CLOSED)  # Fewer than min_calls
+        self.calls((True, 1))
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.status()['rejected'], 1)
+
+    def test_slow_calls_count_as_failures(self):
+        self.calls((True, 1), (True, 61), (True, 1), (True, 90))
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_window_forgets_old_failures(self):
+        self.calls((False, 1), (True, 1), (True, 1), (True, 1), (True, 1), (True, 1))
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertEqual(self.breaker.status()['recent_failures'], 0)
+
+    def test_single_probe_after_cool_down(self):
+        self.calls(*[(False, 1)] * 4)
+        self.now += 119
+        self.assertFalse(self.breaker.allow())
+        self.now += 1
+        self.assertTrue(self.breaker.allow())       # The probe
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertFalse(self.breaker.allow())      # Only one at a time
+        self.breaker.record(True, 1)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertEqual(self.breaker.status()['recent_calls'], 0)
+
+    def test_failed_probe_reopens(self):
+        self.calls(*[(False, 1)] * 4)
+        self.now += 120
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record(True, 75)               # Slow probe
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.breaker.opened_at, self.now)
+        self.assertFalse(self.breaker.allow())
+
+    def test_open_circuit_skips_the_webhook(self):
+        self.calls(*[(False, 1)] * 4)
+        with mock.patch.object(ollama_service, 'n8n_breaker', self.breaker), \
+                mock.patch.object(ollama_service, 'N8N_WEBHOOK_URL', "http://n8n/webhook"), \
+                mock.patch.object(ollama_service, '_call_n8n') as call:
+            result = ollama_service.extract_invoice_via_n8n("inv.pdf")
+        self.assertTrue(result['circuit_open'])
+        self.assertFalse(result['success'])
+        call.assert_not_called()
+
+
+class HedgeTests(SimpleTestCase):
+    text = "Invoice No: INV-1 " * 10
+
+    def setUp(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.executor.shutdown)
+        self.ocr = concurrent.futures.Future()
+        self.ocr.set_result(self.text)
+        self.n8n = concurrent.futures.Future()
+        for target, value in (
+            ('fallback_text', lambda ocr_text, file_path: ocr_text),
+            ('_hedge_slots', threading.BoundedSemaphore(1)),
+        ):
+            patcher = mock.patch.object(ollama_service, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(ollama_service.n8n_latency, 'percentile', return_value=0.05)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def finish_n8n(self, result, after=0.0):
+        timer = threading.Timer(after, self.n8n.set_result, args=(result,))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+    def hedge(self, direct):
+        with mock.patch.object(ollama_service, 'extract_with_routing', side_effect=direct) as routed:
+            result, text = ollama_service.hedge_n8n(self.executor, self.n8n, self.ocr, "inv.pdf")
+        return result, routed.called
+
+    def test_fast_n8n_is_not_hedged(self):
+        self.finish_n8n({'success': True, 'method': 'n8n'})
+        result, hedged = self.hedge(lambda *args: self.fail("no hedge expected"))
+        self.assertEqual(result, {'success': True, 'method': 'n8n'})
+        self.assertFalse(hedged)
+
+    def test_direct_ollama_wins(self):
+        self.finish_n8n({'success': True, 'method': 'n8n'}, after=1.0)
+        result, hedged = self.hedge(lambda *args: {'success': True, 'method': 'ollama'})
+        self.assertTrue(hedged)
+        self.assertEqual(result['method'], 'ollama')
+        self.assertEqual(result['hedge']['winner'], 'ollama_direct')
+
+    def test_n8n_wins_and_cancels_direct(self):
+        release = threading.Event()
+        seen = {}
+
+        def direct(*args):
+            self.finish_n8n({'success': True, 'method': 'n8n'})
+            release.wait(2)
+            seen['cancelled'] = cancelled()
+            return {'success': False}
+
+        result, hedged = self.hedge(direct)
+        self.assertEqual(result['hedge']['winner'], 'n8n')
+        release.set()
+        self.executor.shutdown(wait=True)
+        self.assertTrue(seen['cancelled'])
+
+    def test_failed_direct_waits_for_n8n(self):
+        self.finish_n8n({'success': True, 'method': 'n8n'}, after=0.2)
+        result, _ = self.hedge(lambda *args: {'success': False, 'error': 'bad JSON'})
+        self.assertEqual(result['hedge']['winner'], 'n8n')
+
+    def test_both_fail_returns_direct_result(self):
+        self.finish_n8n({'success': False, 'error': 'n8n down'}, after=0.1)
+        result, _ = self.hedge(lambda *args: {'success': False, 'error': 'bad JSON'})
+        self.assertEqual(result['error'], 'bad JSON')
+        self.assertIsNone(result['hedge']['winner'])
+
+    def test_hedge_cap(self):
+        ollama_service._hedge_slots.acquire()
+        self.finish_n8n({'success': True, 'method': 'n8n'}, after=0.1)
+        result, hedged = self.hedge(lambda *args: {'success': True})
+        self.assertFalse(hedged)
+        self.assertEqual(result['method'], 'n8n')
+
+
+def json_response(status, payload):
+    response = http_response(status)
+    response._content = json.dumps(payload).encode()
+    return response
+
+
+class OllamaPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('finance.services.ollama_pool.time.time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = OllamaPool(["http://a", "http://b", "http://c"], health_interval=0, eject_after=3, eject_seconds=30)
+        self.a, self.b, self.c = self.pool.endpoints
+
+    def fail_lease(self, endpoint, error=None):
+        with mock.patch.object(self.pool, 'choose', return_value=endpoint):
+            with self.assertRaises(requests.exceptions.RequestException):
+                with self.pool.lease("llama3.2"):
+                    raise error or requests.exceptions.ConnectionError("refused")
+
+    def test_least_outstanding_first_then_loaded_model(self):
+        self.a.loaded_models = {"llama3.2:latest"}
+        self.a.outstanding, self.b.outstanding, self.c.outstanding = 1, 0, 2
+        self.assertIs(self.pool.choose("llama3.2"), self.b)
+        self.b.outstanding = 1
+        self.assertIs(self.pool.choose("llama3.2"), self.a)
+
+    def test_hosts_without_the_model_and_excluded_hosts_are_skipped(self):
+        self.a.available_models = {"llama3.1:8b"}
+        self.b.available_models = {"llama3.2:latest"}
+        self.b.outstanding = 5
+        self.assertIs(self.pool.choose("llama3.2", exclude=("http://c",)), self.b)
+
+    def test_lease_counts_outstanding_and_marks_model_loaded(self):
+        with self.pool.lease("llama3.2") as url:
+            endpoint = next(e for e in self.pool.endpoints if e.url == url)
+            self.assertEqual(endpoint.outstanding, 1)
+            self.assertIsNot(self.pool.choose("llama3.2"), endpoint)
+        self.assertEqual(endpoint.outstanding, 0)
+        self.assertEqual(endpoint.loaded_models, {"llama3.2:latest"})
+
+    def test_ejection_after_consecutive_failures(self):
+        for _ in range(3):
+            self.fail_lease(self.a)
+        self.assertTrue(self.a.ejected)
+        self.assertEqual(self.a.outstanding, 0)
+        self.assertNotIn(self.a, [self.pool.choose("llama3.2") for _ in range(20)])
+        self.now += 30
+        self.assertFalse(self.a.ejected)
+
+    def test_client_errors_do_not_count(self):
+        error = requests.exceptions.HTTPError(response=http_response(404))
+        for _ in range(3):
+            self.fail_lease(self.a, error)
+        self.assertEqual(self.a.consecutive_failures, 0)
+
+    def test_fails_open_when_every_host_is_down(self):
+        for endpoint in (self.a, self.b, self.c):
+            for _ in range(3):
+                self.fail_lease(endpoint)
+            self.now += 1
+        self.assertIs(self.pool.choose("llama3.2"), self.a)  # Earliest back
+
+    def test_health_check_readmits_after_cool_down(self):
+        for _ in range(3):
+            self.fail_lease(self.a)
+        tags = json_response(200, {"models": [{"name": "llama3.2:latest"}]})
+        ps = json_response(200, {"models": [{"name": "llama3.2"}]})
+        with mock.patch('finance.services.ollama_pool.http_client.get', side_effect=[tags, ps] * 3) as get:
+            self.pool.check_all()
+            self.assertEqual({c.args[0].split('/api')[0] for c in get.call_args_list}, {"http://b", "http://c"})
+            self.now += 30
+            self.assertTrue(self.pool.check(self.a))
+        self.assertFalse(self.a.ejected)
+        self.assertEqual(self.a.consecutive_failures, 0)
+        self.assertEqual(self.a.loaded_models, {"llama3.2:latest"})
+
+    def test_failed_health_check_marks_unhealthy(self):
+        with mock.patch('finance.services.ollama_pool.http_client.get', side_effect=requests.exceptions.ConnectTimeout()):
+            self.assertFalse(self.pool.check(self.a))
+        self.assertFalse(self.a.healthy)
+        self.assertNotIn(self.a, [self.pool.choose("llama3.2") for _ in range(20)])
+
+
+class LLMCacheTests(SimpleTestCase):
+    payload = {"model": "llama3.2:1b", "options": {"temperature": 0}, "format": "json", "prompt": "Extract\n  this"}
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('finance.services.llm_cache.time.time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_cache_key(self):
+        key = cache_key(self.payload)
+        self.assertEqual(key, cache_key(dict(self.payload, prompt=" Extract this ", stream=True)))
+        self.assertNotEqual(key, cache_key(dict(self.payload, model="llama3.1:8b")))
+        self.assertNotEqual(key, cache_key(dict(self.payload, options={"temperature": 0.2})))
+        self.assertNotEqual(key, cache_key(dict(self.payload, images=[b"page"])))
+        self.assertEqual(cache_key(dict(self.payload, images=[b"page"])), cache_key(dict(self.payload, images=[b"page"])))
+
+    def test_memory_lru_and_ttl(self):
+        cache = LLMCache(max_entries=2, ttl=60)
+        for key in "abc":
+            cache.set(key, {"key": key})
+        self.assertEqual(cache.get("a"), (None, None))   # Evicted
+        self.assertEqual(cache.get("b"), ({"key": "b"}, 'memory'))
+        self.now += 61
+        self.assertEqual(cache.get("c"), (None, None))   # Expired
+        self.assertEqual(
+            {k: cache.metrics()[k] for k in ('stores', 'evictions', 'memory_hits', 'misses', 'expired', 'hit_rate')},
+            {'stores': 3, 'evictions': 1, 'memory_hits': 1, 'misses': 2, 'expired': 1, 'hit_rate': 0.333},
+        )
+
+    def test_disk_tier(self):
+        LLMCache(directory=self.directory, ttl=60).set("ab12", {"Total": "1"})
+        cache = LLMCache(directory=self.directory, ttl=60)   # New process
+        self.assertEqual(cache.get("ab12"), ({"Total": "1"}, 'disk'))
+        self.assertEqual(cache.get("ab12"), ({"Total": "1"}, 'memory'))
+
+        corrupt = cache._path("cd34")
+        os.makedirs(os.path.dirname(corrupt))
+        with open(corrupt, 'w') as f:
+            f.write("{not json")
+        self.assertEqual(cache.get("cd34"), (None, None))
+
+        self.now += 61
+        self.assertEqual(LLMCache(directory=self.directory, ttl=60).get("ab12"), (None, None))
+        self.assertFalse(os.path.exists(cache._path("ab12")))
+
+    def test_cached_result_is_bypassed_on_restart(self):
+        with mock.patch.object(ollama_service, 'llm_cache') as cache:
+            cache.get.return_value = ({"success": True}, 'disk')
+            self.assertEqual(ollama_service.cached_result(self.payload, use_cache=False), (None, None))
+            cache.get.assert_not_called()
+            key, value = ollama_service.cached_result(self.payload, use_cache=True)
+        self.assertEqual(key, cache_key(self.payload))
+        self.assertEqual(value, {"success": True, "cache": 'disk'})
+
+    def test_only_sound_extractions_are_cacheable(self):
+        self.assertTrue(ollama_service.cacheable(invoice(), []))
+        self.assertFalse(ollama_service.cacheable(invoice(), ['truncated']))
+        self.assertFalse(ollama_service.cacheable(invoice(Total="999"), ['trailing_comma']))
+        self.assertFalse(ollama_service.cacheable({"Items": []}, []))
+        # Chunk calls: only the checks their fields allow
+        items = {"Items": invoice()["Items"]}
+        self.assertTrue(ollama_service.cacheable(items, [], partial=True))
+        self.assertFalse(ollama_service.cacheable({"Subtotal": "50", **items}, [], partial=True))
+
+
+class PromptBudgetTests(SimpleTestCase):
+    header = "ACME TRADING LLC\nTAX INVOICE\nInvoice No: INV-1001\nDate: 01/02/2025\nPO: ATCPO25080595"
+    totals = "Subtotal 200.000\nVAT 5% 10.000\nTotal 210.000"
+    terms = "\n".join(f"Terms and conditions clause {n}: goods once sold are not returned, bank IBAN details apply"
+                      for n in range(12))
+
+    def test_normalize_whitespace(self):
+        text = "  Invoice \t No:   1 \n\n\n\nTotal  2\f\n  \f Page two "
+        self.assertEqual(normalize_whitespace(text), "Invoice No: 1\n\nTotal 2\fPage two")
+
+    def test_repeated_headers_and_footers(self):
+        pages = [
+            f"ACME TRADING LLC\nInvoice No: INV-1\nCement {n} 1.000 1.000\nSand {n} 1.000 1.000\nPage {n} of 3"
+            for n in (1, 2, 3)
+        ]
+        text, removed = remove_repeated_edges("\f".join(pages))
+        self.assertEqual(removed, 6)
+        self.assertEqual(text.count("ACME TRADING LLC"), 1)
+        self.assertEqual(text.count("Page"), 1)
+        # Item rows differing only in their numbers are not page furniture
+        self.assertEqual(text.count("Cement"), 3)
+
+    def test_under_budget_is_unchanged(self):
+        text = self.header + "\n\n" + self.totals
+        fitted, stats = build_invoice_text(text, 2000)
+        self.assertEqual(fitted, text)
+        self.assertEqual(stats['dropped_blocks'], 0)
+        self.assertEqual(build_invoice_text(text * 100, None)[1]['dropped_blocks'], 0)
+
+    def test_over_budget_keeps_relevant_blocks_in_order(self):
+        text = "\n\n".join([self.header, self.terms, self.totals])
+        budget = estimate_tokens(self.header + self.totals) + 10
+        fitted, stats = build_invoice_text(text, budget)
+        self.assertEqual(fitted, self.header + "\n\n" + self.totals)
+        self.assertLessEqual(stats['prompt_tokens'], budget)
+        self.assertEqual(stats['dropped_blocks'], 1)
+        self.assertGreater(stats['original_tokens'], budget)
+
+
+W = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+
+
+def word_part(body, root='w:document'):
+    inner = f"<w:body>{body}</w:body>" if root == 'w:document' else body
+    return f'<?xml version="1.0"?><{root} {W}>{inner}</{root}>'
+
+
+def paragraph(*runs):
+    return "<w:p>" + "".join(f"<w:r>{run}</w:r>" for run in runs) + "</w:p>"
+
+
+class DocxExtractionTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def docx(self, parts):
+        path = os.path.join(self.directory, "invoice.docx")
+        with zipfile.ZipFile(path, 'w') as archive:
+            for name, xml in parts.items():
+                archive.writestr(name, xml)
+        return path
+
+    def test_parts_paragraphs_and_tables(self):
+        cell = lambda text: f"<w:tc>{paragraph(f'<w:t>{text}</w:t>')}</w:tc>"
+        row = lambda *texts: "<w:tr>" + "".join(cell(t) for t in texts) + "</w:tr>"
+        body = (
+            paragraph("<w:t>Invoice No:</w:t>", "<w:tab/>", "<w:t>INV-1001</w:t>")
+            + paragraph("<w:t>Line one</w:t>", "<w:br/>", "<w:t>Line two</w:t>")
+            + paragraph()
+            + f"<w:tbl>{row('Cement', '2', '100.000')}{row('', '', '')}{row('Sand', '4', '100.000')}</w:tbl>"
+        )
+        path = self.docx({
+            'word/document.xml': word_part(body),
+            'word/header1.xml': word_part(paragraph("<w:t>ACME TRADING LLC</w:t>"), 'w:hdr'),
+            'word/footer1.xml': word_part(paragraph("<w:t>Thank you</w:t>"), 'w:ftr'),
+            'word/styles.xml': word_part("", 'w:styles'),
+        })
+        self.assertEqual(ollama_service.extract_document_text(path), "\n".join([
+            "ACME TRADING LLC",
+            "Invoice No:\tINV-1001",
+            "Line one\nLine two",
+            "Cement | 2 | 100.000",
+            "Sand | 4 | 100.000",
+            "Thank you",
+        ]))
+
+    def test_unreadable_docx(self):
+        path = os.path.join(self.directory, "broken.docx")
+        with open(path, 'wb') as f:
+            f.write(b"not a zip")
+        self.assertEqual(ollama_service.extract_text_from_docx(path), "")
+
+    def test_doc_goes_through_a_converter(self):
+        completed = mock.Mock(stdout=b"Invoice No: INV-1001")
+        with mock.patch('shutil.which', side_effect=lambda tool: "/usr/bin/catdoc" if tool == 'catdoc' else None), \
+                mock.patch('subprocess.run', return_value=completed) as run:
+            self.assertEqual(ollama_service.extract_document_text("old.DOC"), "Invoice No: INV-1001")
+        self.assertEqual(run.call_args.args[0], ["/usr/bin/catdoc", "old.DOC"])
+        with mock.patch('shutil.which', return_value=None):
+            self.assertEqual(ollama_service.extract_text_from_doc("old.doc"), "")
+
+    def test_word_documents_skip_n8n_and_ocr(self):
+        text = "Invoice No: INV-1001 " * 5
+        with mock.patch.object(ollama_service, 'extract_document_text', return_value=text), \
+                mock.patch.object(ollama_service, 'extract_with_routing', return_value={'success': True}) as routed, \
+                mock.patch.object(ollama_service, 'extract_invoice_via_n8n') as n8n, \
+                mock.patch.object(ollama_service, 'extract_text_via_ocr') as ocr:
+            self.assertEqual(ollama_service.extract_document("invoice.docx", use_cache=False), ({'success': True}, text))
+        routed.assert_called_once_with(text, "invoice.docx", False)
+        n8n.assert_not_called()
+        ocr.assert_not_called()
@@ -13,4 +13,6 @@ urlpatterns = [
     path('extraction/view/<int:task_id>/', views.view_extraction, name='view_extraction'),
     path('extraction/compare/<int:task_id>/', views.compare_with_axpert, name='compare_with_axpert'),
     path('extraction/push/<int:task_id>/', views.push_to_axpert, name='push_to_axpert'),
+    path('extraction/models/', views.model_status, name='model_status'),
+    path('extraction/trn-index/refresh/', views.refresh_trn_index, name='refresh_trn_index'),
 ]
@@ -4,7 +4,10 @@ from django.contrib import messages
 from django.http import JsonResponse
 from vendors.models import Submission
 from .models import ExtractionTask
-from .services.ollama_service import process_invoice
+from .services.ollama_service import (
+    process_invoice, model_warmer, concurrency_status, n8n_breaker, llm_cache, trn_index, layout_template_status,
+)
+from .services.http_client import client as http_client
 import json
 
 @login_required
@@ -111,7 +114,7 @@ def approve_submission(request, submission_id):
         import threading
         from django.db import connection
 
-        def run_extraction_background(task_id):
+        def run_extraction_background(task_id, use_cache=True):
             # This function runs in a thread
             # Create a new connection for this thread
             from .models import ExtractionTask
@@ -122,17 +125,9 @@ def approve_submission(request, submission_id):
                 # Re-import to avoid scope issues
                 from .services.ollama_service import process_invoice
                 
-                result = process_invoice(task.submission)
-                
-                if result['success']:
-                    task.status = 'completed'
-                    task.extracted_data = result['data']
-                    task.processing_time = result.get('processing_time', 0)
-                    task.model_used = result.get('model', task.model_used)
-                else:
-                    task.status = 'failed'
-                    task.error_log = result.get('error', 'Unknown error')
+                result = process_invoice(task.submission, use_cache=use_cache)
                 
+                task.apply_result(result)
                 task.save()
             except Exception as e:
                 print(f"Extraction thread error: {e}")
@@ -167,7 +162,8 @@ def approve_submission(request, submission_id):
             existing_task.error_log = ''
             existing_task.save()
             
-            thread = threading.Thread(target=run_extraction_background, args=(existing_task.id,))
+            # Re-extraction must not replay the cached results of the previous run
+            thread = threading.Thread(target=run_extraction_background, args=(existing_task.id, False))
             thread.daemon = True
             thread.start()
             
@@ -227,23 +223,22 @@ def start_extraction(request, task_id):
         messages.info(request, 'This extraction task has already been processed.')
         return redirect('finance:extraction_queue')
     
+    # A failed or stuck task is being re-run: ask the models again instead of
+    # replaying cached results of the previous attempt
+    use_cache = task.status == 'pending'
+
     # Update status to processing and clear previous errors
     task.status = 'processing'
     task.error_log = ''  # Clear previous errors (must be empty string, not None)
     task.save()
     
     # Process the invoice
-    result = process_invoice(task.submission)
+    result = process_invoice(task.submission, use_cache=use_cache)
     
+    task.apply_result(result)
     if result['success']:
-        task.status = 'completed'
-        task.extracted_data = result['data']
-        task.processing_time = result.get('processing_time', 0)
-        task.model_used = result.get('model', task.model_used)
         messages.success(request, 'Invoice extraction completed successfully!')
     else:
-        task.status = 'failed'
-        task.error_log = result.get('error', 'Unknown error')
         # Show a friendly message to the user, keep technical details in the task log
         messages.error(request, 'Extraction failed. Please review the error log on the task card.')
     
@@ -379,11 +374,62 @@ def push_to_axpert(request, task_id):
          return JsonResponse({'error': 'No extracted data found'}, status=400)
 
     # Import the service function
-    from .services.ollama_service import push_to_axpert_db
+    from .services.ollama_service import push_to_axpert_db, LAYOUT_TEMPLATES
+    import threading
     
     success, message = push_to_axpert_db(task.extracted_data)
     
     if success:
+        if LAYOUT_TEMPLATES:
+            # Accepted extraction: learn the vendor's layout for the template fast path
+            threading.Thread(target=learn_layout_background, args=(task.id,), daemon=True).start()
         return JsonResponse({'success': True, 'message': message})
     else:
         return JsonResponse({'success': False, 'error': message}, status=500)
+
+
+def learn_layout_background(task_id):
+    """Learn the vendor layout template from a pushed task's invoice (runs in a thread)"""
+    from django.db import connection
+    from core.storage import local_copy
+    from .models import ExtractionTask
+    from .services.ollama_service import learn_layout_template
+
+    try:
+        task = ExtractionTask.objects.get(id=task_id)
+        invoice_doc = task.submission.documents.filter(document_type='invoice').first()
+        if invoice_doc:
+            with local_copy(invoice_doc.file) as file_path:
+                learn_layout_template(file_path, task.extracted_data)
+    except Exception as e:
+        print(f"Layout learning error: {e}")
+    finally:
+        connection.close()
+
+
+@login_required
+def model_status(request):
+    """Load state and concurrency limit of the extraction models on each Ollama endpoint, plus per-host HTTP metrics (JSON)"""
+    if request.user.user_type != 'finance':
+        return JsonResponse({'error': 'Access denied'}, status=403)
+
+    status = model_warmer.status()
+    status['concurrency'] = concurrency_status()
+    status['n8n_circuit'] = n8n_breaker.status()
+    status['llm_cache'] = llm_cache.metrics()
+    status['http'] = http_client.metrics()
+    status['trn_index'] = trn_index.status()
+    status['layout_templates'] = layout_template_status()
+    return JsonResponse(status)
+
+
+@login_required
+def refresh_trn_index(request):
+    """Reload the branch TRN -> PO prefix index now (e.g. after adding a branch in Axpert)"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    if request.user.user_type != 'finance':
+        return JsonResponse({'error': 'Access denied'}, status=403)
+
+    success = trn_index.refresh()
+    return JsonResponse(dict(trn_index.status(), success=success), status=200 if success else 503)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -124,6 +125,32 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Document storage. All uploads and extraction reads go through this backend,
+# so extraction workers can run on other machines when a shared backend is used.
+STORAGES = {
+    'default': {
+        'BACKEND': 'core.storage.ShardedFileSystemStorage',
+    },
+    # S3-compatible alternative (AWS S3, or a local MinIO container for testing):
+    # 'default': {
+    #     'BACKEND': 'core.storage.S3CompatibleStorage',
+    #     'OPTIONS': {
+    #         'bucket_name': 'vendor-portal',
+    #         'endpoint_url': 'http://127.0.0.1:9000',
+    #         'access_key': 'minioadmin',
+    #         'secret_key': 'minioadmin',
+    #     },
+    # },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# Hand media transfers off to the front web server once access is checked.
+# None = Django streams the file, 'x-accel-redirect' = nginx, 'x-sendfile' = Apache
+MEDIA_ACCEL_REDIRECT = None
+MEDIA_ACCEL_PREFIX = '/protected-media/'  # nginx `internal` location aliased to MEDIA_ROOT
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -147,11 +174,104 @@ LOGOUT_REDIRECT_URL = 'login'
 # When set, the system will use n8n instead of Ollama
 N8N_WEBHOOK_URL = 'http://localhost:5678/webhook/invoice_extract'
 # N8N_WEBHOOK_URL = None  # Force direct Ollama usage to avoid n8n timeouts
+N8N_TIMEOUT = 300  # Seconds to wait for the webhook workflow
+# Circuit breaker: stop calling n8n (use direct Ollama) once half of the recent
+# calls failed or took longer than slow_call_seconds; probe again after open_seconds
+N8N_CIRCUIT_BREAKER = {
+    'window': 10,
+    'min_calls': 4,
+    'failure_rate': 0.5,
+    'slow_call_seconds': 90,
+    'open_seconds': 120,
+}
+# Hedging: when n8n has not answered by its recent p90 latency, race direct Ollama
+# on the OCR text and keep the first successful result
+HEDGE_N8N = True
+HEDGE_PERCENTILE = 90
+HEDGE_DEFAULT_DELAY = 60   # Seconds, used until ten n8n latencies are known
+HEDGE_MAX_INFLIGHT = 2     # Max concurrent hedged extractions sent to Ollama
 
 # Ollama Configuration (FALLBACK - only used if N8N_WEBHOOK_URL is None)
 # Running on custom port 11435
 OLLAMA_BASE_URL = 'http://127.0.0.1:11435'
 OLLAMA_MODEL = 'llama3.2:1b'  # Llama 3.2 (1B) - Fast and memory efficient
+# Complexity-based routing: smallest model first, escalate on failed validation
+OLLAMA_MODEL_TIERS = [OLLAMA_MODEL, 'llama3.1:8b']
+MODEL_ROUTING_THRESHOLDS = [2.0]   # Max complexity score per tier (last tier takes the rest)
+MODEL_ESCALATION = True
+# Re-extract n8n / vision / template results whose amounts do not add up
+# (qty x price, items vs Subtotal, Subtotal x VAT vs Total) with the routed models
+VALIDATION_REEXTRACT = True
+
+# All Ollama hosts serving extraction (defaults to [OLLAMA_BASE_URL]).
+# Requests go to the least-busy healthy host that has OLLAMA_MODEL.
+OLLAMA_ENDPOINTS = [OLLAMA_BASE_URL]
+OLLAMA_HEALTH_INTERVAL = 15        # Seconds between /api/tags + /api/ps health checks
+OLLAMA_EJECT_AFTER_FAILURES = 3    # Consecutive failures before a host is ejected
+OLLAMA_EJECT_SECONDS = 30          # Cool-down before an ejected host is re-checked
+# Background threads (model warm-up, TRN index preload) start only in processes
+# launched with FINANCE_BACKGROUND_WORKERS=1 in their environment: the runserver /
+# WSGI workers that serve extractions, never scripts, shells, tests or task workers
+FINANCE_BACKGROUND_WORKERS = os.environ.get('FINANCE_BACKGROUND_WORKERS', '').lower() in ('1', 'true', 'yes')
+# Pre-load OLLAMA_MODEL_TIERS on every host when a background worker starts
+# and keep them resident with keep_alive during working hours (local time, TIME_ZONE)
+OLLAMA_WARMUP_ON_STARTUP = True
+OLLAMA_KEEP_ALIVE = '2h'             # keep_alive sent during working hours
+OLLAMA_WORKING_HOURS = (7, 20)       # Start hour, end hour (exclusive)
+OLLAMA_WORKING_DAYS = (0, 1, 2, 3, 4, 5)  # Monday = 0
+OLLAMA_WARMUP_INTERVAL = 600         # Seconds between keep-alive refreshes
+OLLAMA_WARMUP_TIMEOUT = 300          # Seconds allowed for a cold model load
+# Adaptive (AIMD) limit on concurrent generate calls per Ollama host:
+# +1 while p95 latency holds, cut on p95 growth beyond `tolerance` x best p95 or on timeouts
+OLLAMA_CONCURRENCY = {
+    'initial': 2,
+    'minimum': 1,
+    'maximum': 8,
+    'window': 20,        # Completed calls per adjustment
+    'tolerance': 1.5,
+}
+OLLAMA_STREAMING = True           # Stream tokens; stop/abort early on JSON close or schema divergence
+OLLAMA_STREAM_IDLE_TIMEOUT = 60   # Max seconds between streamed tokens
+OLLAMA_STREAM_MAX_CHARS = 200000  # Abort runaway output past this size (long item lists stay well under it)
+OLLAMA_OUTPUT_FORMAT = 'schema'   # 'schema' (constrained to EXTRACTION_PROMPT schema), 'json', or None
+# Vision models (llava/moondream): images are downscaled and re-encoded before upload,
+# PDFs are sent as rendered pages (needs Pillow + pdf2image)
+VISION_MAX_SIDE = 1344               # Longest side in pixels
+VISION_JPEG_QUALITY = 85
+VISION_MAX_PAGES = 3                 # PDF pages sent to the vision model
+VISION_PDF_DPI = 150
+LLM_CACHE_ENABLED = True             # Reuse results for byte-identical prompts (retries, re-runs)
+LLM_CACHE_MAX_ENTRIES = 256          # In-memory LRU tier
+LLM_CACHE_DIR = BASE_DIR / 'cache' / 'llm'   # Disk tier (None = memory only)
+LLM_CACHE_TTL = 7 * 24 * 3600        # Seconds
+PROMPT_TOKEN_BUDGET = 2000        # Max estimated tokens of OCR text per prompt (None = unlimited)
+# Map-reduce extraction for long item tables (>= CHUNK_MIN_ITEMS item lines or over budget):
+# header fields once, items from overlapping chunks in parallel, merged in order
+CHUNKED_EXTRACTION = True
+CHUNK_MIN_ITEMS = 25
+CHUNK_TOKENS = 800                # Estimated tokens of text per item chunk
+CHUNK_OVERLAP_LINES = 3           # Lines repeated between consecutive chunks
+CHUNK_WORKERS = 4                 # Chunks extracted in parallel
+# Vendor layout templates: recurring layouts are extracted from anchored regions of the
+# OCR word boxes without an LLM call (learned when an extraction is pushed to Axpert)
+LAYOUT_TEMPLATES = True
+LAYOUT_TEMPLATE_MIN_SAMPLES = 2   # Accepted invoices before a template is used
+LAYOUT_TEMPLATE_MATCH = 0.7       # Share of the template's static words that must match
+
+# Inward submissions: extract the Delivery Order and Purchase Order in parallel
+# with the invoice and reconcile them into one record
+INWARD_PARALLEL_EXTRACTION = True
+RECONCILIATION_TOLERANCE = 0.01  # 1% allowed difference on totals
+
+# Split PDFs that contain several scanned invoices and extract each in parallel
+MULTI_INVOICE_SPLITTING = True
+MAX_SPLIT_WORKERS = 4
+
+# Shared HTTP client for Ollama / n8n (keep-alive pools, bounded retries)
+LLM_HTTP_POOL_SIZE = 10       # Keep-alive connections per backend host
+LLM_HTTP_MAX_RETRIES = 2      # Extra attempts for retryable failures
+LLM_HTTP_BACKOFF_BASE = 0.5   # Seconds; full-jitter exponential backoff
+LLM_HTTP_BACKOFF_MAX = 8.0
 
 # ============================================================================
 # Optional: OCR Support (for scanned documents)
@@ -239,6 +359,9 @@ TESSERACT_PATH = r"C:\Users\ITS38\AppData\Local\Programs\Tesseract-OCR\tesseract
 ORACLE_USER = "ADK2011"
 ORACLE_PASSWORD = "log"
 ORACLE_DSN = "172.16.1.85:1521/orcl"
+TRN_INDEX_PRELOAD = True             # Load branch TRN -> PO prefix index when a background worker starts
+TRN_INDEX_REFRESH = 3600             # Seconds between index reloads
+TRN_INDEX_NEGATIVE_TTL = 300         # Seconds an unknown TRN is cached as missing
 
 # ============================================================================
 # INTEGRATION CONFIGURATION
@@ -18,13 +18,15 @@ from django.contrib import admin
 from django.urls import path
 
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
+from core.views import serve_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('core.urls')),
     path('vendors/', include('vendors.urls')),
     path('finance/', include('finance.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    # Access-controlled media with Range / ETag / conditional GET support
+    re_path(r'^%s(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'), serve_media, name='serve_media'),
+]